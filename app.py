@@ -1,155 +1,46 @@
-import streamlit as st
-from pptx import Presentation
-from pptx.util import Inches, Pt
-from pptx.dml.color import RGBColor
-from pptx.enum.text import PP_ALIGN
-from pptx.enum.shapes import MSO_SHAPE
-import io
+import os
 import json
-import base64
-import requests
-from openai import OpenAI
-from PIL import Image  # 用于处理超大图片压缩
+import time
+import threading
 
-# ==========================================
-# 🔑 密钥配置区 (使用 Streamlit Secrets 保护)
-# ==========================================
-BAIDU_API_KEY = st.secrets["BAIDU_API_KEY"]
-BAIDU_SECRET_KEY = st.secrets["BAIDU_SECRET_KEY"]
-DEEPSEEK_API_KEY = st.secrets["DEEPSEEK_API_KEY"]
+import streamlit as st
 
-# ==========================================
-# 1. 百度 OCR 图片识别模块 (包含超大图防崩溃压缩)
-# ==========================================
-def get_baidu_access_token():
-    url = f"https://aip.baidubce.com/oauth/2.0/token?grant_type=client_credentials&client_id={BAIDU_API_KEY}&client_secret={BAIDU_SECRET_KEY}"
-    headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
-    response = requests.request("POST", url, headers=headers, data="")
-    return response.json().get("access_token")
+from settings import Settings
+from jobs import JobManager
+from ocr import join_ocr_pages
+from extraction import FAILED_CHUNKS_KEY, REASONER_MODEL, diff_case_fields, normalize_case
+from pipeline import CasePipeline
+from tracing import start_run, record_duration
 
-def perform_ocr(image_bytes, access_token):
-    try:
-        # 基础防崩溃压缩：仅当图片真的大于 3.5MB 时，才做轻微的体积压缩
-        if len(image_bytes) > 3.5 * 1024 * 1024:
-            img = Image.open(io.BytesIO(image_bytes))
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            output = io.BytesIO()
-            # 仅降低一点保存质量，不改变长宽，防止摩尔纹扭曲
-            img.save(output, format="JPEG", quality=70) 
-            image_bytes = output.getvalue()
-
-        url = "https://aip.baidubce.com/rest/2.0/ocr/v1/accurate_basic?access_token=" + access_token
-        img_base64 = base64.b64encode(image_bytes).decode('utf-8')
-        payload = {'image': img_base64}
-        headers = {'Content-Type': 'application/x-www-form-urlencoded', 'Accept': 'application/json'}
-        response = requests.request("POST", url, headers=headers, data=payload)
-        result_json = response.json()
-        
-        if "words_result" in result_json:
-            text_list = [item["words"] for item in result_json["words_result"]]
-            return "\n".join(text_list)
-        else:
-            return f"[识别错误: {result_json.get('error_msg', '未知错误')}]"
-    except Exception as e:
-        return f"[请求异常: {str(e)}]"
+# 整页脚本每次交互都会重跑一遍，页尾把这次 rerun 的耗时记为 app.rerun，用来确认输入、点击是否跟手
+_rerun_started = time.perf_counter()
 
 # ==========================================
-# 2. AI 结构化提取模块 (学术级深度总结 + 严谨分线)
+# 🔑 密钥配置区 (使用 Streamlit Secrets 保护)
 # ==========================================
-def extract_complex_case(patient_text):
-    client = OpenAI(
-        api_key=DEEPSEEK_API_KEY, 
-        base_url="https://api.deepseek.com"
-    )
-    
-    # 【优化核心】：放权临床推理，锁死输出接口
-    system_prompt = """
-    你是一位顶级的肿瘤内科专家，正在梳理一份复杂的临床病历，准备进行高水平的学术会议汇报（如胃肠肿瘤或妇科肿瘤领域的病例探讨）。
-    
-    【核心任务与自由度】
-    1. 自由梳理逻辑：请发挥你的专业临床判断力，自主分析患者的疾病进展时间轴。你来决定如何划分治疗线数（一线、二线、维持治疗等），并准确判断不同阶段的疗效转归（PR/SD/PD 等）。
-    2. 深度医学提炼：不要单纯当一个“文字搬运工”。请计算关键生存指标，评估治疗策略的得失，敏锐捕捉病程中的矛盾点或亮点（例如：特定靶向药跨线使用的疗效、某种耐药机制的出现等）。
-    
-    【系统接口规范（极度重要）】
-    为了对接下游的 PPT 自动渲染系统，你**必须且只能**输出一个标准的 JSON 对象。
-    严禁改变以下任何一个键名（Key），你可以根据你的临床推理自由填充对应的值（Value）：
-    
-    ```json
-    {
-        "cover": {"title": "晚期XXX癌综合治疗病例汇报"},
-        "baseline": {
-            "patient_info": "患者姓名(姓氏)、性别、年龄",
-            "chief_complaint": "主诉",
-            "diagnosis": "完整的临床及病理诊断",
-            "key_exams": "关键基线检查"
-        },
-        "treatments": [
-            {
-                "phase": "阶段名称（由你自主判断，如：一线治疗 / 维持治疗）", 
-                "duration": "具体时间段", 
-                "regimen": "完整的用药方案及局部治疗手段", 
-                "imaging": "影像学评估结果",
-                "markers": "肿瘤标志物变化"
-            }
-        ],
-        "current_admission": {
-            "exams": ["检验异常指标1", "检验异常指标2"],
-            "imaging": "本次核心影像结论",
-            "plan": ["后续治疗计划或考量1", "考量2"]
-        },
-        "timeline_events": [
-            {
-                "date": "年月", 
-                "phase": "线数或阶段",
-                "event_type": "Treatment 或 Evaluation",
-                "event": "高度凝练的事件短语"
-            }
-        ],
-        "summary": {
-            "highlights": [
-                "由你提炼的病例亮点1", 
-                "由你提炼的病例亮点2"
-            ],
-            "discussion": [
-                "值得探讨的临床深度问题1",
-                "值得探讨的临床深度问题2"
-            ]
-        }
-    }
-    ```
-    """
-    
-    response = client.chat.completions.create(
-        model="deepseek-reasoner",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": patient_text}
-        ]
-        # 注意：移除了 response_format，因为 reasoner 模型不支持强制 JSON 模式
-    )
-    
-    # 获取模型的最终输出内容（忽略前面冗长的 <think> 推理过程）
-    raw_content = response.choices[0].message.content
-    
-    # 增加鲁棒性清洗：确保去除 Markdown 的代码块标记，提取纯 JSON 字符串
+# 业务模块不直接读取 st.secrets：这里统一把 secrets 转成 Settings 交给 CasePipeline
+def _read_secrets():
+    # 用回放后端离线运行时可以没有 secrets.toml
     try:
-        # 去除可能包含的 ```json 和 ``` 标记
-        if "```json" in raw_content:
-            json_str = raw_content.split("```json")[1].split("```")[0].strip()
-        elif "```" in raw_content:
-            json_str = raw_content.split("```")[1].split("```")[0].strip()
-        else:
-            json_str = raw_content.strip()
-            
-        return json.loads(json_str)
-        
-    except json.JSONDecodeError as e:
-        # 如果模型偶尔没有严格遵守 JSON 格式，返回友好的报错信息
-        raise ValueError(f"AI 生成的数据无法解析为 JSON，请重试。原始返回摘要：{raw_content[:100]}...")
+        return {key: st.secrets[key] for key in st.secrets}
+    except FileNotFoundError:
+        return {}
+
+@st.cache_resource
+def get_pipeline():
+    # cache_resource 保证所有会话、所有 rerun 共用同一套 token、缓存与客户端；同名环境变量优先于 secrets
+    pipeline = CasePipeline(Settings.from_mapping(_read_secrets(), os.environ))
+    # python-pptx / openai 等重型依赖在后台线程预热：页面先渲染出来，首次生成时也不必再等导入
+    threading.Thread(target=pipeline.warm_up, name="warm-up", daemon=True).start()
+    return pipeline
+
+@st.cache_resource
+def get_job_manager():
+    settings = get_pipeline().settings
+    return JobManager(settings.job_max_workers, settings.job_result_ttl_minutes * 60)
 
 # ==========================================
-# 3. 网页端 Markdown 逻辑流生成器 (备用Cheat Sheet)
+# 1. 网页端 Markdown 逻辑流生成器 (备用Cheat Sheet)
 # ==========================================
 def render_logic_line_markdown(data):
     """将 JSON 转化为一目了然的 Markdown 病例逻辑流"""
@@ -178,288 +69,343 @@ def render_logic_line_markdown(data):
         
     return "\n".join(lines)
 
+def render_prep_stats_markdown(pages):
+    """逐页展示预处理前后的体积，方便确认上传负载到底省了多少"""
+    lines = ["| 页码 | 原图 | 实际发送 | 节省 | 编码 / 尺寸 |", "| --- | --- | --- | --- | --- |"]
+    total_orig = total_sent = 0
+    for i, page in enumerate(pages):
+        prep = page.get("prep")
+        if not prep:
+            note = "命中缓存，未上传" if page.get("cached") else "未预处理（原样发送）"
+            lines.append(f"| {i+1} | - | - | - | {note} |")
+            continue
+        saved = prep["orig_bytes"] - prep["sent_bytes"]
+        total_orig += prep["orig_bytes"]
+        total_sent += prep["sent_bytes"]
+        ratio = saved / prep["orig_bytes"] * 100 if prep["orig_bytes"] else 0
+        lines.append(
+            f"| {i+1} | {prep['orig_bytes'] / 1024:.0f} KB | {prep['sent_bytes'] / 1024:.0f} KB | "
+            f"{saved / 1024:.0f} KB ({ratio:.0f}%) | {prep['format']} {prep['size'][0]}×{prep['size'][1]} |"
+        )
+    if total_orig:
+        lines.append(f"\n合计：{total_orig / 1024:.0f} KB → {total_sent / 1024:.0f} KB")
+    return "\n".join(lines)
+
+CASE_SECTION_NAMES = {
+    "cover": "封面",
+    "baseline": "基线资料",
+    "treatments": "治疗经过",
+    "current_admission": "本次入院",
+    "timeline_events": "时间轴",
+    "summary": "总结",
+}
+
+def _short(value, limit=80):
+    if value is None:
+        return "（无）"
+    if isinstance(value, str):
+        text = value
+    elif isinstance(value, list):
+        text = "；".join(v if isinstance(v, str) else json.dumps(v, ensure_ascii=False) for v in value)
+    else:
+        text = json.dumps(value, ensure_ascii=False)
+    text = text.replace("|", "｜").replace("\n", " ")
+    return text if len(text) <= limit else text[:limit] + "…"
+
+def render_case_diff_markdown(changes):
+    """快速草稿与深度推理结果的字段差异表"""
+    if not changes:
+        return "两版内容一致。"
+    lines = ["| 字段 | 快速草稿 | 深度推理 |", "| --- | --- | --- |"]
+    for path, draft_value, final_value in changes:
+        section, _, rest = path.partition(".")
+        head, bracket, index = section.partition("[")
+        label = CASE_SECTION_NAMES.get(head, head) + (f" #{int(index.rstrip(']')) + 1}" if bracket else "")
+        lines.append(f"| {label} {rest} | {_short(draft_value)} | {_short(final_value)} |")
+    return "\n".join(lines)
+
+COMPACTION_STEP_NAMES = {
+    "boilerplate": "页码/打印时间/签名等样板行",
+    "near_duplicate": "重复截图中的重复段落",
+    "header_footer": "每页重复的医院抬头、患者信息栏与页脚",
+    "page_overlap": "相邻截图的重叠行",
+    "page_marker": "分页标记",
+}
+
+SPAN_NAMES = {
+    "baidu.token_fetch": "获取百度 token",
+    "ocr.preprocess": "图片预处理",
+    "ocr.request": "OCR 识别请求",
+    "pipeline.ocr": "批量 OCR（整体）",
+    "pipeline.compact": "病史文本压缩",
+    "pipeline.extract": "AI 解析（整体）",
+    "llm.completion": "AI 接口调用",
+    "llm.parse_json": "JSON 解析与校验",
+    "pipeline.marker_trends": "标志物趋势提取",
+    "pipeline.build": "PPT 排版（整体）",
+    "ppt.restore_slides": "复用缓存的幻灯片",
+    "ppt.save": "PPT 保存",
+}
+
+def render_trace_markdown(trace):
+    """单次运行的耗时分解表：各阶段次数、累计/最长耗时，并列出 OCR 上传量与 AI token 用量"""
+    lines = [f"总耗时 **{trace['seconds']:.2f} 秒**（并发阶段的耗时会重叠，占比之和可能超过 100%）\n",
+             "| 阶段 | 次数 | 累计耗时 | 最长一次 | 占比 |", "| --- | --- | --- | --- | --- |"]
+    for stage in trace["stages"]:
+        name = SPAN_NAMES.get(stage["name"], stage["name"].removeprefix("ppt."))
+        errors = f"（失败 {stage['errors']}）" if stage["errors"] else ""
+        share = stage["seconds"] / trace["seconds"] if trace["seconds"] else 0
+        lines.append(f"| {name}{errors} | {stage['count']} | {stage['seconds'] * 1000:.0f} ms | "
+                     f"{stage['max'] * 1000:.0f} ms | {share:.0%} |")
+    totals = trace["totals"]
+    if "payload_bytes" in totals:
+        lines.append(f"\n- OCR 实际上传：{totals['payload_bytes'] / 1024:.0f} KB")
+    if "prompt_tokens" in totals:
+        lines.append(f"- AI token 用量：输入 {totals['prompt_tokens']}，输出 {totals.get('completion_tokens', 0)}"
+                     f"（其中推理 {totals.get('reasoning_tokens', 0)}）")
+    return "\n".join(lines)
+
+def render_compaction_markdown(compaction):
+    """文本压缩明细：各步骤删除行数 + 被删内容示例，方便核对没有误删临床信息"""
+    lines = [f"- {COMPACTION_STEP_NAMES.get(step, step)}：{count} 行" for step, count in compaction["removed"].items()]
+    if compaction["samples"]:
+        lines.append("\n被删除内容示例：")
+        lines.extend(f"- `{sample}`" for sample in compaction["samples"])
+    return "\n".join(lines)
+
 # ==========================================
-# 4. PPT 生成模块
+# 2. 后台任务 (在 JobManager 的工作线程中执行，不能调用 st.*)
 # ==========================================
-class AdvancedPPTMaker:
-    def __init__(self, data):
-        self.prs = Presentation()
-        self.prs.slide_width = Inches(13.333) 
-        self.prs.slide_height = Inches(7.5)
-        self.data = self.clean_data(data)
-        self.C_PRI = RGBColor(115, 21, 40)   
-        self.C_ACC = RGBColor(0, 51, 102)  
-
-    def clean_data(self, data):
-        has_surgery = False
-        full_text = json.dumps(data, ensure_ascii=False)
-        if "根治术" in full_text or "切除术" in full_text or "手术切除" in full_text:
-            has_surgery = True
-            
-        if not has_surgery:
-            for tx in data.get("treatments", []):
-                if "辅助" in tx.get("phase", ""):
-                    tx["phase"] = "一线治疗" 
-            for evt in data.get("timeline_events", []):
-                if "辅助" in evt.get("phase", ""):
-                    evt["phase"] = "一线"
-        return data
-
-    def add_header(self, slide, text):
-        shape = slide.shapes.add_shape(MSO_SHAPE.RECTANGLE, 0, 0, Inches(13.33), Inches(0.9))
-        shape.fill.solid()
-        shape.fill.fore_color.rgb = self.C_PRI
-        shape.line.fill.background()
-        tb = slide.shapes.add_textbox(Inches(0.5), Inches(0.05), Inches(10), Inches(0.8))
-        p = tb.text_frame.paragraphs[0]
-        p.text = text
-        p.font.size = Pt(28)
-        p.font.bold = True
-        p.font.color.rgb = RGBColor(255, 255, 255)
-
-    def make_cover(self):
-        slide = self.prs.slides.add_slide(self.prs.slide_layouts[6])
-        shape = slide.shapes.add_shape(MSO_SHAPE.RECTANGLE, 0, 0, Inches(13.33), Inches(7.5))
-        shape.fill.solid()
-        shape.fill.fore_color.rgb = self.C_PRI
-        tb = slide.shapes.add_textbox(Inches(1.5), Inches(3), Inches(10), Inches(2))
-        p = tb.text_frame.paragraphs[0]
-        p.text = self.data.get("cover", {}).get("title", "病例汇报")
-        p.font.size = Pt(48)
-        p.font.bold = True
-        p.font.color.rgb = RGBColor(255, 255, 255)
-        p.alignment = PP_ALIGN.CENTER
-
-    def make_baseline(self):
-        slide = self.prs.slides.add_slide(self.prs.slide_layouts[6])
-        self.add_header(slide, "病例介绍 (基线资料)")
-        base_data = self.data.get("baseline", {})
-        content = f"【患者信息】 {base_data.get('patient_info', '')}\n\n" \
-                  f"【主诉】 {base_data.get('chief_complaint', '')}\n\n" \
-                  f"【临床诊断】\n{base_data.get('diagnosis', '')}\n\n" \
-                  f"【关键检查/病理】\n{base_data.get('key_exams', '')}"
-        tb = slide.shapes.add_textbox(Inches(0.8), Inches(1.2), Inches(11.5), Inches(6))
-        tf = tb.text_frame
-        tf.word_wrap = True
-        p = tf.paragraphs[0]
-        p.text = content
-        p.font.size = Pt(20) 
-        
-    def make_treatments(self):
-        for tx in self.data.get("treatments", []):
-            phase_name = tx.get('phase', '阶段治疗')
-            if "辅助" in phase_name and len(tx.get('regimen', '')) < 5:
-                continue
-            slide = self.prs.slides.add_slide(self.prs.slide_layouts[6])
-            self.add_header(slide, f"治疗经过：{phase_name}")
-            tb = slide.shapes.add_textbox(Inches(0.8), Inches(1.2), Inches(11.5), Inches(6))
-            tf = tb.text_frame
-            tf.word_wrap = True 
-            p1 = tf.paragraphs[0]
-            p1.text = f"【治疗时间】 {tx.get('duration', '')}"
-            p1.font.size = Pt(20) 
-            p1.font.bold = True
-            p1.font.color.rgb = self.C_PRI
-            p2 = tf.add_paragraph()
-            p2.text = f"\n【用药方案及局部治疗】\n{tx.get('regimen', '')}"
-            p2.font.size = Pt(16) 
-            p3 = tf.add_paragraph()
-            p3.text = f"\n【影像学评估】\n{tx.get('imaging', '')}"
-            p3.font.size = Pt(16) 
-            p3.font.color.rgb = RGBColor(50, 50, 50)
-            p4 = tf.add_paragraph()
-            p4.text = f"\n【肿瘤标志物】\n{tx.get('markers', '')}"
-            p4.font.size = Pt(16) 
-            p4.font.color.rgb = self.C_ACC
-
-    def make_current_admission(self):
-        adm_data = self.data.get("current_admission")
-        if not adm_data: return
-        exams_list = adm_data.get("exams", [])
-        exams_str = "\n".join([f"• {item}" for item in exams_list]) if isinstance(exams_list, list) else str(exams_list)
-        imaging_str = adm_data.get("imaging", "")
-        plan_list = adm_data.get("plan", [])
-        plan_str = "\n".join([f"• {item}" for item in plan_list]) if isinstance(plan_list, list) else str(plan_list)
-        total_len = len(exams_str) + len(imaging_str) + len(plan_str)
-        is_split = len(plan_str) > 200 or total_len > 500
-        
-        if is_split:
-            slide1 = self.prs.slides.add_slide(self.prs.slide_layouts[6])
-            self.add_header(slide1, "本次入院评估 (1/2)")
-            tb1 = slide1.shapes.add_textbox(Inches(0.8), Inches(1.2), Inches(11.5), Inches(5.5))
-            tf1 = tb1.text_frame
-            p_ex_title = tf1.paragraphs[0]
-            p_ex_title.text = "【入院检验指标】"
-            p_ex_title.font.bold = True
-            p_ex_title.font.size = Pt(20)
-            p_ex_title.font.color.rgb = self.C_PRI
-            p_ex_body = tf1.add_paragraph()
-            p_ex_body.text = exams_str + "\n"
-            p_ex_body.font.size = Pt(18)
-            p_im_title = tf1.add_paragraph()
-            p_im_title.text = "【影像学评估】"
-            p_im_title.font.bold = True
-            p_im_title.font.size = Pt(20)
-            p_im_title.font.color.rgb = self.C_PRI
-            p_im_body = tf1.add_paragraph()
-            p_im_body.text = imaging_str
-            p_im_body.font.size = Pt(18)
-            
-            slide2 = self.prs.slides.add_slide(self.prs.slide_layouts[6])
-            self.add_header(slide2, "后续治疗与随访计划 (2/2)")
-            tb2 = slide2.shapes.add_textbox(Inches(0.8), Inches(1.2), Inches(11.5), Inches(5.5))
-            tf2 = tb2.text_frame
-            p_pl_title = tf2.paragraphs[0]
-            p_pl_title.text = "【治疗与随访计划】"
-            p_pl_title.font.bold = True
-            p_pl_title.font.size = Pt(20)
-            p_pl_title.font.color.rgb = self.C_PRI
-            p_pl_body = tf2.add_paragraph()
-            p_pl_body.text = plan_str
-            p_pl_body.font.size = Pt(18)
-        else:
-            slide = self.prs.slides.add_slide(self.prs.slide_layouts[6])
-            self.add_header(slide, "本次入院评估及计划 (转归)")
-            tb = slide.shapes.add_textbox(Inches(0.8), Inches(1.2), Inches(11.5), Inches(6))
-            tf = tb.text_frame
-            content = f"【入院检验指标】\n{exams_str}\n\n【影像学评估】\n{imaging_str}\n\n【后续计划】\n{plan_str}"
-            p = tf.paragraphs[0]
-            p.text = content
-            p.font.size = Pt(16)
-
-    def make_timeline(self):
-        events = self.data.get("timeline_events", [])
-        if not events: return
-        slide = self.prs.slides.add_slide(self.prs.slide_layouts[6])
-        self.add_header(slide, "全病程时间轴概览 (Timeline)")
-        line_y = Inches(4.2)
-        start_x = Inches(0.6)
-        total_width = 12.1 
-        count = min(len(events), 12)
-        if count > 9:
-            card_width = Inches(0.95); card_height = Inches(1.4); font_size_date = Pt(9); font_size_body = Pt(8)
-        elif count > 6:
-            card_width = Inches(1.3); card_height = Inches(1.2); font_size_date = Pt(10); font_size_body = Pt(9)
-        else:
-            card_width = Inches(1.6); card_height = Inches(1.2); font_size_date = Pt(12); font_size_body = Pt(11)
+def ocr_job(update, pipeline, images):
+    """后台任务：批量 OCR，返回 {页码下标: 单页结果}；耗时分解通过 update(trace=...) 交给页面"""
+    update(stage="正在呼叫百度高精度 OCR 引擎扫描所有图片...")
+    run = None
+    try:
+        with start_run("job.ocr", pages=len(images)) as run:
+            if not pipeline.ocr_backend.ready():
+                raise RuntimeError("获取百度 API 授权失败，请检查密钥。")
+            done = []
+            def on_page_done(idx, page):
+                done.append(idx)
+                status = "✅" if page["ok"] else "⚠️"
+                update(progress=len(done) / len(images), stage=f"{status} 第 {idx+1} 页完成（{len(done)}/{len(images)}）")
+            pages = pipeline.ocr(images, on_page_done=on_page_done)
+    finally:
+        # 出错的运行也保留耗时分解，便于定位卡在哪一步
+        if run is not None:
+            update(trace=run.breakdown())
+    return pages
 
-        main_line = slide.shapes.add_shape(MSO_SHAPE.RIGHT_ARROW, start_x - Inches(0.2), line_y - Inches(0.05), Inches(total_width + 0.4), Inches(0.1))
-        main_line.fill.solid()
-        main_line.fill.fore_color.rgb = RGBColor(220, 220, 220) 
-        main_line.line.fill.background()
-        
-        for i, evt in enumerate(events[:12]): 
-            if count > 1: x = start_x + Inches(total_width * (i / (count - 1)))
-            else: x = start_x + Inches(total_width / 2)
-            event_text = evt.get("event", "")
-            phase_text = evt.get("phase", "") 
-            event_type = evt.get("event_type", "Treatment")
-            is_pd = "进展" in event_text or "PD" in event_text.upper() or "复发" in event_text
-            is_control = "PR" in event_text.upper() or "SD" in event_text.upper() or "缩小" in event_text
-            if is_pd: node_color = RGBColor(220, 50, 50) 
-            elif is_control and event_type == "Evaluation": node_color = RGBColor(46, 139, 87) 
-            else: node_color = self.C_PRI 
-            
-            stem_height = Inches(1.0)
-            stem_top = line_y - stem_height if i % 2 == 0 else line_y
-            stem = slide.shapes.add_shape(MSO_SHAPE.RECTANGLE, x, stem_top, Inches(0.03), stem_height) 
-            stem.fill.solid()
-            stem.fill.fore_color.rgb = node_color
-            stem.line.fill.background()
-            circle = slide.shapes.add_shape(MSO_SHAPE.OVAL, x - Inches(0.15), line_y - Inches(0.15), Inches(0.3), Inches(0.3))
-            circle.fill.solid()
-            circle.fill.fore_color.rgb = node_color
-            circle.line.color.rgb = RGBColor(255, 255, 255); circle.line.width = Pt(2)
-            
-            card_top = line_y - stem_height - card_height if i % 2 == 0 else line_y + stem_height
-            card_x = x - (card_width / 2)
-            card = slide.shapes.add_shape(MSO_SHAPE.ROUNDED_RECTANGLE, card_x, card_top, card_width, card_height)
-            card.fill.solid()
-            card.fill.fore_color.rgb = RGBColor(250, 250, 250) 
-            card.line.color.rgb = node_color; card.line.width = Pt(1.5)
-            tf = card.text_frame
-            tf.word_wrap = True
-            tf.margin_left = Inches(0.05); tf.margin_right = Inches(0.05); tf.margin_top = Inches(0.05)
-            p0 = tf.paragraphs[0]
-            p0.text = evt.get("date", "")
-            p0.font.bold = True; p0.font.size = font_size_date; p0.font.color.rgb = node_color; p0.alignment = PP_ALIGN.CENTER
-            
-            if phase_text and phase_text != "评估":
-                p_phase = tf.add_paragraph()
-                p_phase.text = f"【{phase_text}】"
-                p_phase.font.size = font_size_body; p_phase.font.bold = True; p_phase.font.color.rgb = node_color; p_phase.alignment = PP_ALIGN.CENTER
-            elif event_type == "Evaluation":
-                p_phase = tf.add_paragraph()
-                p_phase.text = "【疗效评估】"
-                p_phase.font.size = font_size_body; p_phase.font.bold = True; p_phase.font.color.rgb = node_color; p_phase.alignment = PP_ALIGN.CENTER
-            p1 = tf.add_paragraph()
-            p1.text = event_text
-            p1.font.size = font_size_body; p1.font.color.rgb = RGBColor(30, 30, 30); p1.alignment = PP_ALIGN.CENTER
-
-    def make_summary(self):
-        slide = self.prs.slides.add_slide(self.prs.slide_layouts[6])
-        self.add_header(slide, "病例思考与总结")
-        summary_data = self.data.get("summary", {})
-        highlights = []
-        discussion = []
-        if isinstance(summary_data, list):
-            highlights = summary_data
-        elif isinstance(summary_data, dict):
-            highlights = summary_data.get("highlights", [])
-            discussion = summary_data.get("discussion", [])
-
-        top_box = slide.shapes.add_textbox(Inches(0.8), Inches(1.3), Inches(11.5), Inches(3.0))
-        tf_top = top_box.text_frame
-        tf_top.word_wrap = True
-        
-        for item in highlights:
-            p = tf_top.add_paragraph()
-            p.text = f"• {item}"
-            p.font.size = Pt(22) 
-            p.font.bold = True
-            p.space_after = Pt(18)
-            
-        line = slide.shapes.add_shape(MSO_SHAPE.RECTANGLE, Inches(0.8), Inches(4.3), Inches(11.5), Inches(0.03))
-        line.fill.solid()
-        line.fill.fore_color.rgb = self.C_PRI 
-        line.line.fill.background()
-
-        if discussion:
-            bottom_box = slide.shapes.add_textbox(Inches(0.8), Inches(4.5), Inches(11.5), Inches(2.8))
-            tf_bottom = bottom_box.text_frame
-            tf_bottom.word_wrap = True
-            p_title = tf_bottom.paragraphs[0]
-            p_title.text = "思考："
-            p_title.font.size = Pt(22)
-            p_title.font.bold = True
-            p_title.font.color.rgb = RGBColor(0, 0, 0)
-            p_title.space_after = Pt(12)
-            
-            for item in discussion:
-                p = tf_bottom.add_paragraph()
-                p.text = f"➤ {item}" 
-                p.font.size = Pt(20)
-                p.font.bold = True
-                p.space_after = Pt(14)
-
-    def build(self):
-        self.make_cover()
-        self.make_baseline()
-        self.make_treatments()
-        self.make_current_admission()
-        self.make_timeline()
-        self.make_summary()
-        ppt_stream = io.BytesIO()
-        self.prs.save(ppt_stream)
-        ppt_stream.seek(0)
-        return ppt_stream
+def generate_job(update, pipeline, patient_text, options):
+    """
+    后台任务：AI 解析 + PPT 排版。options 为提交时刻的侧栏设置（live_preview / long_record_mode / force / speculative）。
+    开启快速草稿时，草稿 PPT 先通过 update(draft=...) 交给页面，reasoner 完成后由最终结果取代。
+    返回 {"case_json", "ppt_bytes", "from_cache", "compaction", "draft_case_json"}；耗时分解通过 update(trace=...) 交给页面。
+    """
+    run = None
+    try:
+        with start_run("job.generate", chars=len(patient_text)) as run:
+            source_text = patient_text  # 趋势图的检验值从压缩前的原文提取
+            patient_text, compaction = pipeline.compact(patient_text, long_record_mode=options["long_record_mode"])
+            long_mode = options["long_record_mode"] and pipeline.is_long_record(patient_text)
+            if long_mode:
+                update(stage="🤖 超长病历：正在切分并并发提取...")
+            else:
+                update(stage="🤖 AI 正在按时间轴拆解并自动推断治疗线数...")
+
+            def on_chunk_done(done, total, merged, failed):
+                stage = f"🤖 超长病历分段解析：已完成 {done}/{total} 段"
+                if failed:
+                    stage += f"（第 {', '.join(map(str, failed))} 段重试后仍失败，已跳过）"
+                update(progress=0.9 * done / total, stage=stage, preview=merged if options["live_preview"] else None)
+
+            def on_progress(reasoning, partial):
+                stage = "🤖 AI 正在输出结构化结果..." if partial else f"🧠 AI 推理中（已思考 {len(reasoning)} 字）"
+                update(stage=stage, detail=reasoning[-200:], preview=partial)
+
+            def on_draft(draft):
+                update(draft={"case_json": draft, "ppt_bytes": pipeline.build_ppt(draft), "at": time.time()})
+
+            # 关闭实时预览时不传 on_progress，AI 调用走非流式接口
+            stream_progress = on_progress if options["live_preview"] else None
+            draft = None
+            # 超长病历走分段解析；reasoner 结果已在缓存里时秒出，也没必要再出草稿
+            if options["speculative"] and not long_mode and (options["force"] or not pipeline.has_cached_case(patient_text)):
+                case_json, from_cache, draft = pipeline.extract_speculative(
+                    patient_text, force=options["force"], on_progress=stream_progress, on_draft=on_draft,
+                    source_text=source_text,
+                )
+            else:
+                case_json, from_cache = pipeline.extract(
+                    patient_text, force=options["force"], long_record_mode=options["long_record_mode"],
+                    on_progress=stream_progress, on_chunk_done=on_chunk_done, source_text=source_text,
+                )
+            update(stage="📊 正在自动绘制时间轴并排版幻灯片...", progress=0.95, preview=case_json)
+            ppt_bytes = pipeline.build_ppt(case_json)
+    finally:
+        # 出错的运行也保留耗时分解，便于定位卡在哪一步
+        if run is not None:
+            update(trace=run.breakdown())
+    return {"case_json": case_json, "ppt_bytes": ppt_bytes, "from_cache": from_cache, "compaction": compaction,
+            "draft_case_json": draft}
 
 # ==========================================
-# 5. Streamlit 网页前端
+# 3. Streamlit 网页前端
 # ==========================================
 st.set_page_config(page_title="Pro级肿瘤病例PPT生成", layout="wide")
 st.title("🩺 医疗级病史 PPT 自动生成排版系统")
 
+pipeline = get_pipeline()
+
+with st.sidebar:
+    st.markdown("### ⚙️ 生成设置")
+    live_preview = st.toggle("⚡ 流式实时预览", value=True, help="边生成边展示 AI 推理进度和已解析出的病例逻辑线，无需干等完整结果。")
+    long_record_mode = st.toggle("📚 超长病历分段并发解析", value=True, help=f"病史超过 {pipeline.settings.long_record_threshold} 字时，按页/按日期切块并发提取，再在本地合并去重。")
+    speculative = st.toggle("📝 快速草稿先行", value=pipeline.settings.speculative_draft, help=f"先用 {pipeline.settings.draft_model} 几秒内生成一版草稿 PPT 供预览，{REASONER_MODEL} 深度推理完成后自动替换为最终版。")
+    show_timings = st.toggle("⏱️ 显示耗时分解", value=False, help="任务结束后列出本次运行各阶段（token 获取、逐页 OCR、AI 调用、JSON 解析、逐页排版、保存）的耗时与 token 用量。")
+    force_regenerate = st.checkbox("🔄 强制重新生成（忽略缓存）", value=False, help="默认相同病史会直接复用上次的 AI 解析结果；勾选后重新调用 AI 并覆盖缓存。")
+    if pipeline.llm_cache is not None:
+        llm_cache_stats = pipeline.llm_cache.stats(max_age=30)
+        st.caption(f"💾 AI 解析缓存：命中 {llm_cache_stats['hits']} 次 / 未命中 {llm_cache_stats['misses']} 次，共 {llm_cache_stats['entries']} 条")
+    st.caption(f"🧵 后台运行中的任务：{get_job_manager().active_count()} 个")
+
+if "jobs" not in st.session_state:
+    st.session_state.jobs = {}
+
+def current_options():
+    return {"live_preview": live_preview, "long_record_mode": long_record_mode, "force": force_regenerate,
+            "speculative": speculative}
+
+@st.fragment(run_every=1.0)
+def poll_job(slot):
+    """任务进行中时每秒局部刷新一次进度；结束后触发整页 rerun，由 render_job 渲染最终结果"""
+    job = get_job_manager().get(st.session_state.jobs.get(slot))
+    if job is None or job["status"] not in ("queued", "running"):
+        st.rerun()
+    st.progress(job["progress"], text=job["stage"])
+    if job["detail"]:
+        st.caption(f"…{job['detail']}")
+    draft = job["draft"]
+    if draft:
+        waited = time.time() - draft["at"]
+        st.info(f"📝 当前为快速草稿（{pipeline.settings.draft_model}）：{REASONER_MODEL} 深度推理仍在进行（已等待 {waited:.0f} 秒），完成后自动替换为最终版。")
+        st.download_button(
+            label="📥 先下载草稿 PPT",
+            data=draft["ppt_bytes"],
+            file_name="病例汇报_快速草稿.pptx",
+            mime="application/vnd.openxmlformats-officedocument.presentationml.presentation",
+            key=f"download_draft_{job['id']}"
+        )
+    preview = job["preview"] or (draft["case_json"] if draft else None)
+    if preview and (preview.get("baseline") or preview.get("treatments")):
+        st.info(render_logic_line_markdown(preview))
+
+def render_job(slot):
+    """渲染某个页面槽位上的任务：进行中则轮询，结束则返回任务快照供调用方展示结果"""
+    job_id = st.session_state.jobs.get(slot)
+    if not job_id:
+        return None
+    job = get_job_manager().get(job_id)
+    if job is None:
+        st.warning("⏱️ 上一次任务的结果已过期清理，请重新提交。")
+        del st.session_state.jobs[slot]
+        return None
+    if job["status"] in ("queued", "running"):
+        poll_job(slot)
+        return None
+    if show_timings and job.get("trace"):
+        trace = job["trace"]
+        with st.expander(f"⏱️ 本次运行耗时分解（共 {trace['seconds']:.2f} 秒）"):
+            st.markdown(render_trace_markdown(trace))
+    if job["status"] == "error":
+        st.error(f"❌ 运行出错，请核对：{job['error']}")
+        return None
+    return job
+
+if "case_edits" not in st.session_state:
+    st.session_state.case_edits = {}
+
+def apply_case_edit(job_id):
+    """
+    “应用修改”按钮的回调：在本轮 rerun 渲染页面之前完成重排，下载按钮与逻辑线直接拿到修改后的版本。
+    只有输入变了的页面单元重新排版，其余页复用缓存（见 deck_cache）。
+    """
+    edits = st.session_state.case_edits
+    # 只保留页面上仍在展示的任务的修改结果
+    for stale in set(edits) - set(st.session_state.jobs.values()):
+        del edits[stale]
+    try:
+        case_json = normalize_case(json.loads(st.session_state[f"case_editor_{job_id}"]))
+    except json.JSONDecodeError as e:
+        edits[job_id] = {**edits.get(job_id, {}), "error": f"JSON 格式有误（第 {e.lineno} 行第 {e.colno} 列）：{e.msg}"}
+        return
+    except ValueError:
+        edits[job_id] = {**edits.get(job_id, {}), "error": "病例 JSON 的最外层必须是对象（{...}）。"}
+        return
+    ppt_bytes, stats = pipeline.render_ppt(case_json)
+    edits[job_id] = {"case_json": case_json, "ppt_bytes": ppt_bytes, "stats": stats, "error": None}
+
+def render_case_editor(job):
+    result = job["result"]
+    edit = st.session_state.case_edits.get(job["id"], {})
+    with st.expander("✏️ 修改病例 JSON 并快速重排 PPT", expanded=bool(edit)):
+        st.caption("直接改字段（如某段治疗的 regimen、某个时间轴日期）后点击应用：只重新排版受影响的页，无需重新调用 AI。")
+        st.text_area("病例 JSON", value=json.dumps(result["case_json"], ensure_ascii=False, indent=2), height=400,
+                     key=f"case_editor_{job['id']}", label_visibility="collapsed")
+        st.button("♻️ 应用修改并重新排版", key=f"apply_edit_{job['id']}", on_click=apply_case_edit, args=(job["id"],))
+        if edit.get("error"):
+            st.error(f"❌ {edit['error']}")
+        stats = edit.get("stats")
+        if stats:
+            rebuilt = "、".join(dict.fromkeys(stats["rebuilt"])) or "无"
+            st.caption(f"⚡ 已按修改重排：{stats['slides']} 页中复用 {stats['reused_slides']} 页，"
+                       f"重新排版的单元：{rebuilt}，用时 {stats['seconds'] * 1000:.0f} ms")
+
+def render_generation_result(job, file_name, show_json=False):
+    result = job["result"]
+    edit = st.session_state.case_edits.get(job["id"], {})
+    # 页面里改过 JSON 时，下载与逻辑线都换成修改后的版本
+    case_json = edit.get("case_json", result["case_json"])
+    st.success("✅ 深度解析成功！您可以下载完整 PPT，或直接复制下方的逻辑流。")
+    if result["from_cache"]:
+        st.caption("⚡ 命中本地缓存，已直接复用上次的 AI 解析结果（如需重新推理请勾选侧栏“强制重新生成”）")
+    if result["case_json"].get(FAILED_CHUNKS_KEY):
+        failed = result["case_json"][FAILED_CHUNKS_KEY]
+        st.warning(f"⚠️ 超长病历第 {', '.join(map(str, failed))} 段解析失败，PPT 只包含其余段落的内容，可稍后重新生成。")
+    if result.get("draft_case_json") is not None:
+        # 与 reasoner 的原始输出比，用户在页面里改的字段不算“深度推理的修改”
+        changes = diff_case_fields(result["draft_case_json"], result["case_json"])
+        st.caption(f"🧠 当前 PPT 来自深度推理（{REASONER_MODEL}），已替换快速草稿（{pipeline.settings.draft_model}）。")
+        with st.expander(f"🔍 深度推理相对草稿修改了 {len(changes)} 处字段"):
+            st.markdown(render_case_diff_markdown(changes))
+    compaction = result.get("compaction")
+    if compaction and compaction["removed"]:
+        saved = 1 - compaction["tokens_after"] / max(1, compaction["tokens_before"])
+        with st.expander(f"🗜️ 送入 AI 前已精简病史：{compaction['chars_before']} → {compaction['chars_after']} 字，"
+                         f"约 {compaction['tokens_before']} → {compaction['tokens_after']} tokens（-{saved:.0%}）"):
+            st.markdown(render_compaction_markdown(compaction))
+
+    # 1. PPT 下载按钮
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        st.download_button(
+            label="📥 立即下载完整 PPT（已含修改）" if "ppt_bytes" in edit else "📥 立即下载完整 PPT",
+            data=edit.get("ppt_bytes", result["ppt_bytes"]),
+            file_name=file_name,
+            mime="application/vnd.openxmlformats-officedocument.presentationml.presentation",
+            key=f"download_{job['id']}"
+        )
+    if show_json:
+        with col2:
+            with st.expander("点击查看底层 JSON 树"):
+                st.json(case_json)
+    render_case_editor(job)
+
+    # 2. 网页端直接展示病例逻辑线 (Markdown)
+    st.markdown("---")
+    st.markdown("### 📋 病例全病程逻辑线 (Cheat Sheet)")
+    st.info(render_logic_line_markdown(case_json))
+
 tab1, tab2 = st.tabs(["📸 传图识别 (OCR)", "📝 电子病历粘贴"])
 
 if "ocr_result_text" not in st.session_state:
@@ -484,18 +430,43 @@ with tab1:
     if uploaded_files:
         st.info(f"📁 已选择 {len(uploaded_files)} 张图片。")
         if st.button("🔍 开始批量提取文字"):
-            with st.spinner("正在呼叫百度高精度 OCR 引擎扫描所有图片..."):
-                token = get_baidu_access_token()
-                if not token:
-                    st.error("获取百度 API 授权失败，请检查密钥。")
-                else:
-                    all_extracted_text = []
-                    for i, file in enumerate(uploaded_files):
-                        image_bytes = file.getvalue()
-                        text = perform_ocr(image_bytes, token)
-                        all_extracted_text.append(f"【第 {i+1} 页提取结果】\n{text}\n")
-                    st.session_state.ocr_result_text = "\n".join(all_extracted_text)
-            st.success("✅ 文字提取成功！请在下方核对。")
+            images = {i: file.getvalue() for i, file in enumerate(uploaded_files)}
+            st.session_state.ocr_pages = [None] * len(images)
+            st.session_state.jobs["ocr"] = get_job_manager().submit(ocr_job, pipeline, images)
+
+        ocr_done = render_job("ocr")
+        ocr_pages = st.session_state.get("ocr_pages", [])
+        if ocr_done and st.session_state.get("ocr_applied_job") != ocr_done["id"]:
+            # 任务结束后只合并一次：全量提取会填满所有页，重试任务只替换对应的失败页
+            for idx, page in ocr_done["result"].items():
+                ocr_pages[idx] = page
+            st.session_state.ocr_result_text = join_ocr_pages([page or {"text": ""} for page in ocr_pages])
+            st.session_state.ocr_applied_job = ocr_done["id"]
+
+        if ocr_done and ocr_pages and all(ocr_pages):
+            failed = [i + 1 for i, page in enumerate(ocr_pages) if not page["ok"]]
+            if failed:
+                st.warning(f"⚠️ 第 {', '.join(map(str, failed))} 页识别失败，可点击下方按钮单独重试。")
+            else:
+                st.success("✅ 文字提取成功！请在下方核对。")
+            cached_pages = sum(1 for page in ocr_pages if page["cached"])
+            if pipeline.ocr_cache is not None:
+                cache_stats = pipeline.ocr_cache.stats()
+                st.caption(
+                    f"💾 本批 {cached_pages}/{len(ocr_pages)} 页命中 OCR 缓存；"
+                    f"累计命中 {cache_stats['hits']} 次 / 未命中 {cache_stats['misses']} 次，"
+                    f"缓存 {cache_stats['entries']} 条（{cache_stats['bytes'] / 1024:.0f} KB）"
+                )
+            with st.expander("🗜️ 图片预处理统计（上传体积）"):
+                st.markdown(render_prep_stats_markdown(ocr_pages))
+
+            # 仅重试失败页：其余页直接沿用上一次的结果，不重复消耗 OCR 额度
+            failed_idx = [i - 1 for i in failed]
+            if failed_idx and len(ocr_pages) == len(uploaded_files):
+                if st.button(f"🔁 重试失败的 {len(failed_idx)} 页"):
+                    retry_images = {i: uploaded_files[i].getvalue() for i in failed_idx}
+                    st.session_state.jobs["ocr"] = get_job_manager().submit(ocr_job, pipeline, retry_images)
+                    st.rerun()
 
     st.markdown("### 第二步：人工校对与修改")
     final_text_to_process = st.text_area(
@@ -508,30 +479,11 @@ with tab1:
         if len(final_text_to_process) < 20:
             st.warning("⚠️ 病史太短，请补充详细记录。")
         else:
-            try:
-                with st.spinner('🤖 AI 正在化身肿瘤科主任，按时间轴拆解并自动推断您的治疗线数...'):
-                    case_json = extract_complex_case(final_text_to_process)
-                with st.spinner('📊 正在为您自动绘制时间轴并排版幻灯片...'):
-                    maker = AdvancedPPTMaker(case_json)
-                    ppt_file = maker.build()
-                
-                st.success("✅ 深度解析成功！您可以下载完整 PPT，或直接复制下方的逻辑流。")
-                
-                # 1. PPT 下载按钮
-                st.download_button(
-                    label="📥 立即下载完整 PPT",
-                    data=ppt_file,
-                    file_name="病例汇报_Pro版.pptx",
-                    mime="application/vnd.openxmlformats-officedocument.presentationml.presentation"
-                )
-                
-                # 2. 网页端直接展示病例逻辑线 (Markdown)
-                st.markdown("---")
-                st.markdown("### 📋 病例全病程逻辑线 (Cheat Sheet)")
-                st.info(render_logic_line_markdown(case_json))
-                
-            except Exception as e:
-                st.error(f"❌ 运行出错，请核对：{str(e)}")
+            st.session_state.jobs["tab1"] = get_job_manager().submit(generate_job, pipeline, final_text_to_process, current_options())
+
+    tab1_job = render_job("tab1")
+    if tab1_job:
+        render_generation_result(tab1_job, "病例汇报_Pro版.pptx")
 
 with tab2:
     st.markdown("如果你已经有电子版的长病历（如从医院系统拷贝），可以直接粘贴在这里。")
@@ -540,32 +492,13 @@ with tab2:
         if len(patient_input) < 20:
             st.warning("⚠️ 病史太短，请提供详细病历。")
         else:
-            try:
-                with st.spinner('🤖 AI 正在按时间轴拆解并自动推断治疗线数...'):
-                    case_json = extract_complex_case(patient_input)
-                with st.spinner('📊 正在为您自动排版幻灯片...'):
-                    maker = AdvancedPPTMaker(case_json)
-                    ppt_file = maker.build()
-                
-                st.success("✅ 深度解析成功！您可以下载完整 PPT，或直接复制下方的逻辑流。")
-                
-                # 1. PPT 下载按钮
-                col1, col2 = st.columns([2, 1])
-                with col1:
-                    st.download_button(
-                        label="📥 立即下载完整 PPT",
-                        data=ppt_file,
-                        file_name="病例汇报_文本版.pptx",
-                        mime="application/vnd.openxmlformats-officedocument.presentationml.presentation"
-                    )
-                with col2:
-                    with st.expander("点击查看底层 JSON 树"):
-                        st.json(case_json)
-                
-                # 2. 网页端直接展示病例逻辑线 (Markdown)
-                st.markdown("---")
-                st.markdown("### 📋 病例全病程逻辑线 (Cheat Sheet)")
-                st.info(render_logic_line_markdown(case_json))
-                
-            except Exception as e:
-                st.error(f"❌ 运行出错，请核对：{str(e)}")
+            st.session_state.jobs["tab2"] = get_job_manager().submit(generate_job, pipeline, patient_input, current_options())
+
+    tab2_job = render_job("tab2")
+    if tab2_job:
+        render_generation_result(tab2_job, "病例汇报_文本版.pptx", show_json=True)
+
+rerun_seconds = time.perf_counter() - _rerun_started
+record_duration("app.rerun", rerun_seconds)
+if show_timings:
+    st.sidebar.caption(f"🖥️ 本次页面脚本执行 {rerun_seconds * 1000:.0f} ms")
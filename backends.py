@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import random
+import hashlib
+from types import SimpleNamespace
+
+from ocr import OCR_ENDPOINT, OCRError, perform_ocr, parse_ocr_response
+from extraction import make_llm_client
+
+# ==========================================
+# 🔌 可替换的 OCR / AI 后端 (真实接口 + 离线回放)
+# ==========================================
+# OCR 后端约定：name 属性（参与 OCR 缓存键）、ready() 是否可用、recognize(图片字节) -> 文字，失败抛 OCRError。
+# AI 后端约定：与 OpenAI SDK 相同的 client.chat.completions.create(model, messages, stream=False)，
+# 流式时逐块产出 chunk.choices[0].delta（reasoning_content / content）。
+# 回放目录结构：<dir>/ocr/<送检图片 sha256>.json 与 <dir>/llm/<请求 sha256>.json，可由录制后端自动生成。
+
+def _sleep_ms(latency_ms, jitter_ms=0):
+    delay = latency_ms + (random.uniform(0, jitter_ms) if jitter_ms else 0)
+    if delay > 0:
+        time.sleep(delay / 1000)
+
+def ocr_recording_key(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+def llm_recording_key(model, messages):
+    payload = json.dumps({"model": model, "messages": messages}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _recording_path(recordings_dir, kind, key):
+    return os.path.join(recordings_dir, kind, f"{key}.json")
+
+def _load_recording(recordings_dir, kind, key):
+    if not recordings_dir:
+        return None
+    path = _recording_path(recordings_dir, kind, key)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def _save_recording(recordings_dir, kind, key, data):
+    path = _recording_path(recordings_dir, kind, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+class BaiduOCRBackend:
+    """百度高精度 OCR（真实接口）"""
+    name = OCR_ENDPOINT
+
+    def __init__(self, token_provider):
+        self.token_provider = token_provider
+
+    def ready(self):
+        return bool(self.token_provider.get())
+
+    def recognize(self, image_bytes):
+        return perform_ocr(image_bytes, self.token_provider)
+
+class RecordingOCRBackend:
+    """包装真实后端：识别成功的结果按送检图片哈希写入回放目录，之后可离线复现"""
+    def __init__(self, inner, recordings_dir):
+        self.inner = inner
+        self.recordings_dir = recordings_dir
+        self.name = inner.name
+
+    def ready(self):
+        return self.inner.ready()
+
+    def recognize(self, image_bytes):
+        text = self.inner.recognize(image_bytes)
+        _save_recording(self.recordings_dir, "ocr", ocr_recording_key(image_bytes), {"text": text})
+        return text
+
+class ReplayOCRBackend:
+    """
+    离线 OCR：按送检图片哈希回放录制结果（{"text"} 或百度原始返回格式均可），
+    没有录制时返回可重复的占位文字；latency_ms/jitter_ms 模拟接口耗时，fail_rate 模拟偶发失败。
+    """
+    name = "replay"
+
+    def __init__(self, recordings_dir="", latency_ms=0, jitter_ms=0, fail_rate=0.0):
+        self.recordings_dir = recordings_dir
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.fail_rate = fail_rate
+
+    def ready(self):
+        return True
+
+    def recognize(self, image_bytes):
+        _sleep_ms(self.latency_ms, self.jitter_ms)
+        if self.fail_rate and random.random() < self.fail_rate:
+            raise OCRError("请求异常: 回放后端模拟失败")
+        key = ocr_recording_key(image_bytes)
+        recording = _load_recording(self.recordings_dir, "ocr", key)
+        if recording is None:
+            return f"【离线回放】未录制的页面 {key[:12]}（{len(image_bytes)} 字节）"
+        if "text" in recording:
+            return recording["text"]
+        return parse_ocr_response(recording)
+
+def _message(content, reasoning_content=None):
+    return SimpleNamespace(role="assistant", content=content, reasoning_content=reasoning_content)
+
+def _response(content, reasoning_content=None):
+    return SimpleNamespace(choices=[SimpleNamespace(index=0, message=_message(content, reasoning_content))])
+
+def _stream_chunk(content=None, reasoning_content=None):
+    delta = SimpleNamespace(content=content, reasoning_content=reasoning_content)
+    return SimpleNamespace(choices=[SimpleNamespace(index=0, delta=delta)])
+
+# 未录制请求的占位回答：其余字段由 normalize_case 按接口规范补齐
+DEFAULT_REPLAY_CASE = {
+    "cover": {"title": "离线回放病例"},
+    "baseline": {"patient_info": "未录制的请求（回放后端占位数据）"},
+}
+
+class _Completions:
+    def __init__(self, create):
+        self.create = create
+
+class ReplayLLMClient:
+    """
+    离线 AI 客户端：按 (模型, 消息) 哈希回放录制的回答，接口形状与 OpenAI SDK 一致。
+    没有录制时由 response_factory(messages) 生成回答（默认返回占位病例 JSON）。
+    latency_ms 为首字延迟；chars_per_second 不为空时流式按该速度吐字，非流式则整体等待同样时长。
+    """
+    def __init__(self, recordings_dir="", latency_ms=0, chars_per_second=None, response_factory=None, chunk_chars=24):
+        self.recordings_dir = recordings_dir
+        self.latency_ms = latency_ms
+        self.chars_per_second = chars_per_second
+        self.response_factory = response_factory
+        self.chunk_chars = chunk_chars
+        self.chat = SimpleNamespace(completions=_Completions(self._create))
+
+    def _answer(self, model, messages):
+        recording = _load_recording(self.recordings_dir, "llm", llm_recording_key(model, messages))
+        if recording is not None:
+            return recording.get("reasoning_content") or "", recording.get("content") or ""
+        if self.response_factory is not None:
+            return "", self.response_factory(messages)
+        return "", json.dumps(DEFAULT_REPLAY_CASE, ensure_ascii=False)
+
+    def _create(self, model, messages, stream=False, **kwargs):
+        reasoning, content = self._answer(model, messages)
+        _sleep_ms(self.latency_ms)
+        if not stream:
+            if self.chars_per_second:
+                time.sleep((len(reasoning) + len(content)) / self.chars_per_second)
+            return _response(content, reasoning or None)
+        return self._stream(reasoning, content)
+
+    def _stream(self, reasoning, content):
+        step = self.chunk_chars
+        for field, text in (("reasoning_content", reasoning), ("content", content)):
+            for i in range(0, len(text), step):
+                piece = text[i:i + step]
+                if self.chars_per_second:
+                    time.sleep(len(piece) / self.chars_per_second)
+                yield _stream_chunk(**{field: piece})
+
+class RecordingLLMClient:
+    """包装真实客户端：把每次请求的回答（含推理过程）写入回放目录，流式请求在流结束后落盘"""
+    def __init__(self, inner, recordings_dir):
+        self.inner = inner
+        self.recordings_dir = recordings_dir
+        self.chat = SimpleNamespace(completions=_Completions(self._create))
+
+    def _create(self, model, messages, stream=False, **kwargs):
+        key = llm_recording_key(model, messages)
+        response = self.inner.chat.completions.create(model=model, messages=messages, stream=stream, **kwargs)
+        if not stream:
+            message = response.choices[0].message
+            _save_recording(self.recordings_dir, "llm", key, {
+                "model": model,
+                "reasoning_content": getattr(message, "reasoning_content", None) or "",
+                "content": message.content or "",
+            })
+            return response
+        return self._tee(response, model, key)
+
+    def _tee(self, stream, model, key):
+        reasoning_parts = []
+        content_parts = []
+        for chunk in stream:
+            if chunk.choices:
+                delta = chunk.choices[0].delta
+                reasoning_parts.append(getattr(delta, "reasoning_content", None) or "")
+                content_parts.append(delta.content or "")
+            yield chunk
+        _save_recording(self.recordings_dir, "llm", key, {
+            "model": model,
+            "reasoning_content": "".join(reasoning_parts),
+            "content": "".join(content_parts),
+        })
+
+# ==========================================
+# 🏭 按 Settings 创建后端
+# ==========================================
+OCR_BACKENDS = ("baidu", "replay")
+LLM_BACKENDS = ("deepseek", "replay")
+
+def create_ocr_backend(settings, token_provider):
+    if settings.ocr_backend == "replay":
+        return ReplayOCRBackend(settings.replay_dir, latency_ms=settings.mock_ocr_latency_ms,
+                                jitter_ms=settings.mock_ocr_jitter_ms)
+    if settings.ocr_backend != "baidu":
+        raise ValueError(f"未知的 OCR_BACKEND: {settings.ocr_backend}（可选 {', '.join(OCR_BACKENDS)}）")
+    backend = BaiduOCRBackend(token_provider)
+    if settings.record_dir:
+        backend = RecordingOCRBackend(backend, settings.record_dir)
+    return backend
+
+def create_llm_client(settings):
+    if settings.llm_backend == "replay":
+        return ReplayLLMClient(settings.replay_dir, latency_ms=settings.mock_llm_latency_ms,
+                               chars_per_second=settings.mock_llm_chars_per_second or None)
+    if settings.llm_backend != "deepseek":
+        raise ValueError(f"未知的 LLM_BACKEND: {settings.llm_backend}（可选 {', '.join(LLM_BACKENDS)}）")
+    client = make_llm_client(settings.deepseek_api_key, connect_timeout=settings.llm_connect_timeout,
+                             read_timeout=settings.llm_read_timeout, max_retries=settings.llm_max_retries)
+    if settings.record_dir:
+        client = RecordingLLMClient(client, settings.record_dir)
+    return client
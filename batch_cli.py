@@ -0,0 +1,170 @@
+"""
+命令行批处理：把一个目录下的多份病例一次性生成 PPT，不需要打开网页逐个点击。
+
+用法：
+    python batch_cli.py cases/ -o decks/ -j 3
+
+目录约定（每一项是一份病例，以文件名/子目录名作为输出文件名）：
+    cases/张某.txt            电子病历文本
+    cases/李某/01.jpg ...     同一患者的多张病历图片（按文件名自然顺序 OCR），目录内的 .txt 拼在识别结果之后
+    cases/王某.png            单张病历图片
+
+输出目录中每份病例生成 <名称>.pptx 与 <名称>.json，另附汇总报告 report.json（各阶段耗时与失败原因）。
+单个文件去掉扩展名后与其它病例重名时（如 张某.txt 与 张某.png，或与子目录 张某/ 同名），名称保留扩展名
+（张某.txt.pptx、张某.png.pptx），各自生成、互不覆盖。
+密钥与参数读取 .streamlit/secrets.toml（可用 --secrets 指定），同名环境变量优先。
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from settings import Settings
+from extraction import FAILED_CHUNKS_KEY
+from pipeline import CasePipeline
+
+TEXT_EXTS = {".txt", ".md"}
+IMAGE_EXTS = {".png", ".jpg", ".jpeg"}
+
+def _natural_key(name):
+    # “第2页.jpg” 排在 “第10页.jpg” 前面
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", name)]
+
+def _read_text(path):
+    # 医院系统导出的文本常见 GBK 编码
+    with open(path, "rb") as f:
+        raw = f.read()
+    for encoding in ("utf-8-sig", "gb18030"):
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return raw.decode("utf-8", errors="replace")
+
+# 汇总报告占用的文件名，病例不能同名
+REPORT_NAME = "report"
+
+def discover_cases(input_dir):
+    """
+    扫描输入目录，返回 [{"name", "text_files", "image_files"}]，按名称自然排序。
+    name 即输出文件名：子目录用目录名，单个文件用去掉扩展名的部分；
+    后者与其它病例（或汇总报告）重名时改用完整文件名，避免输出互相覆盖。
+    """
+    found = []  # (病例, 单个文件时的完整文件名，子目录为 None)
+    for entry in sorted(os.listdir(input_dir), key=_natural_key):
+        path = os.path.join(input_dir, entry)
+        stem, ext = os.path.splitext(entry)
+        if os.path.isdir(path):
+            files = sorted(os.listdir(path), key=_natural_key)
+            texts = [os.path.join(path, f) for f in files if os.path.splitext(f)[1].lower() in TEXT_EXTS]
+            images = [os.path.join(path, f) for f in files if os.path.splitext(f)[1].lower() in IMAGE_EXTS]
+            if texts or images:
+                found.append(({"name": entry, "text_files": texts, "image_files": images}, None))
+        elif ext.lower() in TEXT_EXTS:
+            found.append(({"name": stem, "text_files": [path], "image_files": []}, entry))
+        elif ext.lower() in IMAGE_EXTS:
+            found.append(({"name": stem, "text_files": [], "image_files": [path]}, entry))
+
+    # 输出目录可能在不区分大小写的文件系统上（Windows / macOS），重名按小写比较
+    counts = {}
+    for case, _ in found:
+        counts[case["name"].lower()] = counts.get(case["name"].lower(), 0) + 1
+    for case, file_name in found:
+        if file_name and (counts[case["name"].lower()] > 1 or case["name"].lower() == REPORT_NAME):
+            case["name"] = file_name
+    return [case for case, _ in found]
+
+def process_case(pipeline, case, output_dir, force=False, long_record_mode=True):
+    """跑完一份病例并落盘，返回该病例的报告条目；异常不向外抛，记录在 error 字段"""
+    report = {"name": case["name"], "status": "ok", "error": None, "timings": {}, "outputs": []}
+    start = time.perf_counter()
+    try:
+        images = []
+        for path in case["image_files"]:
+            with open(path, "rb") as f:
+                images.append(f.read())
+        patient_text = "\n".join(_read_text(path) for path in case["text_files"])
+        if not images and len(patient_text.strip()) < 20:
+            raise ValueError("病史太短，请补充详细记录。")
+
+        result = pipeline.run(patient_text, images=images, force=force, long_record_mode=long_record_mode)
+        report["timings"] = result["timings"]
+        report["from_cache"] = result["from_cache"]
+        report["ocr_failed_pages"] = result["ocr_failed_pages"]
+        if result["compaction"]:
+            report["compaction"] = {k: v for k, v in result["compaction"].items() if k != "samples"}
+
+        ppt_path = os.path.join(output_dir, f"{case['name']}.pptx")
+        json_path = os.path.join(output_dir, f"{case['name']}.json")
+        with open(ppt_path, "wb") as f:
+            f.write(result["ppt_bytes"])
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(result["case_json"], f, ensure_ascii=False, indent=2)
+        report["outputs"] = [ppt_path, json_path]
+        failed_chunks = result["case_json"].get(FAILED_CHUNKS_KEY, [])
+        if failed_chunks:
+            report["llm_failed_chunks"] = failed_chunks
+        if result["ocr_failed_pages"] or failed_chunks:
+            report["status"] = "partial"  # PPT 已生成，但有页面没识别出来或有病历分段没解析出来
+    except Exception as e:
+        report["status"] = "error"
+        report["error"] = f"{type(e).__name__}: {e}"
+    report["timings"]["total"] = time.perf_counter() - start
+    return report
+
+def _format_timings(timings):
+    return " / ".join(f"{stage} {seconds:.1f}s" for stage, seconds in timings.items() if stage != "total")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量把病历文本/图片生成病例汇报 PPT")
+    parser.add_argument("input_dir", help="病例目录（每个 .txt / 图片 / 子目录为一份病例）")
+    parser.add_argument("-o", "--output-dir", default="output", help="PPT / JSON / 报告输出目录（默认 output）")
+    parser.add_argument("-j", "--jobs", type=int, default=2, help="同时处理的病例数（默认 2）")
+    parser.add_argument("--secrets", default=".streamlit/secrets.toml", help="密钥与参数文件路径")
+    parser.add_argument("--force", action="store_true", help="忽略 AI 解析缓存，强制重新生成")
+    parser.add_argument("--no-long-record", action="store_true", help="关闭超长病历分段解析")
+    args = parser.parse_args(argv)
+
+    cases = discover_cases(args.input_dir)
+    if not cases:
+        print(f"在 {args.input_dir} 中没有找到病例（支持 .txt/.md、.png/.jpg/.jpeg 或子目录）", file=sys.stderr)
+        return 2
+    os.makedirs(args.output_dir, exist_ok=True)
+    pipeline = CasePipeline(Settings.load(args.secrets))
+
+    started = time.time()
+    reports = {}
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        futures = {
+            pool.submit(process_case, pipeline, case, args.output_dir, args.force, not args.no_long_record): case["name"]
+            for case in cases
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            report = future.result()
+            reports[report["name"]] = report
+            mark = {"ok": "✅", "partial": "⚠️", "error": "❌"}[report["status"]]
+            detail = report["error"] or _format_timings(report["timings"])
+            print(f"[{done}/{len(cases)}] {mark} {report['name']}  {report['timings']['total']:.1f}s  {detail}", flush=True)
+
+    ordered = [reports[case["name"]] for case in cases]
+    summary = {
+        "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started)),
+        "wall_seconds": time.time() - started,
+        "concurrency": args.jobs,
+        "succeeded": sum(1 for r in ordered if r["status"] != "error"),
+        "failed": sum(1 for r in ordered if r["status"] == "error"),
+        "cases": ordered,
+    }
+    report_path = os.path.join(args.output_dir, f"{REPORT_NAME}.json")
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    print(f"\n完成 {summary['succeeded']}/{len(cases)} 份，失败 {summary['failed']} 份，"
+          f"总耗时 {summary['wall_seconds']:.1f}s；报告：{report_path}")
+    return 1 if summary["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
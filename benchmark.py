@@ -0,0 +1,287 @@
+"""
+离线端到端性能基准：不需要任何密钥，用回放后端在 small / medium / huge 三档合成病例上逐阶段计时，
+输出机器可读的 JSON，便于不同版本之间对比。
+
+计时阶段：
+    preprocess      OCR 前的图片预处理（缩放/灰度/重编码）
+    ocr             并发 OCR（含逐页预处理；回放后端 + 注入延迟，不走缓存）
+    llm_parse       AI 结构化提取（回放客户端 + 注入延迟，含容错解析与字段校验）
+    clean_data      PPT 数据清洗
+    make_*          每个幻灯片构建步骤（与 AdvancedPPTMaker.BUILD_STEPS 一致）
+    save            prs.save 序列化为 pptx 字节
+
+冷启动（startup，每次在新进程里测，取中位数）：
+    import          导入网页端用到的业务模块（不含 streamlit 本身）
+    init            构造 CasePipeline
+    warm_up         预热重型依赖（python-pptx、模板解析、AI 客户端）
+    first_ppt       预热后的首份 PPT
+    并记录导入完成时已加载的重型模块（理想情况为空）
+
+用法：
+    python benchmark.py -o bench/v1.json
+    python benchmark.py --sizes small huge --repeat 5 --ocr-latency-ms 300 --compare bench/v1.json
+"""
+import io
+import os
+import sys
+import copy
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import subprocess
+
+from PIL import Image, ImageDraw
+
+from ocr import DEFAULT_PREP_OPTIONS, preprocess_image, batch_ocr
+from extraction import REASONER_MODEL, extract_complex_case
+from backends import ReplayOCRBackend, ReplayLLMClient
+from ppt_maker import AdvancedPPTMaker
+
+# 三档合成病例：图片页数、图片尺寸、治疗线数、时间轴事件数、入院检验条目数
+CASE_SIZES = {
+    "small":  {"pages": 1,  "image_size": (1240, 1754), "treatments": 2,  "events": 4,  "exams": 5},
+    "medium": {"pages": 6,  "image_size": (2480, 3508), "treatments": 5,  "events": 10, "exams": 15},
+    "huge":   {"pages": 30, "image_size": (3508, 4961), "treatments": 12, "events": 40, "exams": 60},
+}
+
+def synthetic_page(width, height, seed):
+    """模拟一张手机拍摄的病历页：浅灰底、多行文字块、轻微噪点，编码为 JPEG"""
+    rng = random.Random(seed)
+    img = Image.new("RGB", (width, height), (236, 234, 228))
+    draw = ImageDraw.Draw(img)
+    line_height = max(height // 60, 12)
+    for y in range(line_height * 3, height - line_height * 3, line_height * 2):
+        x = width // 12
+        while x < width - width // 12:
+            word = rng.randint(width // 40, width // 10)
+            draw.rectangle([x, y, min(x + word, width - width // 12), y + line_height], fill=(40, 40, 40))
+            x += word + rng.randint(10, 40)
+    for _ in range(2000):
+        draw.point((rng.randrange(width), rng.randrange(height)), fill=(rng.randint(150, 255),) * 3)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=92)
+    return buf.getvalue()
+
+def synthetic_case(spec, seed=0):
+    """按接口规范生成一份结构完整的病例 JSON，各字段长度随档位增长"""
+    rng = random.Random(seed)
+    phases = ["新辅助治疗", "一线治疗", "二线治疗", "三线治疗", "维持治疗", "局部治疗"]
+    drugs = ["奥沙利铂", "卡培他滨", "贝伐珠单抗", "信迪利单抗", "伊立替康", "瑞戈非尼", "呋喹替尼"]
+    treatments = []
+    for i in range(spec["treatments"]):
+        regimen = "+".join(rng.sample(drugs, 2))
+        treatments.append({
+            "phase": phases[i % len(phases)],
+            "duration": f"2021.{i % 12 + 1:02d} - 2021.{(i + 2) % 12 + 1:02d}",
+            "regimen": f"{regimen} 方案 × {rng.randint(2, 8)} 周期，期间出现 {rng.choice(['骨髓抑制', '手足综合征', '乏力'])}",
+            "imaging": f"腹部增强CT：肝内病灶较前{rng.choice(['缩小', '稳定', '增大'])}，疗效评估 {rng.choice(['PR', 'SD', 'PD'])}",
+            "markers": f"CEA {rng.uniform(2, 200):.1f} ng/mL，CA19-9 {rng.uniform(10, 900):.1f} U/mL",
+        })
+    events = []
+    for i in range(spec["events"]):
+        is_eval = i % 3 == 2
+        events.append({
+            "date": f"{2020 + i // 12}.{i % 12 + 1:02d}",
+            "phase": "评估" if is_eval else phases[i % len(phases)],
+            "event_type": "Evaluation" if is_eval else "Treatment",
+            "event": f"复查CT 疗效{rng.choice(['PR', 'SD', 'PD'])}" if is_eval else f"{rng.choice(drugs)} 第{i + 1}周期",
+        })
+    exams = [f"{name}：{rng.uniform(1, 300):.1f}" for name in
+             (["血常规 WBC", "HGB", "PLT", "ALT", "AST", "TBIL", "CEA", "CA19-9", "CA125", "肌酐"] * 10)[:spec["exams"]]]
+    return {
+        "cover": {"title": "晚期结肠癌多线治疗后进展一例"},
+        "baseline": {
+            "patient_info": "男，56岁",
+            "chief_complaint": "便血伴排便习惯改变3月",
+            "diagnosis": "乙状结肠腺癌 cT4aN2M1a（肝转移）IVA期，RAS野生型，MSS",
+            "key_exams": "肠镜活检：中分化腺癌；基因检测：KRAS/NRAS/BRAF 野生型；" * max(1, spec["treatments"] // 3),
+        },
+        "treatments": treatments,
+        "current_admission": {
+            "exams": exams,
+            "imaging": "胸腹盆增强CT：肝内多发转移灶，较前增多增大。" * max(1, spec["events"] // 10),
+            "plan": [f"计划：{rng.choice(drugs)} 联合治疗，2周期后评估" for _ in range(max(2, spec["treatments"] // 2))],
+        },
+        "timeline_events": events,
+        # 本地规则提取的指标序列（正常流程由 CasePipeline 附加），每条治疗线一个检测点
+        "marker_trends": [{
+            "name": name, "kind": kind, "unit": unit, "ref_low": None, "ref_high": ref_high,
+            "points": [{"date": f"2021-{i % 12 + 1:02d}-01", "value": round(rng.uniform(1, ref_high * 4), 1),
+                        "flag": "", "phase": phases[i % len(phases)], "raw": ""} for i in range(spec["treatments"])],
+        } for name, kind, unit, ref_high in (("CEA", "tumor", "ng/mL", 5.0), ("CA19-9", "tumor", "U/mL", 37.0),
+                                             ("CA125", "tumor", "U/mL", 35.0), ("WBC", "lab", "10^9/L", 9.5))],
+        "summary": {
+            "highlights": ["多线治疗后的耐药管理", "转化治疗时机的把握", "局部治疗联合系统治疗"],
+            "discussion": ["下一步治疗选择？", "是否再挑战抗EGFR治疗？"],
+        },
+    }
+
+def _timed(timings, stage, fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    timings[stage] = time.perf_counter() - start
+    return result
+
+def run_once(images, ocr_backend, llm_client, ocr_workers):
+    """跑一遍全部阶段，返回 {阶段: 秒}"""
+    timings = {}
+    _timed(timings, "preprocess", lambda: [preprocess_image(img, **DEFAULT_PREP_OPTIONS) for img in images])
+    _timed(timings, "ocr", batch_ocr, dict(enumerate(images)), ocr_backend, max_workers=ocr_workers, retries=0)
+    parsed = _timed(timings, "llm_parse", extract_complex_case, "合成病史", llm_client)
+
+    maker = AdvancedPPTMaker(copy.deepcopy(parsed))
+    _timed(timings, "clean_data", maker.clean_data, copy.deepcopy(parsed))
+    for step in maker.BUILD_STEPS:
+        _timed(timings, step, getattr(maker, step))
+    _timed(timings, "save", maker.prs.save, io.BytesIO())
+    timings["total"] = sum(timings.values())
+    timings["_slides"] = len(maker.prs.slides)
+    return timings
+
+def _summarize(runs):
+    stages = [k for k in runs[0] if not k.startswith("_")]
+    summary = {}
+    for stage in stages:
+        values = sorted(run[stage] for run in runs)
+        summary[stage] = {
+            "median": statistics.median(values),
+            "min": values[0],
+            "max": values[-1],
+        }
+    return summary
+
+def benchmark(sizes, repeat, ocr_latency_ms, ocr_jitter_ms, llm_latency_ms, llm_chars_per_second, ocr_workers):
+    results = {}
+    for size in sizes:
+        spec = CASE_SIZES[size]
+        images = [synthetic_page(*spec["image_size"], seed=i) for i in range(spec["pages"])]
+        case_json = synthetic_case(spec)
+        answer = json.dumps(case_json, ensure_ascii=False)
+        ocr_backend = ReplayOCRBackend(latency_ms=ocr_latency_ms, jitter_ms=ocr_jitter_ms)
+        llm_client = ReplayLLMClient(latency_ms=llm_latency_ms, chars_per_second=llm_chars_per_second,
+                                     response_factory=lambda messages: answer)
+        runs = [run_once(images, ocr_backend, llm_client, ocr_workers) for _ in range(repeat)]
+        results[size] = {
+            "spec": {**spec, "image_size": list(spec["image_size"]),
+                     "image_bytes": sum(len(img) for img in images), "json_chars": len(answer)},
+            "slides": runs[-1]["_slides"],
+            "stages": _summarize(runs),
+        }
+        print(f"{size:>6}: total {results[size]['stages']['total']['median'] * 1000:8.1f} ms "
+              f"（{spec['pages']} 页图片，{results[size]['slides']} 张幻灯片）", file=sys.stderr, flush=True)
+    return results
+
+# 冷启动探针：在干净的解释器里按网页端的顺序导入、构造、预热，打印各步耗时（JSON）
+STARTUP_PROBE = r'''
+import sys, json, time
+timings = {}
+start = time.perf_counter()
+from settings import Settings
+from jobs import JobManager
+from ocr import join_ocr_pages
+from extraction import REASONER_MODEL, diff_case_fields, normalize_case
+from pipeline import CasePipeline
+from tracing import start_run, record_duration
+timings["import"] = time.perf_counter() - start
+heavy = sorted(name for name in ("openai", "pptx", "PIL", "lxml", "http.server") if name in sys.modules)
+
+start = time.perf_counter()
+pipeline = CasePipeline(Settings({"OCR_BACKEND": "replay", "LLM_BACKEND": "replay",
+                                  "OCR_CACHE_PATH": "", "LLM_CACHE_PATH": ""}))
+timings["init"] = time.perf_counter() - start
+start = time.perf_counter()
+pipeline.warm_up()
+timings["warm_up"] = time.perf_counter() - start
+start = time.perf_counter()
+pipeline.build_ppt(json.loads(sys.argv[1]))
+timings["first_ppt"] = time.perf_counter() - start
+timings["total"] = sum(timings.values())
+print(json.dumps({"timings": timings, "heavy_modules_at_import": heavy}))
+'''
+
+def startup(repeat):
+    """冷启动耗时：每次起一个新进程跑 STARTUP_PROBE，返回 {"heavy_modules_at_import", "stages"}"""
+    case_json = json.dumps(synthetic_case(CASE_SIZES["small"]), ensure_ascii=False)
+    runs, heavy = [], []
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-c", STARTUP_PROBE, case_json], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+        probe = json.loads(proc.stdout.strip().splitlines()[-1])
+        runs.append(probe["timings"])
+        heavy = probe["heavy_modules_at_import"]
+    stages = _summarize(runs)
+    print(f"startup: import {stages['import']['median'] * 1000:.1f} ms，init {stages['init']['median'] * 1000:.1f} ms，"
+          f"warm_up {stages['warm_up']['median'] * 1000:.1f} ms，first_ppt {stages['first_ppt']['median'] * 1000:.1f} ms"
+          f"（导入时已加载的重型模块：{'、'.join(heavy) or '无'}）", file=sys.stderr, flush=True)
+    return {"heavy_modules_at_import": heavy, "stages": stages}
+
+def compare(current, baseline):
+    """打印与基线结果的中位数对比，返回 {档位: {阶段: 变化比例}}"""
+    diff = {}
+    for size, result in current.items():
+        base = baseline.get("results", {}).get(size)
+        if not base:
+            continue
+        diff[size] = {}
+        print(f"\n[{size}] 与基线对比（中位数）", file=sys.stderr)
+        for stage, stats in result["stages"].items():
+            old = base["stages"].get(stage, {}).get("median")
+            if not old:
+                continue
+            ratio = stats["median"] / old - 1
+            diff[size][stage] = ratio
+            print(f"  {stage:<24} {old * 1000:9.2f} ms → {stats['median'] * 1000:9.2f} ms  {ratio:+7.1%}", file=sys.stderr)
+    return diff
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="离线端到端性能基准（回放后端，无需密钥）")
+    parser.add_argument("--sizes", nargs="+", choices=list(CASE_SIZES), default=list(CASE_SIZES), help="要跑的病例档位")
+    parser.add_argument("--repeat", type=int, default=3, help="每档重复次数，结果取中位数（默认 3）")
+    parser.add_argument("--ocr-latency-ms", type=float, default=0, help="回放 OCR 每页注入延迟")
+    parser.add_argument("--ocr-jitter-ms", type=float, default=0, help="回放 OCR 每页随机抖动上限")
+    parser.add_argument("--llm-latency-ms", type=float, default=0, help="回放 AI 首字延迟")
+    parser.add_argument("--llm-chars-per-second", type=float, default=None, help="回放 AI 吐字速度（默认不限速）")
+    parser.add_argument("--ocr-workers", type=int, default=2, help="并发 OCR 在途上限（默认 2）")
+    parser.add_argument("-o", "--output", help="结果 JSON 输出路径（默认打印到标准输出）")
+    parser.add_argument("--compare", help="基线结果 JSON，打印各阶段中位数变化")
+    parser.add_argument("--no-startup", action="store_true", help="跳过冷启动测量")
+    args = parser.parse_args(argv)
+
+    params = {
+        "repeat": args.repeat,
+        "ocr_latency_ms": args.ocr_latency_ms,
+        "ocr_jitter_ms": args.ocr_jitter_ms,
+        "llm_latency_ms": args.llm_latency_ms,
+        "llm_chars_per_second": args.llm_chars_per_second,
+        "ocr_workers": args.ocr_workers,
+    }
+    results = benchmark(args.sizes, **params)
+    report = {
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "model": REASONER_MODEL,
+        "params": params,
+        "results": results,
+    }
+    if not args.no_startup:
+        report["startup"] = startup(args.repeat)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            report["compare"] = {"baseline": args.compare, "change": compare(results, json.load(f))}
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"\n结果已写入 {args.output}")
+    else:
+        print(text)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+import os
+import time
+import sqlite3
+import threading
+
+# ==========================================
+# 💾 本地持久化缓存 (SQLite + LRU 淘汰)
+# ==========================================
+class DiskCache:
+    """
+    基于 SQLite 的持久化文本缓存，多线程共享同一连接（写操作加锁）。
+    总体积超过 max_bytes 时，按最近访问时间淘汰最旧的条目；设置 ttl（秒）后，写入超过 ttl 的条目视为未命中并删除。
+    hits/misses 为进程内累计计数。
+    """
+    def __init__(self, path, table, max_bytes, ttl=None):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.table = table
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._table_stats = None  # (查询时间, 条目数, 总字节数)，供 stats(max_age) 复用
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL, "
+            "created_at REAL NOT NULL DEFAULT 0)"
+        )
+        columns = [row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")]
+        if "created_at" not in columns:  # 兼容早期没有 created_at 列的缓存文件
+            self._conn.execute(f"ALTER TABLE {table} ADD COLUMN created_at REAL NOT NULL DEFAULT 0")
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_last_access ON {table} (last_access)")
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, created_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl is not None and time.time() - row[1] > self.ttl:
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(f"UPDATE {self.table} SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def contains(self, key):
+        """只探测是否有未过期的条目：不计入 hits/misses，也不刷新访问时间"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT created_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+        return row is not None and (self.ttl is None or time.time() - row[0] <= self.ttl)
+
+    def set(self, key, value):
+        size = len(value.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, size, last_access, created_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        if self.ttl is not None:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE created_at < ?", (time.time() - self.ttl,))
+        total = self._conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # 从最久未访问的条目开始删，直到总体积回到上限以内
+        rows = self._conn.execute(f"SELECT key, size FROM {self.table} ORDER BY last_access ASC").fetchall()
+        stale = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        self._conn.executemany(f"DELETE FROM {self.table} WHERE key = ?", stale)
+
+    def stats(self, max_age=0):
+        """
+        max_age（秒）内复用上次查到的条目数/总字节数，hits/misses 总是实时值。
+        网页侧栏每次 rerun 都要展示，全表 COUNT/SUM 随缓存变大而变慢，不必每次都查。
+        """
+        with self._lock:
+            cached = self._table_stats
+            if cached is None or time.monotonic() - cached[0] > max_age:
+                entries, total = self._conn.execute(
+                    f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}"
+                ).fetchone()
+                self._table_stats = cached = (time.monotonic(), entries, total)
+            _, entries, total = cached
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": total}
@@ -0,0 +1,117 @@
+import re
+
+# ==========================================
+# 🏷️ 临床术语分类器 (编译一次，线性扫描，支持否定)
+# ==========================================
+# 术语词典：标签 -> 术语正则列表。英文缩写只按独立词匹配（“PD-1 抑制剂”不是疾病进展，“SD”不能匹配单词内部），
+# 中文术语可用前后断言排除常见误伤（“进展期胃癌”不是进展）。
+DEFAULT_TERMS = {
+    "surgery": [r"根治术", r"根治性切除", r"切除术", r"手术切除", r"R0\s*切除"],
+    "progression": [r"疾病进展", r"进展(?!期)", r"复发", r"新发转移", r"新发病灶", r"PD(?!-?L?\d)"],
+    "response": [r"完全缓解", r"部分缓解", r"疾病稳定", r"缩小", r"退缩", r"稳定", r"好转", r"CR", r"PR", r"SD"],
+    "neoadjuvant": [r"新辅助"],
+    "adjuvant": [r"(?<!新)辅助"],
+}
+
+# 否定词：其后 NEGATION_WINDOW 个字以内、且在本句结束（逗号、句号、分号、换行或“但”）之前的术语视为被否定，
+# 如“未见明显进展”“无复发”；被否定的术语之后再顺延一个窗口，覆盖“未见复发、转移或进展”这类并列。
+NEGATION_CUES = [r"未见", r"未发现", r"未提示", r"未", r"无", r"没有", r"排除", r"否认", r"不考虑", r"不支持"]
+NEGATION_WINDOW = 6
+# 伪否定：字面带“无/未”或术语、但并不否定病情的固定说法，整体跳过（“无明显诱因出现进展”“无进展生存期 12 月后复发”）
+PSEUDO_NEGATIONS = [r"无明显诱因", r"无明显原因", r"无诱因", r"无进展生存", r"无病生存", r"无复发生存", r"无事件生存",
+                    r"未经治疗", r"m?PFS", r"DFS", r"RFS", r"EFS"]
+CLAUSE_BREAK = r"[，,。；;！!？?\n]|但"
+
+def _term_pattern(term):
+    # 英文缩写两侧不能紧挨字母，避免 “SD” 命中 “SDH”、“PR” 命中 “PRN” 这类无关词
+    return rf"(?<![A-Za-z])(?:{term})(?![A-Za-z])" if term[0].isascii() and term[0].isalpha() else term
+
+class ClinicalTermClassifier:
+    """
+    按术语词典给文本打标签。所有术语、否定词、伪否定与断句符编译进同一个正则，每段文本只扫描一遍：
+    tags(text) 返回 (命中的标签, 被否定的标签) 两个集合。实例无状态，可在线程间共享。
+    """
+    def __init__(self, terms=None, negation_cues=None, pseudo_negations=None):
+        self.terms = dict(DEFAULT_TERMS if terms is None else terms)
+        pseudo = PSEUDO_NEGATIONS if pseudo_negations is None else pseudo_negations
+        # 伪否定排在否定词和术语前面：同一位置优先整体匹配固定说法
+        groups = [f"(?P<sep>{CLAUSE_BREAK})",
+                  "(?P<pseudo>" + "|".join(_term_pattern(p) for p in pseudo) + ")",
+                  "(?P<neg>" + "|".join(NEGATION_CUES if negation_cues is None else negation_cues) + ")"]
+        self._group_tags = {}
+        for index, (tag, patterns) in enumerate(self.terms.items()):
+            # 长术语优先，保证“疾病进展”整体命中而不是只命中“进展”
+            alternatives = "|".join(_term_pattern(p) for p in sorted(patterns, key=len, reverse=True))
+            groups.append(f"(?P<t{index}>{alternatives})")
+            self._group_tags[f"t{index}"] = tag
+        self._regex = re.compile("|".join(groups))
+
+    def tags(self, text):
+        found, negated = set(), set()
+        if not text:
+            return found, negated
+        negation_end = -1  # 否定作用范围的终点（不含）；-1 表示当前不在否定范围内
+        for match in self._regex.finditer(str(text)):
+            kind = match.lastgroup
+            if kind == "sep":
+                negation_end = -1
+            elif kind == "neg":
+                negation_end = match.end() + NEGATION_WINDOW
+            elif kind != "pseudo":
+                if match.start() < negation_end:
+                    negated.add(self._group_tags[kind])
+                    negation_end = match.end() + NEGATION_WINDOW
+                else:
+                    found.add(self._group_tags[kind])
+        return found, negated
+
+    def _walk_text(self, value):
+        if isinstance(value, str):
+            yield value
+        elif isinstance(value, dict):
+            for item in value.values():
+                yield from self._walk_text(item)
+        elif isinstance(value, list):
+            for item in value:
+                yield from self._walk_text(item)
+
+    def classify_case(self, data):
+        """
+        一次遍历整份病例 JSON，返回：
+        {"has_surgery": 全文是否提到（未被否定的）手术,
+         "treatments": [{"phase": 阶段名标签, "content": 方案/影像/标志物等其余字段标签}],
+         "events": [{"phase": 阶段名标签, "event": 事件描述标签, "event_negated": 事件描述中被否定的标签}]}
+        """
+        treatments = data.get("treatments", []) if isinstance(data.get("treatments"), list) else []
+        events = data.get("timeline_events", []) if isinstance(data.get("timeline_events"), list) else []
+        has_surgery = False
+
+        tx_tags = []
+        for tx in treatments:
+            phase, _ = self.tags(tx.get("phase", ""))
+            content = set()
+            for key, value in tx.items():
+                if key != "phase":
+                    for text in self._walk_text(value):
+                        content |= self.tags(text)[0]
+            tx_tags.append({"phase": phase, "content": content})
+            has_surgery = has_surgery or "surgery" in phase | content
+
+        evt_tags = []
+        for evt in events:
+            phase, _ = self.tags(evt.get("phase", ""))
+            found, negated = self.tags(evt.get("event", ""))
+            evt_tags.append({"phase": phase, "event": found, "event_negated": negated})
+            has_surgery = has_surgery or "surgery" in phase | found
+
+        if not has_surgery:
+            for key, value in data.items():
+                if key in ("treatments", "timeline_events"):
+                    continue
+                if any("surgery" in self.tags(text)[0] for text in self._walk_text(value)):
+                    has_surgery = True
+                    break
+        return {"has_surgery": has_surgery, "treatments": tx_tags, "events": evt_tags}
+
+# 进程内共享的默认分类器（构建一次）
+DEFAULT_CLASSIFIER = ClinicalTermClassifier()
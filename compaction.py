@@ -0,0 +1,244 @@
+import re
+import difflib
+import unicodedata
+from collections import deque
+
+from dates import find_date_keys
+
+# ==========================================
+# 🗜️ AI 解析前的病历文本压缩 (去重 + 去样板 + 空白规整)
+# ==========================================
+# OCR 出来的多页病历里充斥着每页重复的医院抬头、患者信息栏、页脚，以及重叠截图造成的重复段落。
+# 这些内容对 AI 提取毫无帮助，却按 token 计费并拉长 reasoner 的思考时间。
+# 这里的每一步都是确定性的、只删不改：含新数字（化验值、日期）的内容一律保留。
+
+PAGE_MARKER_LINE_RE = re.compile(r"^【第 ?\d+ ?页提取结果】$")
+
+# 默认样板行（整行匹配才删除，匹配前已做全半角归一化）；可通过 Settings 的 COMPACTION_EXTRA_PATTERNS 追加
+DEFAULT_BOILERPLATE_PATTERNS = (
+    r"第\s*\d+\s*页\s*[/,]?\s*(共\s*\d+\s*页)?",                    # 第1页 共3页 / 第 1 页/共 3 页
+    r"共\s*\d+\s*页\s*[/,]?\s*第\s*\d+\s*页",
+    r"(?i)(page|p\.)\s*\d+\s*(/|of)\s*\d+",
+    r"(打印时间|打印日期|打印人|打印者)\s*[:：].*",
+    r"(本报告|此报告|报告)仅(对|供).{0,12}(负责|参考)[。.]?",
+    r"((检验者|审核者|报告医师|审核医师|记录者|医师签名)\s*[:：]\s*\S{0,6}\s*)+",  # 只有签名、没有日期和结论的落款行
+)
+
+NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+CJK_RE = re.compile(r"[\u4e00-\u9fff]")
+
+def estimate_tokens(text):
+    """粗估 token 数（按 DeepSeek 官方经验值：1 个汉字约 0.6 token，其它字符约 0.3 token）"""
+    cjk = len(CJK_RE.findall(text))
+    return round(cjk * 0.6 + (len(text) - cjk) * 0.3)
+
+def _normalize_line(line):
+    line = unicodedata.normalize("NFKC", line)
+    return re.sub(r"[ \t\u3000]+", " ", line).strip()
+
+def _split_pages(lines):
+    """按【第 N 页提取结果】切页，返回 [(页标记或 None, [行])]；没有页标记时整份文本视为一页"""
+    pages = [(None, [])]
+    for line in lines:
+        if PAGE_MARKER_LINE_RE.match(line):
+            pages.append((line, []))
+        else:
+            pages[-1][1].append(line)
+    return [page for page in pages if page[0] is not None or any(page[1])]
+
+def _is_banner_candidate(line):
+    # 抬头/信息栏/页脚一般是带汉字的整句；纯数值、单位这类表格单元格即使跨页重复也不能删
+    return len(line) >= 6 and len(CJK_RE.findall(line)) >= 2
+
+def _edge_zones(lines, edge_lines):
+    """页首、页尾各 edge_lines 个非空行的下标"""
+    content = [i for i, line in enumerate(lines) if line]
+    return {"top": set(content[:edge_lines]), "bottom": set(content[-edge_lines:])}
+
+def _drop_running_headers(pages, edge_lines, removed):
+    """
+    在两页及以上的页首（或两页及以上的页尾）重复出现的行视为抬头/信息栏/页脚：保留第一次出现，其余删除。
+    页首、页尾分开统计，上一页结尾与下一页开头的重叠内容交给 _drop_page_overlaps 处理。
+    """
+    if len(pages) < 2:
+        return pages
+    seen_on = {}
+    for page_no, (_, lines) in enumerate(pages):
+        for zone, indexes in _edge_zones(lines, edge_lines).items():
+            for i in indexes:
+                if _is_banner_candidate(lines[i]):
+                    seen_on.setdefault((zone, lines[i]), set()).add(page_no)
+    repeated = {key for key, page_nos in seen_on.items() if len(page_nos) >= 2}
+    kept_once = set()
+    result = []
+    for marker, lines in pages:
+        zones = _edge_zones(lines, edge_lines)
+        out = []
+        for i, line in enumerate(lines):
+            keys = [(zone, line) for zone, indexes in zones.items() if i in indexes and (zone, line) in repeated]
+            if keys:
+                if any(key in kept_once for key in keys):
+                    removed.append(("header_footer", line))
+                    continue
+                kept_once.update(keys)
+            out.append(line)
+        result.append((marker, out))
+    return result
+
+def _drop_page_overlaps(pages, removed):
+    """重叠截图：下一页开头若与上一页结尾的若干行完全一致，删掉下一页开头的这部分"""
+    result = []
+    prev_tail = []
+    for marker, lines in pages:
+        content = [line for line in lines if line]
+        overlap = 0
+        for k in range(min(len(prev_tail), len(content)), 0, -1):
+            # 只重叠一行时要求这一行足够长，避免把“血常规”这类常见短标题误判为重叠
+            if prev_tail[-k:] == content[:k] and (k >= 2 or len(content[0]) >= 15):
+                overlap = k
+                break
+        if overlap:
+            removed.extend(("page_overlap", line) for line in content[:overlap])
+            # 按非空行计数跳过，原有空行（段落分隔）随之去掉
+            skipped, start = 0, 0
+            while skipped < overlap:
+                if lines[start]:
+                    skipped += 1
+                start += 1
+            lines = lines[start:]
+        result.append((marker, lines))
+        prev_tail = content if content else prev_tail
+    return result
+
+def _blocks(lines):
+    """按空行分段；OCR 页内没有空行时整页就是一段"""
+    blocks, buf = [], []
+    for line in lines:
+        if line:
+            buf.append(line)
+        elif buf:
+            blocks.append(buf)
+            buf = []
+    if buf:
+        blocks.append(buf)
+    return blocks
+
+def _covered_ratio(prev_text, text):
+    """text 有多大比例的字符能在 prev_text 中按顺序找到（0~1）；先用快速上界排除明显不相似的段落"""
+    matcher = difflib.SequenceMatcher(None, prev_text, text, autojunk=False)
+    upper = matcher.quick_ratio() * (len(prev_text) + len(text)) / 2
+    if upper < len(text) * 0.5:
+        return upper / len(text)
+    return sum(block.size for block in matcher.get_matching_blocks()) / len(text)
+
+def _drop_near_duplicates(pages, threshold, min_block_chars, removed, window=64):
+    """
+    近似重复段落（如两张截图里同一张化验单）：本段 ≥ threshold 的内容已在前文某段中出现，
+    且本段没有前文那段之外的数字（化验值、日期）时才删除，保证不丢临床数值。
+    重复截图只会出现在同一页或相邻两页，且属于同一个日期：只和同页/上一页、所属日期相同的段落比较。
+    所属日期取段内第一个日期，段内没有日期时取前文最近的日期标题——
+    不同日期下数值相同的复查（如两次随访 CEA 都稳定）是两个时间点，必须都留给 AI。
+    完全相同的段落按哈希直接判定；近似比较只和最近 window 个保留段落做，
+    并先按长度、二字组重合度排除明显不相似的段落，才交给逐字符的 SequenceMatcher，超长病历上不再是段落数的平方。
+    """
+    exact = {}  # (文本, 所属日期) -> 最近一次保留时的页序号
+    kept = deque(maxlen=window)  # [(文本, 数字集合, 二字组集合, 页序号, 所属日期)]
+    current_date = None  # 前文最近的日期
+    result = []
+    for page_no, (marker, lines) in enumerate(pages):
+        out_blocks = []
+        for block in _blocks(lines):
+            text = "\n".join(block)
+            block_dates = find_date_keys(text)
+            date = block_dates[0][1] if block_dates else current_date
+            if block_dates:
+                current_date = block_dates[-1][1]
+            numbers = set(NUMBER_RE.findall(text))
+            bigrams = {text[i:i + 2] for i in range(len(text) - 1)}
+            duplicate = False
+            if len(text) >= min_block_chars:
+                if page_no - exact.get((text, date), -2) <= 1:
+                    duplicate = True
+                else:
+                    min_prev_len = len(text) * threshold  # 前文段落比这还短时覆盖率不可能达到 threshold
+                    # 覆盖率达标时，前文那段里找不到的二字组只能来自未匹配的字符（每个最多带坏两个）和匹配片段的接缝，
+                    # 按未匹配字符数的三倍放宽
+                    max_missing = 3 * (1 - threshold) * len(text)
+                    for prev_text, prev_numbers, prev_bigrams, prev_page, prev_date in kept:
+                        if page_no - prev_page > 1 or prev_date != date:
+                            continue
+                        if len(prev_text) < min_prev_len or not numbers <= prev_numbers \
+                                or len(bigrams - prev_bigrams) > max_missing:
+                            continue
+                        if _covered_ratio(prev_text, text) >= threshold:
+                            duplicate = True
+                            break
+            if duplicate:
+                removed.extend(("near_duplicate", line) for line in block)
+                continue
+            if len(text) >= min_block_chars:
+                exact[(text, date)] = page_no
+                kept.append((text, numbers, bigrams, page_no, date))
+            out_blocks.append(block)
+        # 段与段之间保留一个空行
+        out = []
+        for block in out_blocks:
+            if out:
+                out.append("")
+            out.extend(block)
+        result.append((marker, out))
+    return result
+
+def compact_medical_text(text, extra_patterns=(), strip_page_markers=True, edge_lines=3,
+                         near_duplicate_ratio=0.9, min_block_chars=40):
+    """
+    确定性地压缩病历文本，返回 (压缩后文本, 统计信息)。依次执行：
+    全半角/空白规整 -> 样板行删除（DEFAULT_BOILERPLATE_PATTERNS + extra_patterns）-> 近似重复段落删除
+    -> 跨页重复抬头/页脚删除 -> 重叠截图去重 -> 多余空行合并。
+    strip_page_markers=False 时保留【第 N 页提取结果】标记（超长病历分段解析要靠它切块）。
+    统计信息：chars_before/after、tokens_before/after（估算）、removed {步骤: 删除行数}、samples 前若干条被删行。
+    """
+    patterns = [re.compile(p) for p in (*DEFAULT_BOILERPLATE_PATTERNS, *extra_patterns) if p]
+    removed = []
+
+    lines = []
+    for raw in text.splitlines():
+        line = _normalize_line(raw)
+        if line and any(p.fullmatch(line) for p in patterns):
+            removed.append(("boilerplate", line))
+            continue
+        lines.append(line)
+
+    pages = _split_pages(lines)
+    # 先删整段重复，避免抬头检测把重复截图删掉一半、留下残段
+    pages = _drop_near_duplicates(pages, near_duplicate_ratio, min_block_chars, removed)
+    pages = _drop_running_headers(pages, edge_lines, removed)
+    pages = _drop_page_overlaps(pages, removed)
+
+    parts = []
+    for marker, page_lines in pages:
+        body = "\n".join(page_lines).strip()
+        if not body:
+            if marker:
+                removed.append(("page_marker", marker))
+            continue
+        if marker and not strip_page_markers:
+            parts.append(f"{marker}\n{body}")
+        else:
+            if marker:
+                removed.append(("page_marker", marker))
+            parts.append(body)
+    compacted = "\n\n".join(parts)
+
+    counts = {}
+    for step, _ in removed:
+        counts[step] = counts.get(step, 0) + 1
+    stats = {
+        "chars_before": len(text),
+        "chars_after": len(compacted),
+        "tokens_before": estimate_tokens(text),
+        "tokens_after": estimate_tokens(compacted),
+        "removed": counts,
+        "samples": [f"[{step}] {line}" for step, line in removed if step != "page_marker"][:12],
+    }
+    return compacted, stats
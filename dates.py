@@ -0,0 +1,49 @@
+import re
+import unicodedata
+
+# ==========================================
+# 📅 日期解析 (时间轴排序、分段合并去重、检验值采样日期共用同一套规则)
+# ==========================================
+# 支持 “2021-03-15”“2021/3/5”“2021.3”“2021年3月5日”“2021年3月”“2021年”“20210315”，解析为可排序的 (年, 月, 日)，
+# 缺省的月、日为 0。月、日越界（“2021-13”）的不算日期。
+DATE_RE = re.compile(
+    r"(?<!\d)(?:"
+    # 年与月之间必须有分隔符；日与月之间不允许空格，避免把 “2021.01 - 2021.05” 里的 “- 20” 当成日期的“日”
+    r"(?P<year>(?:19|20)\d{2})\s*[-./年]\s*(?P<month>\d{1,2})(?!\d)(?:[-./]|月\s*)?(?:(?<=[-./月 ])(?P<day>\d{1,2})(?!\d))?"
+    r"|(?P<compact_year>(?:19|20)\d{2})(?P<compact_month>0[1-9]|1[0-2])(?P<compact_day>[0-3]\d)(?!\d)"
+    r"|(?P<year_only>(?:19|20)\d{2})\s*年"
+    r")"
+)
+
+def date_key(match):
+    """DATE_RE 的一次匹配对应的 (年, 月, 日)；月、日越界返回 None"""
+    if match.group("year"):
+        year, month, day = match.group("year"), match.group("month"), match.group("day")
+    elif match.group("compact_year"):
+        year, month, day = match.group("compact_year"), match.group("compact_month"), match.group("compact_day")
+    else:
+        return (int(match.group("year_only")), 0, 0)
+    year, month, day = int(year), int(month), int(day or 0)
+    if not 1 <= month <= 12 or day > 31:
+        return None
+    return (year, month, day)
+
+def find_date_keys(text):
+    """文本中全部有效日期，返回 [(起始位置, (年, 月, 日))]；text 需已做全半角归一化"""
+    keys = []
+    for match in DATE_RE.finditer(text):
+        key = date_key(match)
+        if key:
+            keys.append((match.start(), key))
+    return keys
+
+def parse_date_key(text):
+    """文本中第一个有效日期的 (年, 月, 日)，缺省的月、日为 0；没有日期返回 None"""
+    keys = find_date_keys(unicodedata.normalize("NFKC", str(text)))
+    return keys[0][1] if keys else None
+
+def format_date_key(key):
+    year, month, day = key
+    if not month:
+        return str(year)
+    return f"{year}-{month:02d}-{day:02d}" if day else f"{year}-{month:02d}"
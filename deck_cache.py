@@ -0,0 +1,144 @@
+import io
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from lxml import etree
+from pptx.oxml import parse_xml
+from pptx.oxml.ns import qn
+from pptx.opc.constants import CONTENT_TYPE as CT
+from pptx.opc.constants import RELATIONSHIP_TYPE as RT
+from pptx.parts.chart import ChartPart
+
+from ppt_maker import AdvancedPPTMaker
+from tracing import span
+
+# ==========================================
+# ♻️ 增量重排 (按页面单元指纹缓存幻灯片，改一处 JSON 只重画受影响的页)
+# ==========================================
+def _snapshot_slide(slide):
+    """
+    把一页幻灯片存成与 Presentation 无关的字节快照：版式 partname、形状树 XML、图表（图表 XML + 内嵌数据表）。
+    成品里只有版式与图表两类关系；图表 XML 去掉 externalData，还原时重新挂内嵌数据表。
+    """
+    charts = []
+    for rId, rel in slide.part.rels.items():
+        if rel.reltype == RT.SLIDE_LAYOUT:
+            continue
+        if rel.reltype != RT.CHART:
+            raise ValueError(f"增量重排不支持的幻灯片关系类型：{rel.reltype}")
+        chart_part = rel.target_part
+        xlsx_part = chart_part.chart_workbook.xlsx_part
+        chart_space = parse_xml(chart_part.blob)
+        for external in chart_space.findall(qn("c:externalData")):
+            chart_space.remove(external)
+        charts.append((rId, etree.tostring(chart_space), xlsx_part.blob if xlsx_part is not None else None))
+    return {"layout": str(slide.slide_layout.part.partname), "sp_tree": etree.tostring(slide.shapes._spTree),
+            "charts": tuple(charts)}
+
+def _restore_slide(prs, layouts, snapshot):
+    """按快照在 prs 末尾追加一页，返回新页的 sldId 元素"""
+    slide = prs.slides.add_slide(layouts[snapshot["layout"]])
+    old = slide.shapes._spTree
+    sp_tree = parse_xml(snapshot["sp_tree"])
+    old.addprevious(sp_tree)
+    old.getparent().remove(old)
+    if snapshot["charts"]:
+        package = slide.part.package
+        rid_map = {}
+        for old_rid, chart_xml, xlsx_blob in snapshot["charts"]:
+            chart_part = ChartPart.load(package.next_partname(ChartPart.partname_template), CT.DML_CHART,
+                                        package, chart_xml)
+            if xlsx_blob is not None:
+                chart_part.chart_workbook.update_from_xlsx_blob(xlsx_blob)
+            rid_map[old_rid] = slide.part.relate_to(chart_part, RT.CHART)
+        for chart in sp_tree.iter(qn("c:chart")):
+            chart.set(qn("r:id"), rid_map[chart.get(qn("r:id"))])
+    return prs.slides._sldIdLst[-1]
+
+class IncrementalDeckRenderer:
+    """
+    增量生成 PPT：按 AdvancedPPTMaker.render_units 把成品拆成页面单元（封面、基线、每个治疗阶段、趋势图、
+    本次入院、时间轴、总结），每个单元的输入（病例字段 + 术语标签）连同模板与测量字体算一个指纹。
+    指纹命中时直接用缓存的幻灯片快照拼回成品，只有输入变了的单元重新排版；
+    首次生成（全部未命中）与直接 build() 结果一致。
+
+    缓存按指纹做 LRU，存的是不可变字节，实例可在多线程间共享。
+    """
+    def __init__(self, template, measurer, classifier=None, max_entries=256):
+        self.template = template
+        self.measurer = measurer
+        self.classifier = classifier
+        self.max_entries = max_entries
+        self._slides = OrderedDict()
+        self._lock = threading.Lock()
+        self._env = [template.fingerprint, measurer.font_path]
+
+    def fingerprint(self, kind, inputs):
+        payload = json.dumps([self._env, kind, inputs], ensure_ascii=False, sort_keys=True, default=sorted)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _get(self, key):
+        with self._lock:
+            snapshots = self._slides.get(key)
+            if snapshots is not None:
+                self._slides.move_to_end(key)
+            return snapshots
+
+    def _put(self, key, snapshots):
+        with self._lock:
+            self._slides[key] = snapshots
+            self._slides.move_to_end(key)
+            while len(self._slides) > self.max_entries:
+                self._slides.popitem(last=False)
+
+    def render(self, case_json):
+        """
+        返回 (PPT 字节, 统计)。统计为 {"units": 单元数, "rebuilt": 重新排版的单元名列表,
+        "slides": 总页数, "reused_slides": 复用缓存的页数, "seconds": 耗时}。
+        与 AdvancedPPTMaker 一样会就地规整 case_json（阶段改名）。
+        """
+        start = time.perf_counter()
+        maker = AdvancedPPTMaker(case_json, classifier=self.classifier, measurer=self.measurer,
+                                 template=self.template)
+        prs = maker.prs
+        sld_id_lst = prs.slides._sldIdLst
+        # 先按顺序重画未命中的单元（新页直接留在 maker.prs 里），命中的单元稍后从快照追加，最后统一排序
+        plan, rebuilt = [], []
+        for kind, inputs, build_unit in maker.render_units():
+            key = self.fingerprint(kind, inputs)
+            snapshots = self._get(key)
+            if snapshots is None:
+                first = len(sld_id_lst)
+                with span(f"ppt.make_{kind}"):
+                    build_unit()
+                new_ids = list(sld_id_lst)[first:]
+                slides = list(prs.slides)[first:]
+                self._put(key, tuple(_snapshot_slide(slide) for slide in slides))
+                plan.append(new_ids)
+                rebuilt.append(kind)
+            else:
+                plan.append(snapshots)
+
+        reused = 0
+        with span("ppt.restore_slides") as current:
+            layouts = None
+            for i, entry in enumerate(plan):
+                if isinstance(entry, tuple):
+                    if layouts is None:
+                        layouts = {str(layout.part.partname): layout for layout in prs.slide_layouts}
+                    plan[i] = [_restore_slide(prs, layouts, snapshot) for snapshot in entry]
+                    reused += len(entry)
+            ordered = [sld_id for entry in plan for sld_id in entry]
+            if reused:
+                for sld_id in ordered:
+                    sld_id_lst.append(sld_id)  # lxml 的 append 会把已有元素移到末尾，即按单元顺序重排
+            current.set(slides=reused)
+
+        buf = io.BytesIO()
+        with span("ppt.save", slides=len(ordered)):
+            prs.save(buf)
+        stats = {"units": len(plan), "rebuilt": rebuilt, "slides": len(ordered), "reused_slides": reused,
+                 "seconds": time.perf_counter() - start}
+        return buf.getvalue(), stats
@@ -0,0 +1,238 @@
+import io
+import os
+import json
+import copy
+import hashlib
+import threading
+from pptx import Presentation
+from pptx.util import Inches, Pt
+from pptx.dml.color import RGBColor
+from pptx.oxml import parse_xml
+from pptx.oxml.ns import nsdecls
+from pptx.enum.shapes import PP_PLACEHOLDER
+from pptx.text.text import _Paragraph
+
+# ==========================================
+# 🎨 PPT 模板与样式预设 (母版解析一次，进程内缓存)
+# ==========================================
+# 主题：配色表 + 对样式预设的覆盖。科室可在 PPT_THEME_PATH 指向的 JSON 里追加/覆盖主题，
+# 格式 {"主题名": {"colors": {"primary": "1F4E79", ...}, "styles": {"body": {"size": 18}, ...}}}，无需改代码。
+THEMES = {
+    "default": {"colors": {
+        "primary": "731528",      # 院徽红：标题栏、小标题、时间轴节点
+        "accent": "003366",       # 深蓝：肿瘤标志物、趋势线
+        "on_primary": "FFFFFF",
+        "text": "1E1E1E",
+        "strong": "000000",
+        "muted": "323232",
+        "progression": "DC3232",  # 进展/偏高
+        "control": "2E8B57",      # 病情控制
+        "low": "E68C1E",          # 偏低
+        "axis": "DCDCDC",
+        "card_fill": "FAFAFA",
+        "grid": "E6E6E6",
+        "reference": "A0A0A0",
+        "band": "ECE0E3",
+        "band_alt": "DEE6F0",
+    }},
+    "navy": {"colors": {"primary": "1F3A5F", "accent": "8C2F39", "band": "DCE3EC", "band_alt": "F0E0E2"}},
+    "teal": {"colors": {"primary": "0F5257", "accent": "2B4C7E", "band": "D9ECEC", "band_alt": "E0E6F0"}},
+}
+
+# 样式预设：各页构建时按名字取用，颜色写配色表里的角色名。字号单位 pt
+STYLE_PRESETS = {
+    "header":           {"size": 28, "bold": True, "color": "on_primary"},
+    "cover_title":      {"size": 48, "bold": True, "color": "on_primary"},
+    "heading":          {"size": 20, "bold": True, "color": "primary"},
+    "lead":             {"size": 20},
+    "body":             {"size": 16},
+    "body_muted":       {"size": 16, "color": "muted"},
+    "body_accent":      {"size": 16, "color": "accent"},
+    "body_large":       {"size": 18},
+    "highlight":        {"size": 22, "bold": True},
+    "discussion_title": {"size": 22, "bold": True, "color": "strong"},
+    "discussion":       {"size": 20, "bold": True},
+    "chart_title":      {"size": 14, "bold": True, "color": "primary"},
+    "chart_axis":       {"size": 9},
+    "chart_label":      {"size": 10},
+    "card_date":        {"size": 10, "bold": True},
+    "card_phase":       {"size": 9, "bold": True},
+    "card_body":        {"size": 9, "color": "text"},
+    "band_label":       {"size": 8, "color": "primary"},
+}
+
+SLIDE_WIDTH = Inches(13.333)
+SLIDE_HEIGHT = Inches(7.5)
+HEADER_HEIGHT = Inches(0.9)
+
+def load_themes(theme_path=""):
+    """内置主题 + JSON 文件里的主题（同名覆盖对应的颜色与样式）"""
+    themes = copy.deepcopy(THEMES)
+    if theme_path:
+        with open(theme_path, encoding="utf-8") as f:
+            for name, theme in json.load(f).items():
+                merged = themes.setdefault(name, {})
+                for section in ("colors", "styles"):
+                    merged.setdefault(section, {}).update(theme.get(section, {}))
+    return themes
+
+def _find_layout(prs, want_title):
+    """按占位符挑版式：want_title 时找“仅标题”版式（只有标题占位符），否则找空白版式"""
+    fallback = None
+    for index, layout in enumerate(prs.slide_layouts):
+        types = {ph.placeholder_format.type for ph in layout.placeholders} - {
+            PP_PLACEHOLDER.DATE, PP_PLACEHOLDER.FOOTER, PP_PLACEHOLDER.SLIDE_NUMBER}
+        if want_title and types == {PP_PLACEHOLDER.TITLE}:
+            return index
+        if not want_title and not types:
+            return index
+        if want_title and fallback is None and PP_PLACEHOLDER.TITLE in types:
+            fallback = index
+    return fallback
+
+def _set_title_style(placeholder, style, align="l", anchor="ctr"):
+    """把版式里标题占位符的字号/粗细/颜色写进 lstStyle，套用该版式的幻灯片标题直接继承，不再逐段设置"""
+    tx_body = placeholder._element.txBody
+    body_pr = tx_body.find(f"{{{tx_body.nsmap['a']}}}bodyPr")
+    body_pr.set("anchor", anchor)
+    old = tx_body.find(f"{{{tx_body.nsmap['a']}}}lstStyle")
+    new = parse_xml(
+        f'<a:lstStyle {nsdecls("a")}><a:lvl1pPr algn="{align}">'
+        f'<a:defRPr sz="{int(style["size"] * 100)}" b="{1 if style.get("bold") else 0}">'
+        f'<a:solidFill><a:srgbClr val="{style["color"]}"/></a:solidFill></a:defRPr></a:lvl1pPr></a:lstStyle>'
+    )
+    old.addprevious(new)
+    tx_body.remove(old)
+
+def _insert_background_rect(layout, width, height, color):
+    """在版式最底层放一个纯色矩形（标题栏/封面底色），所有套用该版式的幻灯片共享，不占幻灯片本身的体积"""
+    sp_tree = layout.shapes._spTree
+    next_id = max([int(el.get("id")) for el in sp_tree.iter() if el.tag.endswith("}cNvPr")] + [1]) + 1
+    sp = parse_xml(
+        f'<p:sp {nsdecls("p", "a")}><p:nvSpPr><p:cNvPr id="{next_id}" name="Brand Bar"/><p:cNvSpPr/>'
+        f'<p:nvPr userDrawn="1"/></p:nvSpPr><p:spPr><a:xfrm><a:off x="0" y="0"/>'
+        f'<a:ext cx="{int(width)}" cy="{int(height)}"/></a:xfrm><a:prstGeom prst="rect"><a:avLst/></a:prstGeom>'
+        f'<a:solidFill><a:srgbClr val="{color}"/></a:solidFill><a:ln><a:noFill/></a:ln></p:spPr></p:sp>'
+    )
+    sp_tree.insert(2, sp)  # nvGrpSpPr、grpSpPr 之后，占位符之前
+
+def _drop_slides(prs):
+    """模板里自带的示例页不进入成品"""
+    sld_id_lst = prs.slides._sldIdLst
+    for sld_id in list(sld_id_lst):
+        prs.part.drop_rel(sld_id.rId)
+        sld_id_lst.remove(sld_id)
+
+class DeckTemplate:
+    """
+    成品 PPT 的母版：医院模板（.pptx）或内置默认版式 + 主题配色 + 样式预设。
+    构造时解析一次模板：删掉示例页、定位“仅标题”/标题页/空白版式；内置版式时把标题栏色块和标题样式直接写进版式，
+    每页只需填标题文字。结果序列化为字节缓存，每次生成 PPT 从字节载入一份新的 Presentation。
+    模板需为 16:9 宽屏，正文排版按 13.333 × 7.5 英寸设计。
+    """
+    def __init__(self, template_path="", theme="default", theme_path=""):
+        themes = load_themes(theme_path)
+        if theme not in themes:
+            raise ValueError(f"未知的 PPT 主题：{theme}（可选：{'、'.join(themes)}）")
+        self.template_path = template_path
+        self.theme_name = theme
+        palette = {**THEMES["default"]["colors"], **themes[theme].get("colors", {})}
+        self.colors = {name: RGBColor.from_string(value) for name, value in palette.items()}
+        self.styles = {}
+        for name, preset in STYLE_PRESETS.items():
+            style = {**preset, **themes[theme].get("styles", {}).get(name, {})}
+            if isinstance(style.get("color"), str):
+                style["color"] = self.colors[style["color"]]
+            self.styles[name] = style
+        self._palette = palette
+        self._ppr_cache = {}
+        self._master = self._build_master()
+        # 母版 + 样式决定成品外观，增量重排（deck_cache）把它计入每页的指纹
+        styles = json.dumps(self.styles, sort_keys=True, default=str).encode("utf-8")
+        self.fingerprint = hashlib.sha256(self._master + styles).hexdigest()
+
+    def _build_master(self):
+        prs = Presentation(self.template_path) if self.template_path else Presentation()
+        prs.slide_width, prs.slide_height = SLIDE_WIDTH, SLIDE_HEIGHT
+        _drop_slides(prs)
+        self.title_layout = _find_layout(prs, want_title=True)
+        self.blank_layout = _find_layout(prs, want_title=False)
+        if self.blank_layout is None:
+            self.blank_layout = len(prs.slide_layouts) - 1
+        self.cover_layout = None
+        if not self.template_path:
+            # 内置版式：标题栏（整条色块 + 白色粗体标题）与封面（满版底色 + 居中大标题）都做进版式
+            layout = prs.slide_layouts[self.title_layout]
+            _insert_background_rect(layout, SLIDE_WIDTH, HEADER_HEIGHT, self._palette["primary"])
+            title = next(ph for ph in layout.placeholders if ph.placeholder_format.type == PP_PLACEHOLDER.TITLE)
+            title.left, title.top, title.width, title.height = Inches(0.5), Inches(0.05), Inches(10), Inches(0.8)
+            _set_title_style(title, self.styles["header"])
+
+            self.cover_layout = 0
+            cover = prs.slide_layouts[self.cover_layout]
+            _insert_background_rect(cover, SLIDE_WIDTH, SLIDE_HEIGHT, self._palette["primary"])
+            for ph in list(cover.placeholders):
+                if ph.placeholder_format.type == PP_PLACEHOLDER.CENTER_TITLE:
+                    ph.left, ph.top, ph.width, ph.height = Inches(1.5), Inches(3), Inches(10), Inches(2)
+                    _set_title_style(ph, self.styles["cover_title"], align="ctr")
+                elif ph.placeholder_format.type == PP_PLACEHOLDER.SUBTITLE:
+                    ph._element.getparent().remove(ph._element)
+        else:
+            for index, layout in enumerate(prs.slide_layouts):
+                if any(ph.placeholder_format.type == PP_PLACEHOLDER.CENTER_TITLE for ph in layout.placeholders):
+                    self.cover_layout = index
+                    break
+        buf = io.BytesIO()
+        prs.save(buf)
+        return buf.getvalue()
+
+    def new_presentation(self):
+        return Presentation(io.BytesIO(self._master))
+
+    def color(self, name):
+        return self.colors[name]
+
+    def style(self, name, text, **overrides):
+        """按预设生成 layout.paginate 使用的段落描述"""
+        return {**self.styles[name], "text": text, **overrides}
+
+    def paragraph_properties(self, para, scale=1.0):
+        """
+        段落描述对应的 <a:pPr>（字号、粗体、颜色、对齐、段前段后）。同一组合只通过 python-pptx 接口生成一次，
+        之后每个段落直接复制这段 XML，不再逐项设置属性。
+        """
+        key = (para["size"] * scale, bool(para.get("bold")), str(para.get("color") or ""), para.get("align"),
+               para.get("space_before", 0) * scale, para.get("space_after", 0) * scale)
+        ppr = self._ppr_cache.get(key)
+        if ppr is None:
+            p = _Paragraph(parse_xml(f"<a:p {nsdecls('a')}/>"), None)
+            p.font.size = Pt(para["size"] * scale)
+            if para.get("bold"):
+                p.font.bold = True
+            if para.get("color") is not None:
+                p.font.color.rgb = para["color"]
+            if para.get("space_before"):
+                p.space_before = Pt(para["space_before"] * scale)
+            if para.get("space_after"):
+                p.space_after = Pt(para["space_after"] * scale)
+            if para.get("align") is not None:
+                p.alignment = para["align"]
+            ppr = p._p.pPr
+            self._ppr_cache[key] = ppr
+        return copy.deepcopy(ppr)
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+def _mtime(path):
+    return os.path.getmtime(path) if path and os.path.exists(path) else None
+
+def load_deck_template(template_path="", theme="default", theme_path=""):
+    """按 (模板, 主题) 缓存 DeckTemplate；模板或主题文件修改后自动重新解析"""
+    key = (template_path, _mtime(template_path), theme, theme_path, _mtime(theme_path))
+    with _templates_lock:
+        template = _templates.get(key)
+        if template is None:
+            template = DeckTemplate(template_path, theme, theme_path)
+            _templates[key] = template
+        return template
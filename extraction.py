@@ -0,0 +1,660 @@
+import re
+import json
+import time
+import hashlib
+import unicodedata
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from dates import parse_date_key
+from tracing import span, add_metric
+
+# ==========================================
+# 2. AI 结构化提取模块 (学术级深度总结 + 严谨分线)
+# ==========================================
+DEEPSEEK_BASE_URL = "https://api.deepseek.com"
+REASONER_MODEL = "deepseek-reasoner"
+
+# 【优化核心】：放权临床推理，锁死输出接口
+SYSTEM_PROMPT = """
+    你是一位顶级的肿瘤内科专家，正在梳理一份复杂的临床病历，准备进行高水平的学术会议汇报（如胃肠肿瘤或妇科肿瘤领域的病例探讨）。
+    
+    【核心任务与自由度】
+    1. 自由梳理逻辑：请发挥你的专业临床判断力，自主分析患者的疾病进展时间轴。你来决定如何划分治疗线数（一线、二线、维持治疗等），并准确判断不同阶段的疗效转归（PR/SD/PD 等）。
+    2. 深度医学提炼：不要单纯当一个“文字搬运工”。请计算关键生存指标，评估治疗策略的得失，敏锐捕捉病程中的矛盾点或亮点（例如：特定靶向药跨线使用的疗效、某种耐药机制的出现等）。
+    
+    【系统接口规范（极度重要）】
+    为了对接下游的 PPT 自动渲染系统，你**必须且只能**输出一个标准的 JSON 对象。
+    严禁改变以下任何一个键名（Key），你可以根据你的临床推理自由填充对应的值（Value）：
+    
+    ```json
+    {
+        "cover": {"title": "晚期XXX癌综合治疗病例汇报"},
+        "baseline": {
+            "patient_info": "患者姓名(姓氏)、性别、年龄",
+            "chief_complaint": "主诉",
+            "diagnosis": "完整的临床及病理诊断",
+            "key_exams": "关键基线检查"
+        },
+        "treatments": [
+            {
+                "phase": "阶段名称（由你自主判断，如：一线治疗 / 维持治疗）", 
+                "duration": "具体时间段", 
+                "regimen": "完整的用药方案及局部治疗手段", 
+                "imaging": "影像学评估结果",
+                "markers": "肿瘤标志物变化"
+            }
+        ],
+        "current_admission": {
+            "exams": ["检验异常指标1", "检验异常指标2"],
+            "imaging": "本次核心影像结论",
+            "plan": ["后续治疗计划或考量1", "考量2"]
+        },
+        "timeline_events": [
+            {
+                "date": "年月", 
+                "phase": "线数或阶段",
+                "event_type": "Treatment 或 Evaluation",
+                "event": "高度凝练的事件短语"
+            }
+        ],
+        "summary": {
+            "highlights": [
+                "由你提炼的病例亮点1", 
+                "由你提炼的病例亮点2"
+            ],
+            "discussion": [
+                "值得探讨的临床深度问题1",
+                "值得探讨的临床深度问题2"
+            ]
+        }
+    }
+    ```
+    """
+
+def parse_partial_json(text):
+    """
+    流式输出过程中的“半截 JSON”尽力解析：把未闭合的字符串/对象/数组补齐后再 json.loads。
+    只用于实时预览，解析不出来就返回 None，最终结果仍以完整回复为准。
+    """
+    start = text.find("{")
+    if start < 0:
+        return None
+    stack = []
+    in_string = False
+    escaped = False
+    cut_points = []  # (截断位置, 该位置的括号栈)：截断后补齐括号即为合法 JSON 的候选点
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append(ch)
+            cut_points.append((i + 1, tuple(stack)))
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                try:
+                    return json.loads(text[start:i + 1], strict=False)
+                except json.JSONDecodeError:
+                    return None
+            cut_points.append((i + 1, tuple(stack)))
+        elif ch == ",":
+            cut_points.append((i, tuple(stack)))
+
+    def closers(opened):
+        return "".join("}" if c == "{" else "]" for c in reversed(opened))
+
+    # 先尝试保留正在输出的那一段（例如写到一半的 regimen），再依次退回到更早的安全截断点
+    tail = text[start:] + ('"' if in_string else "")
+    candidates = [tail + closers(stack)]
+    candidates += [text[start:pos] + closers(opened) for pos, opened in reversed(cut_points[-8:])]
+    for candidate in candidates:
+        try:
+            return json.loads(candidate, strict=False)
+        except json.JSONDecodeError:
+            continue
+    return None
+
+def _balanced_object(text, start):
+    """从 start 处的 { 开始做字符串感知的括号匹配，返回完整对象文本；没有闭合（回复被截断）返回 None"""
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            depth += 1
+        elif ch in "}]":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+def _strip_trailing_commas(text):
+    """去掉 } 或 ] 前多余的逗号（字符串内部的逗号不动）"""
+    out = []
+    in_string = False
+    escaped = False
+    for ch in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+        out.append(ch)
+    return "".join(out)
+
+# 中文引号字符串的结束位置：引号后（跳过空白）紧跟结构符号或文本结束
+_QUOTE_END_RE = re.compile(r"\s*(?:[}\],:，：]|$)")
+
+def _repair_json_text(text):
+    """
+    修复模型常见的 JSON 格式瑕疵：中文引号/全角标点当作结构符号、尾逗号。
+    与 _strip_trailing_commas 一样逐字符跟踪字符串：只改字符串外面的结构符号，值里的中文引号和全角标点原样保留。
+    用中文引号开头的字符串，遇到后面紧跟结构符号的中文引号（或英文引号）才算结束，其间的英文引号转义。
+    """
+    out = []
+    quote = None  # 当前字符串的开引号：'"' 或 "“"；None 表示在字符串外
+    escaped = False
+    for i, ch in enumerate(text):
+        if quote == '"':
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                quote = None
+            out.append(ch)
+        elif quote == "“":
+            if ch in '“”"' and _QUOTE_END_RE.match(text, i + 1):
+                quote = None
+                out.append('"')
+            else:
+                out.append('\\"' if ch == '"' else ch)
+        elif ch == '"':
+            quote = '"'
+            out.append(ch)
+        elif ch in "“”":
+            quote = "“"
+            out.append('"')
+        else:
+            out.append({"：": ":", "，": ","}.get(ch, ch))
+    return _strip_trailing_commas("".join(out))
+
+# 残缺回复补齐后救回的结果带此标记：可以先拿来预览/排版，但不写缓存，下次重新调用 AI
+PARTIAL_KEY = "_partial"
+# 超长病历分段解析时最终失败、未参与合并的段号
+FAILED_CHUNKS_KEY = "_failed_chunks"
+
+def parse_model_json(raw_content):
+    """
+    容错解析模型回复中的 JSON 对象，依次尝试：
+    1) 跳过前言/代码块标记/结尾说明，按括号匹配截出完整对象直接解析；
+    2) 修复中文引号、全角标点、尾逗号后再解析；
+    3) 回复被截断时，补齐未闭合的字符串和括号，尽量保住已输出的部分（结果带 PARTIAL_KEY 标记，不应写入缓存）。
+    全部失败才抛 ValueError。
+    """
+    text = (raw_content or "").lstrip("\ufeff")
+    starts = [m.start() for m in re.finditer(r"\{", text)][:5]
+    fallback = None
+    scanned_until = -1
+    for start in starts:
+        if start < scanned_until:
+            continue  # 上一个对象内部的花括号，不单独尝试
+        obj_text = _balanced_object(text, start)
+        if obj_text is None:
+            break  # 从这里开始就没有闭合，说明是截断，交给下面的补齐逻辑
+        scanned_until = start + len(obj_text)
+        for candidate in (obj_text, _repair_json_text(obj_text)):
+            try:
+                result = json.loads(candidate, strict=False)
+            except json.JSONDecodeError:
+                continue
+            # 前言里偶尔也有花括号：优先返回带接口字段的对象，避免把内层子对象误当成整份病例
+            if isinstance(result, dict) and set(result) & set(CASE_SCHEMA):
+                return result
+            if isinstance(result, dict) and fallback is None:
+                fallback = result
+            break
+    if fallback is not None:
+        return fallback
+    if starts:
+        partial = parse_partial_json(_repair_json_text(text[starts[0]:]))
+        if isinstance(partial, dict) and partial:
+            partial[PARTIAL_KEY] = True
+            return partial
+    # 如果模型偶尔没有严格遵守 JSON 格式，返回友好的报错信息
+    raise ValueError(f"AI 生成的数据无法解析为 JSON，请重试。原始返回摘要：{text[:100]}...")
+
+# 下游 PPT 渲染依赖的字段契约（字段名 -> 期望类型），与 SYSTEM_PROMPT 中的接口规范保持一致
+CASE_SCHEMA = {
+    "cover": {"title": str},
+    "baseline": {"patient_info": str, "chief_complaint": str, "diagnosis": str, "key_exams": str},
+    "treatments": [{"phase": str, "duration": str, "regimen": str, "imaging": str, "markers": str}],
+    "current_admission": {"exams": list, "imaging": str, "plan": list},
+    "timeline_events": [{"date": str, "phase": str, "event_type": str, "event": str}],
+    "summary": {"highlights": list, "discussion": list},
+}
+
+def _as_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, list):
+        return "；".join(_as_text(v) for v in value if _as_text(v))
+    if isinstance(value, dict):
+        return "；".join(f"{k}：{_as_text(v)}" for k, v in value.items() if _as_text(v))
+    return str(value)
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return [_as_text(v) for v in value if _as_text(v)]
+    if isinstance(value, dict):
+        return [f"{k}：{_as_text(v)}" for k, v in value.items() if _as_text(v)]
+    # 模型把列表写成了一整段文字：按换行/分号拆回条目
+    return [item.strip(" •·-") for item in re.split(r"[\n；;]+", _as_text(value)) if item.strip(" •·-")]
+
+def _coerce_fields(value, fields, text_key):
+    """按字段表补齐默认值并纠正类型；value 不是对象时整体当作 text_key 字段的内容"""
+    if not isinstance(value, dict):
+        value = {text_key: value}
+    out = dict(value)
+    for field, kind in fields.items():
+        out[field] = _as_list(value.get(field)) if kind is list else _as_text(value.get(field))
+    return out
+
+def normalize_case(data):
+    """
+    按 CASE_SCHEMA 校验并修正病例 JSON：缺失字段补默认值，列表/字符串错位时互相转换，
+    对象写成列表（或反之）时自动包装；接口外的额外字段原样保留。
+    """
+    if not isinstance(data, dict):
+        raise ValueError("AI 生成的数据不是 JSON 对象，请重试。")
+    case = dict(data)
+    for section, spec in CASE_SCHEMA.items():
+        value = data.get(section)
+        if isinstance(spec, list):
+            if isinstance(value, dict):
+                value = [value]
+            elif not isinstance(value, list):
+                value = [value] if value else []
+            text_key = "event" if section == "timeline_events" else "regimen"
+            case[section] = [_coerce_fields(item, spec[0], text_key) for item in value if item]
+        else:
+            if section == "summary" and isinstance(value, list):
+                value = {"highlights": value}
+            text_key = next(iter(spec))
+            case[section] = _coerce_fields(value if value is not None else {}, spec, text_key)
+
+    # 本次入院是可选章节：整段为空时保持空对象，下游据此跳过该页
+    if not any(case["current_admission"].get(field) for field in CASE_SCHEMA["current_admission"]):
+        case["current_admission"] = {}
+
+    for evt in case["timeline_events"]:
+        is_eval = "evaluation" in evt["event_type"].lower() or "评估" in evt["event_type"]
+        evt["event_type"] = "Evaluation" if is_eval else "Treatment"
+    if not case["cover"]["title"]:
+        case["cover"]["title"] = "病例汇报"
+    return case
+
+def make_llm_client(api_key, connect_timeout=10.0, read_timeout=600.0, max_retries=2):
+    """
+    创建 DeepSeek 客户端。客户端自带 HTTP 连接池且线程安全，应在进程内长期复用；
+    SDK 会对连接错误、408/409/429/5xx 按指数退避（带抖动）自动重试 max_retries 次。
+    reasoner 思考时间较长，读取超时要留足，连接超时则应尽早失败。
+    """
+    # 延迟导入：openai 包本身导入要数百毫秒，只在真正创建 DeepSeek 客户端时才加载（网页冷启动、回放后端都用不到）
+    from openai import OpenAI, Timeout
+    return OpenAI(
+        api_key=api_key, 
+        base_url=DEEPSEEK_BASE_URL,
+        timeout=Timeout(read_timeout, connect=connect_timeout),
+        max_retries=max_retries,
+    )
+
+def _record_usage(current, model, usage):
+    """把接口返回的 token 用量写进 span 属性并累加到计数器；回放后端没有用量信息时跳过"""
+    if usage is None:
+        return
+    details = getattr(usage, "completion_tokens_details", None)
+    tokens = {"prompt": usage.prompt_tokens or 0, "completion": usage.completion_tokens or 0,
+              "reasoning": getattr(details, "reasoning_tokens", None) or 0}
+    current.set(**{f"{kind}_tokens": count for kind, count in tokens.items()})
+    for kind, count in tokens.items():
+        add_metric("case_pipeline_llm_tokens_total", count, model=model, kind=kind)
+
+def extract_complex_case(patient_text, client, on_progress=None, system_prompt=SYSTEM_PROMPT, model=REASONER_MODEL):
+    """
+    调用 deepseek-reasoner（或 model 指定的其它模型）生成结构化病例 JSON。
+    传入 on_progress 时走流式模式：边接收边回调 on_progress(推理过程文本, 已解析出的部分 JSON)，
+    回调在当前线程内执行，节流到约每 0.4 秒一次。
+    """
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": patient_text}
+    ]
+    with span("llm.completion", model=model, stream=on_progress is not None, prompt_chars=len(patient_text)) as current:
+        if on_progress is None:
+            response = client.chat.completions.create(
+                model=model,
+                messages=messages
+                # 注意：移除了 response_format，因为 reasoner 模型不支持强制 JSON 模式
+            )
+            # 获取模型的最终输出内容（忽略前面冗长的 <think> 推理过程）
+            raw_content = response.choices[0].message.content
+            _record_usage(current, model, getattr(response, "usage", None))
+        else:
+            stream = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True}  # 最后一个数据块附带 token 用量
+            )
+            reasoning_parts = []
+            content_parts = []
+            last_emit = 0.0
+            for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    _record_usage(current, model, chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                # reasoner 先流出 reasoning_content（思考过程），再流出 content（最终 JSON）
+                reasoning = getattr(delta, "reasoning_content", None)
+                if reasoning:
+                    reasoning_parts.append(reasoning)
+                if delta.content:
+                    content_parts.append(delta.content)
+                now = time.time()
+                if now - last_emit >= 0.4:
+                    last_emit = now
+                    partial = parse_partial_json("".join(content_parts)) if content_parts else None
+                    on_progress("".join(reasoning_parts), partial)
+            raw_content = "".join(content_parts)
+
+    # 增加鲁棒性清洗：容错解析 + 按接口规范补齐/纠正字段，尽量在本地救回而不是让用户重跑一分钟
+    with span("llm.parse_json", chars=len(raw_content or "")) as current:
+        case_json = normalize_case(parse_model_json(raw_content))
+        current.set(partial=bool(case_json.get(PARTIAL_KEY)))
+        return case_json
+
+def normalize_patient_text(patient_text):
+    """缓存键用的归一化：全半角统一、去掉行尾空白和多余空行，避免无意义的格式差异导致缓存失效"""
+    text = unicodedata.normalize("NFKC", patient_text)
+    lines = [re.sub(r"[ \t\u3000]+", " ", line).strip() for line in text.splitlines()]
+    return "\n".join(line for line in lines if line)
+
+def llm_cache_key(patient_text, system_prompt=SYSTEM_PROMPT, model=REASONER_MODEL):
+    prompt_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:16]
+    text_hash = hashlib.sha256(normalize_patient_text(patient_text).encode("utf-8")).hexdigest()
+    return f"{model}:{prompt_hash}:{text_hash}"
+
+def get_cached_case(patient_text, cache, system_prompt=SYSTEM_PROMPT, model=REASONER_MODEL):
+    """只查缓存不调用 AI：命中返回病例 JSON，否则返回 None"""
+    if cache is None:
+        return None
+    cached = cache.get(llm_cache_key(patient_text, system_prompt=system_prompt, model=model))
+    return json.loads(cached) if cached is not None else None
+
+def has_cached_case(patient_text, cache, system_prompt=SYSTEM_PROMPT, model=REASONER_MODEL):
+    """缓存里是否已有解析结果；只是探测，不计入命中/未命中统计，也不刷新访问时间"""
+    return cache is not None and cache.contains(llm_cache_key(patient_text, system_prompt=system_prompt, model=model))
+
+def extract_case_with_cache(patient_text, client, cache, force=False, on_progress=None, system_prompt=SYSTEM_PROMPT,
+                            model=REASONER_MODEL):
+    """
+    先查本地缓存，未命中（或 force=True 强制重新生成）才真正调用 AI，成功后写回缓存。
+    cache 为 None 时不做缓存；残缺回复补齐救回的结果（PARTIAL_KEY）照常返回但不写缓存。返回 (病例 JSON, 是否来自缓存)。
+    """
+    key = llm_cache_key(patient_text, system_prompt=system_prompt, model=model)
+    if not force:
+        cached = get_cached_case(patient_text, cache, system_prompt=system_prompt, model=model)
+        if cached is not None:
+            return cached, True
+    case_json = extract_complex_case(patient_text, client, on_progress=on_progress, system_prompt=system_prompt,
+                                     model=model)
+    partial = case_json.pop(PARTIAL_KEY, False)
+    if cache is not None and not partial:
+        cache.set(key, json.dumps(case_json, ensure_ascii=False))
+    return case_json, False
+
+# ==========================================
+# 2.1 超长病历分段解析 (Map-Reduce)
+# ==========================================
+# 分段提取时追加在系统提示词后面：只让模型整理本段内容，跨段的推理交给本地合并
+CHUNK_PROMPT = SYSTEM_PROMPT + """
+    【分段提取说明（本次调用专用）】
+    你收到的只是一份超长病历中按时间顺序切出来的一个片段。请只依据本片段中明确出现的信息填写上述 JSON：
+    - 本片段没有涉及的字段请留空字符串或空数组，不要臆测其它片段的内容；
+    - treatments 与 timeline_events 请完整列出本片段内的所有治疗阶段和关键事件，日期尽量精确到年月；
+    - 输出的键名与结构必须与上面的接口规范完全一致。
+    """
+
+PAGE_MARKER_RE = re.compile(r"(?=【第 ?\d+ ?页提取结果】)")
+# 行首日期标题，如 “2021-03-15”“2021.3”“2021年3月”
+DATE_HEADING_RE = re.compile(r"(?m)(?=^[ \t]*\d{4}\s*(?:[-./年])\s*\d{1,2})")
+
+def split_medical_record(text, max_chars=6000):
+    """
+    把超长病历切成不超过 max_chars 的若干块：优先按【第 N 页提取结果】分页，
+    没有分页标记时按行首日期标题切分；相邻的小段会合并到同一块，保持时间顺序。
+    """
+    segments = [seg for seg in PAGE_MARKER_RE.split(text) if seg.strip()]
+    if len(segments) <= 1:
+        segments = [seg for seg in DATE_HEADING_RE.split(text) if seg.strip()]
+
+    pieces = []
+    for seg in segments:
+        if len(seg) <= max_chars:
+            pieces.append(seg)
+            continue
+        # 单页/单段本身就超长：退回到按行切，实在没有换行才硬切
+        buf = ""
+        for line in seg.splitlines(keepends=True):
+            while len(line) > max_chars:
+                pieces.append(line[:max_chars])
+                line = line[max_chars:]
+            if len(buf) + len(line) > max_chars:
+                pieces.append(buf)
+                buf = ""
+            buf += line
+        if buf.strip():
+            pieces.append(buf)
+
+    chunks = []
+    buf = ""
+    for piece in pieces:
+        if buf and len(buf) + len(piece) > max_chars:
+            chunks.append(buf)
+            buf = ""
+        buf += piece
+    if buf.strip():
+        chunks.append(buf)
+    return chunks
+
+def _norm_key(value):
+    """去重用的宽松比较键：忽略空白、标点和大小写"""
+    return re.sub(r"[\s\W_]+", "", str(value)).lower()
+
+def merge_case_fragments(fragments):
+    """
+    Reduce 阶段：把各分段提取出的局部 JSON 合并成一份完整病例。
+    基线信息取最早出现的非空值；治疗阶段和时间轴事件按顺序拼接并去重（重复时保留信息更全的一条），
+    时间轴按日期排序；本次入院取最后一个非空片段；亮点与讨论合并去重。
+    合并结果再过一遍 normalize_case，与单次调用的结果字段、类型完全一致。
+    """
+    merged = {
+        "cover": {"title": ""},
+        "baseline": {},
+        "treatments": [],
+        "current_admission": {},
+        "timeline_events": [],
+        "summary": {"highlights": [], "discussion": []},
+    }
+    treatment_index = {}
+    event_keys = set()
+    summary_keys = {"highlights": set(), "discussion": set()}
+
+    for frag in fragments:
+        if not merged["cover"]["title"]:
+            merged["cover"]["title"] = frag.get("cover", {}).get("title", "")
+        for field, value in frag.get("baseline", {}).items():
+            if value and not merged["baseline"].get(field):
+                merged["baseline"][field] = value
+
+        for tx in frag.get("treatments", []):
+            key = (_norm_key(tx.get("phase", "")), _norm_key(tx.get("duration", "")))
+            if key in treatment_index:
+                existing = treatment_index[key]
+                for field, value in tx.items():
+                    if len(str(value)) > len(str(existing.get(field, ""))):
+                        existing[field] = value
+            else:
+                treatment_index[key] = dict(tx)
+                merged["treatments"].append(treatment_index[key])
+
+        for evt in frag.get("timeline_events", []):
+            date = evt.get("date", "")
+            key = (parse_date_key(date) or _norm_key(date), _norm_key(evt.get("event", "")))
+            if key not in event_keys:
+                event_keys.add(key)
+                merged["timeline_events"].append(evt)
+
+        if frag.get("current_admission"):
+            merged["current_admission"] = frag["current_admission"]
+
+        summary = frag.get("summary", {})
+        if isinstance(summary, list):
+            summary = {"highlights": summary}
+        for section in ("highlights", "discussion"):
+            for item in summary.get(section, []):
+                if _norm_key(item) not in summary_keys[section]:
+                    summary_keys[section].add(_norm_key(item))
+                    merged["summary"][section].append(item)
+
+    # 无法解析日期的事件沿用前一个事件的排序键，保持其在原文中的相对位置（sorted 是稳定排序）
+    sort_keys = []
+    last_key = (0, 0, 0)
+    for evt in merged["timeline_events"]:
+        last_key = parse_date_key(evt.get("date", "")) or last_key
+        sort_keys.append(last_key)
+    order = sorted(range(len(sort_keys)), key=lambda i: sort_keys[i])
+    merged["timeline_events"] = [merged["timeline_events"][i] for i in order]
+
+    if not merged["cover"]["title"]:
+        merged["cover"]["title"] = "病例汇报"
+    for section in ("highlights", "discussion"):
+        merged["summary"][section] = merged["summary"][section][:5]
+    return normalize_case(merged)
+
+def _extract_chunk(index, attempt, chunk, client, cache, force):
+    with span("llm.chunk", index=index, attempt=attempt, chars=len(chunk)):
+        return extract_case_with_cache(chunk, client, cache, force, None, CHUNK_PROMPT)
+
+def extract_long_case(patient_text, client, cache, force=False, max_workers=4, chunk_chars=6000, on_chunk_done=None,
+                      chunk_retries=1):
+    """
+    超长病历 Map-Reduce：切块后并发提取（每块单独走缓存），再在本地合并。
+    某一块出错（超时、回复无法解析等）时单独重试 chunk_retries 次，仍失败就跳过该块，只合并成功的块，
+    失败块的段号（从 1 开始）记在结果的 FAILED_CHUNKS_KEY 字段里；所有块都失败时才抛出最后一个异常。
+    每完成一块（成功或最终失败）在调用线程里回调 on_chunk_done(已完成块数, 总块数, 当前已合并的病例 JSON, 失败段号列表)。
+    返回 (病例 JSON, 是否全部来自缓存)。
+    """
+    chunks = split_medical_record(patient_text, max_chars=chunk_chars)
+    fragments = [None] * len(chunks)
+    from_cache = []
+    failed = []
+    last_error = None
+    done_count = 0
+    with ThreadPoolExecutor(max_workers=max(1, int(max_workers))) as pool:
+        def submit(i, attempt):
+            future = pool.submit(contextvars.copy_context().run, _extract_chunk, i + 1, attempt, chunks[i],
+                                 client, cache, force)
+            pending[future] = (i, attempt)
+
+        pending = {}
+        for i in range(len(chunks)):
+            submit(i, 0)
+        while pending:
+            future = next(as_completed(pending))
+            i, attempt = pending.pop(future)
+            try:
+                fragments[i], hit = future.result()
+                from_cache.append(hit)
+            except Exception as e:
+                last_error = e
+                if attempt < chunk_retries:
+                    submit(i, attempt + 1)
+                    continue
+                failed.append(i + 1)
+            done_count += 1
+            if on_chunk_done:
+                on_chunk_done(done_count, len(chunks), merge_case_fragments([f for f in fragments if f]), sorted(failed))
+    if len(failed) == len(chunks):
+        raise last_error
+    case_json = merge_case_fragments([f for f in fragments if f])
+    if failed:
+        case_json[FAILED_CHUNKS_KEY] = sorted(failed)
+    return case_json, not failed and all(from_cache)
+
+# ==========================================
+# 2.2 快速草稿 vs 深度推理：字段级对比
+# ==========================================
+# 本地规则从原文算出的字段（不经过 AI），草稿与最终版两边总是相同，比较时跳过
+LOCAL_FIELDS = ("marker_trends", FAILED_CHUNKS_KEY)
+
+def diff_case_fields(draft, final, path="", ignore=LOCAL_FIELDS):
+    """
+    逐字段比较两份病例 JSON，返回 [(字段路径, 草稿值, 最终值)]，路径形如 baseline.diagnosis、treatments[1].regimen。
+    对象按键递归、对象列表按下标对齐（多出或缺少的条目整条列出），字符串列表整体比较；值为 None 表示该侧没有此项。
+    ignore 为不参与比较的顶层字段。
+    """
+    if isinstance(draft, dict) and isinstance(final, dict):
+        changes = []
+        for key in list(draft) + [k for k in final if k not in draft]:
+            if not path and key in ignore:
+                continue
+            sub_path = f"{path}.{key}" if path else key
+            changes.extend(diff_case_fields(draft.get(key), final.get(key), sub_path))
+        return changes
+    if isinstance(draft, list) and isinstance(final, list) \
+            and any(isinstance(item, dict) for item in draft + final):
+        changes = []
+        for i in range(max(len(draft), len(final))):
+            changes.extend(diff_case_fields(draft[i] if i < len(draft) else None,
+                                            final[i] if i < len(final) else None, f"{path}[{i}]"))
+        return changes
+    if draft == final or (not draft and not final):
+        return []
+    return [(path, draft, final)]
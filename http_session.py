@@ -0,0 +1,52 @@
+import random
+import inspect
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+# ==========================================
+# 🌐 共享 HTTP 连接池 (显式超时 + 抖动退避重试)
+# ==========================================
+# 网关限流 / 服务端临时故障时值得重发的 HTTP 状态码
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# backoff_jitter 是 urllib3 2.x 才有的参数；1.26 上不传，退化为不带抖动的指数退避
+_RETRY_HAS_JITTER = "backoff_jitter" in inspect.signature(Retry.__init__).parameters
+
+def backoff_delay(attempt, base=0.5, cap=8.0):
+    """第 attempt 次（从 0 开始）重试前的等待秒数：指数退避，一半固定一半随机，避免并发请求同时重发"""
+    delay = min(cap, base * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """带默认超时的连接池适配器：调用方没有显式传 timeout 时使用 (连接超时, 读取超时)"""
+    def __init__(self, timeout, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+def make_http_session(pool_size=10, retries=3, connect_timeout=5.0, read_timeout=30.0, backoff=0.5):
+    """
+    创建可在多线程间共享的 requests.Session：同一主机复用 keep-alive 连接（省掉每页一次 TLS 握手），
+    连接失败、读超时与 429/5xx 自动按指数退避 + 随机抖动重试，并遵循服务端的 Retry-After。
+    这是这些错误唯一的重试层：重试用尽后调用方应直接判失败，不要再整体重发（否则请求数按两层重试次数相乘）。
+    """
+    jitter = {"backoff_jitter": backoff} if _RETRY_HAS_JITTER else {}
+    retry = Retry(
+        total=retries, connect=retries, read=retries, status=retries,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=None,  # 百度接口都是 POST（默认不重试），识别与取 token 均可安全重发
+        backoff_factor=backoff, **jitter,
+        respect_retry_after_header=True,
+        raise_on_status=False,  # 重试用尽后把最后一次响应交给调用方，按接口返回的错误信息提示
+    )
+    adapter = TimeoutHTTPAdapter((connect_timeout, read_timeout), pool_connections=4,
+                                 pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
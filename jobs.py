@@ -0,0 +1,77 @@
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# ==========================================
+# 5. 后台任务队列 (生成流程不受 Streamlit rerun 打断)
+# ==========================================
+class JobManager:
+    """
+    进程级后台任务池：OCR / AI 解析 / PPT 排版提交到线程池执行，页面只在 session_state 里记住 job_id 并轮询状态，
+    控件交互或浏览器刷新引起的 rerun 不会丢掉进行中的任务。已结束任务的结果保留 result_ttl 秒后清理。
+    任务函数签名为 fn(update, *args)，通过 update(**fields) 上报进度；任务运行在工作线程里，不能调用任何 st.* 接口。
+    """
+    def __init__(self, max_workers, result_ttl):
+        self.result_ttl = result_ttl
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ppt-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._purge()
+            self._jobs[job_id] = {
+                "id": job_id,
+                "status": "queued",
+                "stage": "排队中...",
+                "progress": 0.0,
+                "detail": "",
+                "preview": None,
+                "draft": None,
+                "trace": None,
+                "result": None,
+                "error": None,
+                "created_at": time.time(),
+                "finished_at": None,
+            }
+        self._pool.submit(self._run, job_id, fn, args)
+        return job_id
+
+    def get(self, job_id):
+        """返回任务状态的快照（浅拷贝）；任务不存在或已过期清理返回 None"""
+        with self._lock:
+            self._purge()
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def active_count(self):
+        with self._lock:
+            self._purge()
+            return sum(1 for job in self._jobs.values() if job["status"] in ("queued", "running"))
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def _run(self, job_id, fn, args):
+        self._update(job_id, status="running", stage="处理中...")
+        try:
+            result = fn(lambda **fields: self._update(job_id, **fields), *args)
+        except Exception as e:
+            self._update(job_id, status="error", error=str(e), finished_at=time.time())
+        else:
+            self._update(job_id, status="done", progress=1.0, result=result, finished_at=time.time())
+
+    def _purge(self):
+        """
+        清理结束超过 result_ttl 的任务（连同 PPT 字节等结果），调用方须持有 self._lock。
+        页面每次 rerun / 每秒轮询都会调到 get 或 active_count，过期结果不必等下一次提交才释放。
+        """
+        cutoff = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["finished_at"] is not None and job["finished_at"] < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
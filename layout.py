@@ -0,0 +1,329 @@
+import os
+import re
+import threading
+import unicodedata
+
+from dates import parse_date_key
+
+# ==========================================
+# 📐 文本测量与自动分页 (按字体度量估算换行后的高度)
+# ==========================================
+# PPT 正文框的字体由 PowerPoint 渲染，这里用一款 CJK 字体的字形宽度近似测量：
+# 找到字体时用 Pillow 读取真实字宽，找不到时退回按东亚宽度（全角 1 em、半角约 0.55 em）估算。
+CJK_FONT_CANDIDATES = (
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/google-noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
+    "/usr/share/fonts/wqy-microhei/wqy-microhei.ttc",
+    "C:/Windows/Fonts/msyh.ttc",
+    "C:/Windows/Fonts/simhei.ttf",
+    "/System/Library/Fonts/PingFang.ttc",
+    "/System/Library/Fonts/STHeiti Medium.ttc",
+    "/Library/Fonts/Arial Unicode.ttf",
+)
+
+# 文本框默认内边距（左右各 0.1 英寸、上下各 0.05 英寸），单位 pt
+BOX_INSET_X = 7.2 * 2
+BOX_INSET_Y = 3.6 * 2
+LINE_SPACING = 1.2      # PowerPoint 单倍行距约为字号的 1.2 倍
+BOLD_FACTOR = 1.05      # 没有单独的粗体字形时，粗体按略宽估算
+_REFERENCE_SIZE = 100   # 按 100px 取字宽后换算成 em，避免小字号的取整误差
+
+# 连续的西文/数字按整词换行，其余字符（汉字、标点、空白）逐字可断
+_TOKEN_RE = re.compile(r"[A-Za-z0-9.,:;%/+\-_()'\"]+|\s|.")
+
+def find_cjk_font(font_path=""):
+    """指定的字体文件存在则用它，否则依次尝试常见系统 CJK 字体；都没有返回空串"""
+    for path in (font_path, *CJK_FONT_CANDIDATES):
+        if path and os.path.exists(path):
+            return path
+    return ""
+
+class TextMeasurer:
+    """
+    按字形宽度测量文本换行后的行数与高度。字宽（em）按字符缓存，同一字符只取一次，
+    几百段文字的排版测量也只是字典查找；实例可在多线程、多份 PPT 之间共享。
+    """
+    def __init__(self, font_path=""):
+        self.font_path = find_cjk_font(font_path)
+        self._font = None
+        if self.font_path:
+            try:
+                from PIL import ImageFont
+                self._font = ImageFont.truetype(self.font_path, _REFERENCE_SIZE)
+            except (ImportError, OSError):
+                self.font_path = ""
+        self._widths = {}
+        self._font_lock = threading.Lock()  # FreeType 字体对象不能并发调用
+
+    def char_width(self, ch):
+        """单个字符的宽度（em）"""
+        width = self._widths.get(ch)
+        if width is None:
+            if self._font is not None:
+                with self._font_lock:
+                    width = self._font.getlength(ch) / _REFERENCE_SIZE
+            elif unicodedata.east_asian_width(ch) in ("W", "F"):
+                width = 1.0
+            else:
+                width = 0.3 if ch.isspace() else 0.55
+            self._widths[ch] = width
+        return width
+
+    def _token_width(self, token):
+        # 只缓存单个字形：化验值、日期、药名这类词各不相同，按词缓存会让进程级共享的实例随病例数无限增长
+        if len(token) == 1:
+            return self.char_width(token)
+        return sum(self.char_width(ch) for ch in token)
+
+    def text_width(self, text, size, bold=False):
+        """单行文本的宽度（pt）"""
+        return sum(self._token_width(t) for t in _TOKEN_RE.findall(text)) * size * (BOLD_FACTOR if bold else 1.0)
+
+    def wrap(self, text, width, size, bold=False):
+        """
+        按框宽（pt）贪心换行，返回 [(原文第几行, 该视觉行的文字)]。
+        同一原文行的各视觉行直接拼接即可还原（换行处的空格留在上一行末尾）。
+        """
+        scale = size * (BOLD_FACTOR if bold else 1.0)
+        limit = width / scale
+        result = []
+        for index, line in enumerate(text.split("\n")):
+            current, used = "", 0.0
+            for token in _TOKEN_RE.findall(line):
+                token_width = self._token_width(token)
+                if used + token_width <= limit or (not current and token_width <= limit):
+                    current += token
+                    used += token_width
+                    continue
+                if current and not token.isspace():
+                    result.append((index, current))
+                    current, used = "", 0.0
+                if token.isspace():
+                    current += token
+                    continue
+                # 单个超长的西文串（网址、编号）只能逐字断开
+                for ch in token:
+                    ch_width = self.char_width(ch)
+                    if current and used + ch_width > limit:
+                        result.append((index, current))
+                        current, used = "", 0.0
+                    current += ch
+                    used += ch_width
+            result.append((index, current))
+        return result
+
+    def line_count(self, text, width, size, bold=False):
+        return len(self.wrap(text, width, size, bold))
+
+    def height(self, text, width, size, bold=False):
+        """文本换行后的高度（pt）"""
+        return self.line_count(text, width, size, bold) * size * LINE_SPACING
+
+_default_measurer = None
+
+def default_measurer():
+    """进程内共享的测量器（首次调用时加载字体）"""
+    global _default_measurer
+    if _default_measurer is None:
+        _default_measurer = TextMeasurer()
+    return _default_measurer
+
+# ==========================================
+# 段落排版：一页放得下（必要时略缩字号）就一页，否则按行拆到续页
+# ==========================================
+# 段落为 dict：{"text", "size"(pt), "bold", "color", "space_before"(pt), "space_after"(pt), "keep_with_next"}，
+# 除 text/size 外都可省略；keep_with_next 的段落（小标题）不会单独留在页尾。
+
+def _paragraph_height(measurer, para, width, scale):
+    size = para["size"] * scale
+    lines = measurer.line_count(para["text"], width, size, para.get("bold", False))
+    return (para.get("space_before", 0) + para.get("space_after", 0)) * scale + lines * size * LINE_SPACING
+
+def fits(paragraphs, measurer, width, height, scale=1.0):
+    """段落按 scale 缩放字号后能否放进 width × height（pt，已扣除内边距）的区域；超出即停止测量"""
+    used = 0.0
+    for para in paragraphs:
+        used += _paragraph_height(measurer, para, width, scale)
+        if used > height:
+            return False
+    return True
+
+def join_wrapped_lines(lines):
+    """把 wrap 返回的视觉行按原文行还原成文本"""
+    parts, last = [], None
+    for index, text in lines:
+        if parts and index == last:
+            parts[-1] += text
+        else:
+            parts.append(text)
+        last = index
+    return "\n".join(parts)
+
+def paginate(paragraphs, measurer, width, height, min_scale=0.85):
+    """
+    把段落排进 width × height（pt，文本框外框尺寸）的正文区。返回 (字号缩放比例, [[每页的段落]])：
+    原字号放得下就一页；缩到 min_scale 以内能放下就一页并缩小字号；否则按原字号逐段填页，
+    放不下的段落按视觉行拆开，剩余行续到下一页（续页开头的空行去掉）。
+    """
+    width -= BOX_INSET_X
+    height -= BOX_INSET_Y
+    paragraphs = [p for p in paragraphs if p.get("text") is not None]
+    if fits(paragraphs, measurer, width, height):
+        return 1.0, [paragraphs]
+    scale = 0.95
+    while scale >= min_scale - 1e-9:
+        if fits(paragraphs, measurer, width, height, scale):
+            return scale, [paragraphs]
+        scale -= 0.05
+
+    pages, page, used = [], [], 0.0
+
+    def new_page():
+        nonlocal page, used
+        if page:
+            pages.append(page)
+        page, used = [], 0.0
+
+    queue = list(paragraphs)
+    while queue:
+        para = queue.pop(0)
+        if not page:
+            # 续页开头不留空行
+            stripped = para["text"].lstrip("\n")
+            if not stripped and para["text"]:
+                continue
+            para = {**para, "text": stripped, "space_before": 0}
+        lines = measurer.wrap(para["text"], width, para["size"], para.get("bold", False))
+        line_height = para["size"] * LINE_SPACING
+        para_height = para.get("space_before", 0) + para.get("space_after", 0) + len(lines) * line_height
+        next_height = 0.0
+        if para.get("keep_with_next") and queue:
+            nxt = queue[0]
+            next_height = nxt.get("space_before", 0) + nxt["size"] * LINE_SPACING * 2
+        if used + para_height + next_height <= height:
+            page.append(para)
+            used += para_height
+            continue
+        # 放不下：小标题直接换页；正文按行拆开，本页能放几行放几行
+        room = int((height - used - para.get("space_before", 0)) // line_height)
+        if para.get("keep_with_next") or room < 1 or len(lines) <= 1:
+            if not page:
+                # 空页也放不下的（单行超高），只能原样放入
+                page.append(para)
+                new_page()
+            else:
+                new_page()
+                queue.insert(0, para)
+            continue
+        page.append({**para, "text": join_wrapped_lines(lines[:room]), "space_after": 0})
+        new_page()
+        queue.insert(0, {**para, "text": join_wrapped_lines(lines[room:])})
+    new_page()
+    return 1.0, pages
+
+# ==========================================
+# 时间轴排版：按日期排序 -> 按治疗阶段分页 -> 比例时间轴 + 分层无重叠放置
+# ==========================================
+# 卡片所在的层：0/1 为轴上方/下方紧贴主轴的一层，2/3 为上方/下方外侧一层
+TIMELINE_LANES = 4
+TIMELINE_MAX_EVENTS = 16    # 每页最多事件数，超出按阶段拆到续页
+
+def _month_value(key):
+    # 只写了年份的日期（月为 0）放在当年年初
+    year, month, day = key
+    return year * 12 + max(month, 1) - 1 + ((day - 1) / 31 if day else 0)
+
+def _event_times(events):
+    """每个事件的时间值（月）。没有可解析日期的事件沿用前一个事件的时间（开头的沿用第一个有日期的），全都没有时按原顺序"""
+    keys = [parse_date_key(evt.get("date", "")) for evt in events]
+    values = [_month_value(key) if key else None for key in keys]
+    known = [v for v in values if v is not None]
+    if not known:
+        return [float(i) for i in range(len(events))], False
+    last = known[0]
+    for i, value in enumerate(values):
+        if value is None:
+            values[i] = last
+        else:
+            last = value
+    return values, True
+
+def _phase_runs(events, order):
+    """排序后按阶段切成连续段；“评估”与空阶段归入前一段"""
+    runs = []
+    for i in order:
+        phase = str(events[i].get("phase", "") or "")
+        if runs and (phase in ("", "评估") or phase == runs[-1][0]):
+            runs[-1][1].append(i)
+        else:
+            runs.append([phase, [i]])
+    return runs
+
+def _split_slides(runs, max_events):
+    """按阶段装页：整段放得下就跟在当前页后面，否则另起一页；单个阶段超过一页时按 max_events 切开"""
+    slides, current = [], []
+    for phase, items in runs:
+        if current and len(current) + len(items) > max_events:
+            slides.append(current)
+            current = []
+        for start in range(0, len(items), max_events):
+            chunk = [(phase, i) for i in items[start:start + max_events]]
+            if current and len(current) + len(chunk) > max_events:
+                slides.append(current)
+                current = []
+            current.extend(chunk)
+    if current:
+        slides.append(current)
+    return slides
+
+def _axis_positions(values, left, right, min_gap, proportional):
+    """按时间比例映射到 [left, right]，再前后各扫一遍把相邻间距撑到 min_gap（保持先后顺序）"""
+    n = len(values)
+    lo, hi = min(values), max(values)
+    if n == 1:
+        return [(left + right) / 2]
+    if proportional and hi > lo:
+        xs = [left + (v - lo) / (hi - lo) * (right - left) for v in values]
+    else:
+        xs = [left + (right - left) * i / (n - 1) for i in range(n)]
+    for i in range(1, n):
+        xs[i] = max(xs[i], xs[i - 1] + min_gap)
+    xs[-1] = min(xs[-1], right)
+    for i in range(n - 2, -1, -1):
+        xs[i] = min(xs[i], xs[i + 1] - min_gap)
+    return xs
+
+def layout_timeline(events, left, right, card_width, max_events=TIMELINE_MAX_EVENTS):
+    """
+    时间轴排版（单位英寸，left/right 为卡片中心可用的横向范围）。返回每页一个 dict：
+    {"items": [{"index": 原事件下标, "x": 中心横坐标, "lane": 层}], "phases": [{"phase", "x0", "x1"}]}。
+    事件按日期稳定排序；同一页内相邻卡片间距至少为卡宽的 1/TIMELINE_LANES，
+    按横坐标顺序逐个放进第一个空闲的层（优先上下交替），因此任意时刻同一横坐标处最多四张卡片、必有空层，互不重叠。
+    排序之后各步都是线性的。
+    """
+    if not events:
+        return []
+    values, proportional = _event_times(events)
+    order = sorted(range(len(events)), key=lambda i: (values[i], i))
+    min_gap = card_width / TIMELINE_LANES + 0.02
+    max_events = max(1, min(max_events, int((right - left) / min_gap) + 1))
+
+    pages = []
+    for slide_items in _split_slides(_phase_runs(events, order), max_events):
+        xs = _axis_positions([values[i] for _, i in slide_items], left, right, min_gap, proportional)
+        lane_right = [float("-inf")] * TIMELINE_LANES
+        items, phases = [], []
+        for n, ((phase, i), x) in enumerate(zip(slide_items, xs)):
+            preference = (0, 1, 2, 3) if n % 2 == 0 else (1, 0, 3, 2)
+            lane = next((k for k in preference if lane_right[k] < x - card_width / 2),
+                        min(range(TIMELINE_LANES), key=lane_right.__getitem__))
+            lane_right[lane] = x + card_width / 2
+            items.append({"index": i, "x": x, "lane": lane})
+            if phases and phases[-1]["phase"] == phase:
+                phases[-1]["x1"] = x
+            else:
+                phases.append({"phase": phase, "x0": x, "x1": x})
+        pages.append({"items": items, "phases": phases})
+    return pages
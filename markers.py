@@ -0,0 +1,208 @@
+import re
+import unicodedata
+
+from dates import find_date_keys, format_date_key
+
+# ==========================================
+# 🧪 肿瘤标志物 / 关键检验值本地提取 (规则匹配，不走 AI)
+# ==========================================
+# 指标词典：标准名 -> 别名正则、默认单位、默认参考范围、类别（tumor 肿瘤标志物 / lab 常规检验）。
+# 参考范围各院略有差异：原文同一行写了参考范围时以原文为准，这里只是缺省值。
+MARKER_LEXICON = {
+    "CEA":      {"aliases": [r"CEA", r"癌胚抗原"], "unit": "ng/mL", "ref": (None, 5.0), "kind": "tumor"},
+    "CA19-9":   {"aliases": [r"CA\s*19\s*[-‐–]?\s*9", r"糖类抗原\s*19\s*[-‐–]?\s*9"], "unit": "U/mL", "ref": (None, 37.0), "kind": "tumor"},
+    "CA125":    {"aliases": [r"CA\s*[-‐–]?\s*125", r"糖类抗原\s*125"], "unit": "U/mL", "ref": (None, 35.0), "kind": "tumor"},
+    "CA15-3":   {"aliases": [r"CA\s*15\s*[-‐–]?\s*3", r"糖类抗原\s*15\s*[-‐–]?\s*3"], "unit": "U/mL", "ref": (None, 25.0), "kind": "tumor"},
+    "CA72-4":   {"aliases": [r"CA\s*72\s*[-‐–]?\s*4", r"糖类抗原\s*72\s*[-‐–]?\s*4"], "unit": "U/mL", "ref": (None, 6.9), "kind": "tumor"},
+    "CA242":    {"aliases": [r"CA\s*[-‐–]?\s*242", r"糖类抗原\s*242"], "unit": "U/mL", "ref": (None, 20.0), "kind": "tumor"},
+    "AFP":      {"aliases": [r"AFP", r"甲胎蛋白"], "unit": "ng/mL", "ref": (None, 7.0), "kind": "tumor"},
+    "CYFRA21-1": {"aliases": [r"CYFRA\s*21\s*[-‐–]?\s*1", r"细胞角蛋白\s*19\s*片段"], "unit": "ng/mL", "ref": (None, 3.3), "kind": "tumor"},
+    "NSE":      {"aliases": [r"NSE", r"神经元特异性烯醇化酶"], "unit": "ng/mL", "ref": (None, 16.3), "kind": "tumor"},
+    "SCC":      {"aliases": [r"SCCA?", r"鳞状细胞癌抗原"], "unit": "ng/mL", "ref": (None, 1.5), "kind": "tumor"},
+    "HE4":      {"aliases": [r"HE4", r"人附睾蛋白\s*4"], "unit": "pmol/L", "ref": (None, 140.0), "kind": "tumor"},
+    "PSA":      {"aliases": [r"t?PSA", r"前列腺特异性抗原"], "unit": "ng/mL", "ref": (None, 4.0), "kind": "tumor"},
+    "WBC":      {"aliases": [r"WBC", r"白细胞(?:计数)?"], "unit": "10^9/L", "ref": (3.5, 9.5), "kind": "lab"},
+    "HGB":      {"aliases": [r"HGB", r"Hb", r"血红蛋白"], "unit": "g/L", "ref": (115.0, 175.0), "kind": "lab"},
+    "PLT":      {"aliases": [r"PLT", r"血小板(?:计数)?"], "unit": "10^9/L", "ref": (125.0, 350.0), "kind": "lab"},
+    "ALT":      {"aliases": [r"ALT", r"谷丙转氨酶", r"丙氨酸氨基转移酶"], "unit": "U/L", "ref": (None, 40.0), "kind": "lab"},
+    "AST":      {"aliases": [r"AST", r"谷草转氨酶", r"天门冬氨酸氨基转移酶"], "unit": "U/L", "ref": (None, 40.0), "kind": "lab"},
+    "TBIL":     {"aliases": [r"T-?BIL", r"总胆红素"], "unit": "μmol/L", "ref": (None, 23.0), "kind": "lab"},
+    "CREA":     {"aliases": [r"CREA?", r"肌酐"], "unit": "μmol/L", "ref": (57.0, 111.0), "kind": "lab"},
+}
+
+def _alias_pattern(alias):
+    # 英文缩写两侧不能紧挨字母，避免把 “SCCA” 里的 “CA” 或单词中间的字母当成指标
+    return rf"(?<![A-Za-z]){alias}(?![A-Za-z])" if alias[0].isascii() else alias
+
+def _compile_lexicon():
+    groups = []
+    for index, spec in enumerate(MARKER_LEXICON.values()):
+        alternatives = "|".join(_alias_pattern(a) for a in sorted(spec["aliases"], key=len, reverse=True))
+        groups.append(f"(?P<m{index}>{alternatives})")
+    return re.compile("|".join(groups), re.IGNORECASE)
+
+# 所有别名编译成一个正则，一次扫描即可定位整行里的全部指标
+MARKER_NAME_RE = _compile_lexicon()
+MARKER_NAMES = list(MARKER_LEXICON)
+
+UNIT_PATTERN = r"(?:ng/ml|u/ml|ku/l|iu/ml|μg/l|ug/l|pmol/l|(?:×|x|\*)?10\^?9/l|g/l|u/l|[μu]mol/l)"
+# 指标名之后：可选的括号说明、冒号，然后是 比较符 + 数值 + 箭头/H/L 标记 + 单位
+VALUE_RE = re.compile(
+    r"^\s*(?:[(（][^)）]{0,20}[)）])?\s*[:：=]?\s*(?P<cmp>[<>≤≥])?\s*(?P<value>\d+(?:\.\d+)?)\s*"
+    r"(?P<flag>[↑↓]|[HL](?![A-Za-z]))?\s*(?P<unit>" + UNIT_PATTERN + r")?",
+    re.IGNORECASE,
+)
+REF_RANGE_RE = re.compile(
+    r"(?:参考(?:范围|值|区间)?|正常值|[(（])\s*[:：]?\s*(?P<low>\d+(?:\.\d+)?)\s*[-~–—]\s*(?P<high>\d+(?:\.\d+)?)"
+    r"|(?:参考(?:范围|值|区间)?|正常值|[(（])\s*[:：]?\s*[<≤]\s*(?P<upper>\d+(?:\.\d+)?)"
+)
+def _month_dates(text):
+    """趋势图按月定位：只认精确到月的日期（dates.find_date_keys 里只有年份的跳过）"""
+    return [(pos, key) for pos, key in find_date_keys(text) if key[1]]
+
+def _flag(value, cmp, arrow, low, high):
+    """“<20” 只说明低于检测/参考上限，不能按 20 判偏高；“>1000” 同理不能判偏低"""
+    if arrow:
+        return "high" if arrow.upper() in ("↑", "H") else "low"
+    below = cmp in ("<", "≤")
+    above = cmp in (">", "≥")
+    if high is not None and not below and (value > high or (value == high and above)):
+        return "high"
+    if low is not None and not above and (value < low or (value == low and below)):
+        return "low"
+    return ""
+
+# 同一指标的中英文名写在一起：“癌胚抗原(CEA) 3.1”“CEA（癌胚抗原）：3.1”
+_PAIRED_NAME_GAP_RE = re.compile(r"\s*[(（]\s*")
+_PAIRED_NAME_CLOSE_RE = re.compile(r"\s*[)）]")
+
+def _marker_names(line):
+    """
+    本行出现的指标名，返回 [(标准名, 名称起点, 名称终点)]。
+    “名称(别名)” 两次命中同一指标时合并成一个名称（终点越过右括号），数值窗口才不会被别名截断在数值之前。
+    """
+    names = []
+    for match in MARKER_NAME_RE.finditer(line):
+        canonical = MARKER_NAMES[int(match.lastgroup[1:])]
+        if names and names[-1][0] == canonical and _PAIRED_NAME_GAP_RE.fullmatch(line, names[-1][2], match.start()):
+            close = _PAIRED_NAME_CLOSE_RE.match(line, match.end())
+            names[-1] = (canonical, names[-1][1], close.end() if close else match.end())
+        else:
+            names.append((canonical, match.start(), match.end()))
+    return names
+
+def extract_marker_points(text):
+    """
+    逐行扫描原文，返回 [{"name", "date", "value", "cmp", "flag", "ref_low", "ref_high", "unit", "raw"}]，
+    cmp 为原文数值前的比较符（“<20” 的 “<”），没有则为空串。
+    日期取同一行里指标之前最近的日期，没有则沿用上文最近出现的日期（化验单的采样日期通常写在表头）。
+    指标名单独一行、数值在下一行（OCR 拆开的表格）时也能配对；没有日期的数值不会进入结果。
+    """
+    lines = [unicodedata.normalize("NFKC", line).strip() for line in text.splitlines()]
+    points = []
+    current_date = None
+    for line_no, line in enumerate(lines):
+        dates = _month_dates(line)
+        names = _marker_names(line)
+        for i, (canonical, name_start, name_end) in enumerate(names):
+            spec = MARKER_LEXICON[canonical]
+            segment_end = names[i + 1][1] if i + 1 < len(names) else len(line)
+            segment = line[name_end:segment_end]
+            value_match = VALUE_RE.match(segment)
+            if value_match is None and not segment.strip() and line_no + 1 < len(lines):
+                segment = lines[line_no + 1]
+                value_match = VALUE_RE.match(segment)
+            if value_match is None:
+                continue
+            # 日期优先取本行指标之前最近的一个（“2021-03-05 CEA 12.3”），其次本行之后的（“CEA 12.3（2021-03-05）”）
+            before = [key for pos, key in dates if pos < name_start]
+            after = [key for pos, key in dates if pos > name_start]
+            date = before[-1] if before else after[0] if after else current_date
+            if date is None:
+                continue
+            value = float(value_match.group("value"))
+            low, high = spec["ref"]
+            ref_match = REF_RANGE_RE.search(segment[value_match.end():])
+            if ref_match and ref_match.group("upper"):
+                low, high = None, float(ref_match.group("upper"))
+            elif ref_match:
+                ref_low, ref_high = float(ref_match.group("low")), float(ref_match.group("high"))
+                if ref_low < ref_high and not 1900 <= ref_low <= 2100:  # 括号里的 “2021-03” 是日期不是参考范围
+                    low, high = ref_low, ref_high
+            points.append({
+                "name": canonical,
+                "date": date,
+                "value": value,
+                "cmp": value_match.group("cmp") or "",
+                "flag": _flag(value, value_match.group("cmp"), value_match.group("flag"), low, high),
+                "ref_low": low,
+                "ref_high": high,
+                "unit": spec["unit"],
+                "raw": f"{line[name_start:name_end]} {segment[:value_match.end()].strip()}",
+            })
+        if dates:
+            current_date = dates[-1][1]
+    return points
+
+def _treatment_spans(treatments):
+    """治疗阶段的 (起, 止, 阶段名)：duration 里第一个日期为起点，第二个为终点，缺终点时延续到下一阶段开始"""
+    spans = []
+    for tx in treatments or []:
+        keys = [key for _, key in _month_dates(unicodedata.normalize("NFKC", str(tx.get("duration", ""))))]
+        if keys:
+            spans.append([keys[0][:2], keys[1][:2] if len(keys) > 1 else None, tx.get("phase", "")])
+    spans.sort(key=lambda span: span[0])
+    for i, span in enumerate(spans):
+        if span[1] is None and i + 1 < len(spans):
+            year, month = spans[i + 1][0]
+            span[1] = (year, month - 1) if month > 1 else (year - 1, 12)
+        elif span[1] is None:
+            span[1] = (9999, 12)
+    return spans
+
+def phase_for_date(date_key, spans):
+    month = date_key[:2]
+    for start, end, phase in spans:
+        if start <= month <= end:
+            return phase
+    return ""
+
+def build_marker_trends(text, treatments=None):
+    """
+    从原文构建各指标的时间序列，按词典顺序返回
+    [{"name", "kind", "unit", "ref_low", "ref_high", "points": [{"date", "value", "cmp", "flag", "phase", "raw"}]}]。
+    同一指标同一天只保留第一次出现的数值（重复截图、出院小结转抄的化验结果）；treatments 用于给每个点标注所处治疗阶段。
+    """
+    spans = _treatment_spans(treatments)
+    by_name = {}
+    for point in extract_marker_points(text):
+        series = by_name.setdefault(point["name"], {"seen": set(), "points": [], "ref": (point["ref_low"], point["ref_high"])})
+        if point["date"] in series["seen"]:
+            continue
+        series["seen"].add(point["date"])
+        series["points"].append(point)
+
+    trends = []
+    for name in MARKER_NAMES:
+        if name not in by_name:
+            continue
+        series = by_name[name]
+        spec = MARKER_LEXICON[name]
+        ref_low, ref_high = series["ref"]
+        points = sorted(series["points"], key=lambda p: p["date"])
+        trends.append({
+            "name": name,
+            "kind": spec["kind"],
+            "unit": spec["unit"],
+            "ref_low": ref_low,
+            "ref_high": ref_high,
+            "points": [{
+                "date": format_date_key(p["date"]),
+                "value": p["value"],
+                "cmp": p["cmp"],
+                "flag": p["flag"],
+                "phase": phase_for_date(p["date"], spans),
+                "raw": p["raw"],
+            } for p in points],
+        })
+    return trends
@@ -0,0 +1,238 @@
+import io
+import time
+import base64
+import hashlib
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from http_session import make_http_session, backoff_delay
+from tracing import span, add_metric
+
+# ==========================================
+# 1. 百度 OCR 图片识别模块 (包含超大图防崩溃压缩)
+# ==========================================
+# 当前调用的百度 OCR 接口版本；换接口后识别结果不同，因此也是缓存键的一部分
+OCR_ENDPOINT = "accurate_basic"
+
+# 百度 OCR 返回的 access_token 失效/过期错误码，遇到时强制刷新 token 并重发一次
+BAIDU_TOKEN_INVALID_CODES = {110, 111}
+
+# 值得退避后重试的百度错误码：1 未知错误、2 服务暂不可用、4 集群超限额、18 QPS 超限、282000 服务内部错误。
+# 17（日调用量超限）、19（总量超限）以及图片格式/尺寸类错误重试也不会成功，直接判失败
+BAIDU_RETRYABLE_CODES = {1, 2, 4, 18, 282000}
+
+class BaiduTokenProvider:
+    """
+    进程级共享的百度 access_token。
+    token 在 expires_in 到期前 refresh_margin 秒内视为过期；刷新过程加锁单飞，
+    多个会话同时发现过期时只会有一个线程真正去请求 OAuth 接口。
+    session 为共享的 HTTP 连接池，OCR 请求也复用它（见 request_baidu_ocr）。
+    """
+    def __init__(self, api_key, secret_key, refresh_margin=300, session=None):
+        self.api_key = api_key
+        self.secret_key = secret_key
+        self.refresh_margin = refresh_margin
+        self.session = session or make_http_session()
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0.0
+
+    def _is_fresh(self):
+        return self._token is not None and time.time() < self._expires_at
+
+    def _fetch(self):
+        url = f"https://aip.baidubce.com/oauth/2.0/token?grant_type=client_credentials&client_id={self.api_key}&client_secret={self.secret_key}"
+        headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+        with span("baidu.token_fetch") as current:
+            response = self.session.request("POST", url, headers=headers, data="")
+            result_json = response.json()
+            token = result_json.get("access_token")
+            current.set(ok=bool(token), error_code=result_json.get("error"))
+        if token:
+            # 百度默认有效期 30 天；提前留出余量，避免请求途中刚好过期
+            expires_in = float(result_json.get("expires_in", 0))
+            self._token = token
+            self._expires_at = time.time() + max(0.0, expires_in - self.refresh_margin)
+        return token
+
+    def get(self):
+        if self._is_fresh():
+            return self._token
+        with self._lock:
+            if self._is_fresh():
+                return self._token
+            return self._fetch()
+
+    def refresh(self, stale_token=None):
+        """强制刷新；若别的线程已经换掉了 stale_token，直接复用新 token"""
+        with self._lock:
+            if stale_token is not None and self._token != stale_token and self._is_fresh():
+                return self._token
+            self._token = None
+            return self._fetch()
+
+# preprocess_image 的默认参数；调用方通常从 Settings 的 OCR_MAX_EDGE / OCR_GRAYSCALE / OCR_JPEG_QUALITY 组装
+DEFAULT_PREP_OPTIONS = {"max_edge": 2560, "grayscale": True, "jpeg_quality": 85}
+
+def ocr_cache_key(image_bytes, prep_options=None, backend_name=OCR_ENDPOINT):
+    # 识别引擎（接口版本）与预处理参数都会影响识别结果，一并纳入缓存键
+    opts = {**DEFAULT_PREP_OPTIONS, **(prep_options or {})}
+    variant = f"{backend_name}:{opts['max_edge']}:{'L' if opts['grayscale'] else 'RGB'}:{opts['jpeg_quality']}"
+    return f"{variant}:{hashlib.sha256(image_bytes).hexdigest()}"
+
+def preprocess_image(image_bytes, max_edge=2560, grayscale=True, jpeg_quality=85):
+    """
+    OCR 前的图片瘦身：按 EXIF 纠正方向 -> 长边缩到 max_edge -> 可选灰度 -> 在候选编码里取体积最小的一种。
+    返回 (实际发送的图片字节, 统计信息)；原图本身已经最小且无需旋转缩放时原样发送。
+    """
+    from PIL import Image, ImageOps  # 延迟导入：只有真正要预处理图片时才加载 Pillow
+    img = Image.open(io.BytesIO(image_bytes))
+    source_format = img.format
+    transformed = False
+
+    if img.getexif().get(0x0112, 1) != 1:  # 0x0112 = EXIF Orientation，手机竖拍常见 6/8
+        img, transformed = ImageOps.exif_transpose(img), True
+    if max(img.size) > max_edge:
+        img = img.copy()
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        transformed = True
+
+    # 带透明通道的截图先铺白底，否则透明区域转灰度后会变成黑块
+    if img.mode in ("RGBA", "LA", "P"):
+        rgba = img.convert("RGBA")
+        img = Image.new("RGB", rgba.size, (255, 255, 255))
+        img.paste(rgba, mask=rgba.getchannel("A"))
+    img = img.convert("L" if grayscale else "RGB")
+
+    candidates = []
+    jpeg_out = io.BytesIO()
+    # 彩色图关闭色度抽样（4:4:4），避免红字/蓝字边缘发虚
+    img.save(jpeg_out, format="JPEG", quality=jpeg_quality, optimize=True, subsampling=0)
+    candidates.append(("JPEG", jpeg_out.getvalue()))
+    if source_format != "JPEG":
+        # 截图类图片色块大、边缘锐利，PNG 往往比 JPEG 更小也更清晰；照片则不必尝试
+        png_out = io.BytesIO()
+        img.save(png_out, format="PNG", optimize=True)
+        candidates.append(("PNG", png_out.getvalue()))
+    if not transformed and source_format in ("JPEG", "PNG"):
+        candidates.append((source_format, image_bytes))
+
+    best_format, best_bytes = min(candidates, key=lambda item: len(item[1]))
+    stats = {
+        "orig_bytes": len(image_bytes),
+        "sent_bytes": len(best_bytes),
+        "format": best_format,
+        "size": img.size,
+    }
+    return best_bytes, stats
+
+class OCRError(RuntimeError):
+    """单页 OCR 失败（百度返回错误码或网络异常）；retryable 为 False 时单页重试层不再重试该页"""
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def request_baidu_ocr(image_bytes, token_provider, session=None):
+    """
+    对已经预处理好的图片字节调用百度 OCR，返回接口原始 JSON。
+    连接错误、读超时与 429/5xx 由连接池按退避重试（见 make_http_session），到这里仍失败说明重试已用尽，
+    抛 retryable=False 的 OCRError，单页重试层不再叠加一轮重发；单页层只重试百度在正常响应里返回的限流/临时错误码。
+    session 缺省时复用 token_provider 的连接池。
+    """
+    session = session or token_provider.session
+    img_base64 = base64.b64encode(image_bytes).decode('utf-8')
+    payload = {'image': img_base64}
+    headers = {'Content-Type': 'application/x-www-form-urlencoded', 'Accept': 'application/json'}
+    try:
+        access_token = token_provider.get()
+        if not access_token:
+            raise OCRError("请求异常: 获取百度 API 授权失败", retryable=False)
+        for attempt in range(2):
+            url = f"https://aip.baidubce.com/rest/2.0/ocr/v1/{OCR_ENDPOINT}?access_token=" + access_token
+            response = session.request("POST", url, headers=headers, data=payload)
+            if response.status_code >= 400:
+                raise OCRError(f"请求异常: HTTP {response.status_code}", retryable=False)
+            result_json = response.json()
+            if attempt == 0 and result_json.get("error_code") in BAIDU_TOKEN_INVALID_CODES:
+                # token 被提前吊销或已过期：刷新一次后原样重发
+                access_token = token_provider.refresh(stale_token=access_token)
+                if access_token:
+                    continue
+            break
+    except OCRError:
+        raise
+    except Exception as e:
+        raise OCRError(f"请求异常: {str(e)}", retryable=False) from e
+    return result_json
+
+def parse_ocr_response(result_json):
+    """把百度 OCR 的返回 JSON 转成按行拼接的文字；接口报错时抛 OCRError"""
+    if "words_result" in result_json:
+        text_list = [item["words"] for item in result_json["words_result"]]
+        return "\n".join(text_list)
+    code = result_json.get("error_code")
+    raise OCRError(f"识别错误: {result_json.get('error_msg', '未知错误')}",
+                   retryable=code is None or code in BAIDU_RETRYABLE_CODES)
+
+def perform_ocr(image_bytes, token_provider, session=None):
+    """对已经预处理好的图片字节调用百度 OCR，返回按行拼接的文字"""
+    return parse_ocr_response(request_baidu_ocr(image_bytes, token_provider, session))
+
+def ocr_page_with_retry(image_bytes, backend, cache=None, retries=2, prep_options=None):
+    """
+    单页 OCR + 独立重试：某一页失败只重发这一页，不影响同批次其它页；命中缓存则完全不走网络。
+    只重试 retryable 的 OCRError；后端抛出的其它异常同样记为该页失败，不会中断整批识别。
+    """
+    key = ocr_cache_key(image_bytes, prep_options, backend.name)
+    if cache is not None:
+        cached_text = cache.get(key)
+        if cached_text is not None:
+            return {"ok": True, "text": cached_text, "cached": True, "prep": None}
+    try:
+        with span("ocr.preprocess", orig_bytes=len(image_bytes)):
+            ocr_bytes, prep_stats = preprocess_image(image_bytes, **{**DEFAULT_PREP_OPTIONS, **(prep_options or {})})
+    except Exception:
+        # 个别损坏/非常规编码的图片 Pillow 打不开，就原样交给百度，由接口判定
+        ocr_bytes, prep_stats = image_bytes, None
+    last_error = None
+    for attempt in range(retries + 1):
+        try:
+            # 每次真正发出的识别请求单独计时；失败时异常类型与消息记入 span，不再只剩一行“[请求异常: ...]”
+            with span("ocr.request", backend=backend.name, payload_bytes=len(ocr_bytes), attempt=attempt):
+                add_metric("case_pipeline_ocr_payload_bytes_total", len(ocr_bytes), backend=backend.name)
+                text = backend.recognize(ocr_bytes)
+            if cache is not None:
+                cache.set(key, text)  # 只缓存成功结果，失败页下次仍会真正重试
+            return {"ok": True, "text": text, "cached": False, "prep": prep_stats}
+        except Exception as e:
+            last_error = e if isinstance(e, OCRError) else OCRError(f"识别异常: {type(e).__name__}: {e}", retryable=False)
+            if not last_error.retryable:
+                break
+            if attempt < retries:
+                time.sleep(backoff_delay(attempt))  # 抖动退避：并发页错开重发，给百度 QPS 留出余量
+    return {"ok": False, "text": f"[{last_error}]", "cached": False, "prep": prep_stats}
+
+def batch_ocr(images, backend, cache=None, max_workers=2, on_page_done=None, retries=2, prep_options=None):
+    """
+    并发 OCR：最多 max_workers 张图片同时在途（受百度 QPS 限制，不宜设太大）。
+    images 为 {页码下标: 图片字节}，返回同样以页码下标为键的结果；
+    每完成一页就在调用线程里回调 on_page_done(页码下标, 结果)，方便刷新进度条。
+    """
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, int(max_workers))) as pool:
+        # 每页带上调用方的追踪上下文，工作线程里的 span 归入同一次运行
+        futures = {pool.submit(contextvars.copy_context().run, ocr_page_with_retry, image_bytes, backend, cache,
+                               retries, prep_options): idx
+                   for idx, image_bytes in images.items()}
+        for future in as_completed(futures):
+            idx = futures[future]
+            results[idx] = future.result()
+            if on_page_done:
+                on_page_done(idx, results[idx])
+    return results
+
+def join_ocr_pages(pages):
+    """按页码顺序拼接，保持【第 N 页提取结果】的原始上传顺序"""
+    return "\n".join(f"【第 {i+1} 页提取结果】\n{page['text']}\n" for i, page in enumerate(pages))
@@ -0,0 +1,264 @@
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import DiskCache
+from http_session import make_http_session
+from compaction import compact_medical_text
+from markers import build_marker_trends
+from ocr import BaiduTokenProvider, batch_ocr, join_ocr_pages
+from extraction import has_cached_case, extract_case_with_cache, extract_long_case
+from backends import create_ocr_backend, create_llm_client
+from tracing import configure_tracing, span, start_run
+
+# ==========================================
+# 🔗 完整生成流程 (OCR -> AI 结构化提取 -> PPT 排版)
+# ==========================================
+class CasePipeline:
+    """
+    不依赖 Streamlit 的完整生成流程，网页端、命令行批处理和脚本共用。
+    构造时按 Settings 建好百度 token、OCR/AI 后端和两级缓存，实例可在多线程间共享。
+    百度接口共用一个 HTTP 连接池，AI 客户端首次使用时创建一次，之后所有请求复用（都自带超时与退避重试）。
+    排版组件（python-pptx、字体度量、解析好的模板）同样在首次排版时才导入和创建，构造本身很轻；
+    网页端可在启动后调用 warm_up 在后台提前加载。
+    ocr_backend / llm_client_factory 可直接传入（测试、基准脚本），否则按 Settings 创建。
+    """
+    def __init__(self, settings, ocr_backend=None, llm_client_factory=None):
+        self.settings = settings
+        configure_tracing(settings.trace_log_path, settings.metrics_path, settings.metrics_port, settings.metrics_host)
+        self.http_session = make_http_session(
+            pool_size=settings.http_pool_size, retries=settings.http_retries,
+            connect_timeout=settings.http_connect_timeout, read_timeout=settings.http_read_timeout,
+        )
+        self.token_provider = BaiduTokenProvider(settings.baidu_api_key, settings.baidu_secret_key,
+                                                 session=self.http_session)
+        self.ocr_backend = ocr_backend or create_ocr_backend(settings, self.token_provider)
+        self.llm_client_factory = llm_client_factory or (lambda: create_llm_client(settings))
+        self._llm_client = None
+        self._llm_client_lock = threading.Lock()
+        self.ocr_cache = None
+        if settings.ocr_cache_path:
+            self.ocr_cache = DiskCache(settings.ocr_cache_path, "ocr_results",
+                                       int(settings.ocr_cache_max_mb * 1024 * 1024))
+        self.llm_cache = None
+        if settings.llm_cache_path:
+            # 回放后端的结果单独建表，避免占位数据混进真实解析缓存
+            table = "case_json" if settings.llm_backend == "deepseek" else "case_json_offline"
+            self.llm_cache = DiskCache(settings.llm_cache_path, table,
+                                       int(settings.llm_cache_max_mb * 1024 * 1024),
+                                       ttl=settings.llm_cache_ttl_hours * 3600)
+        self._ppt_components = None
+        self._ppt_lock = threading.Lock()
+        self.prep_options = {
+            "max_edge": settings.ocr_max_edge,
+            "grayscale": settings.ocr_grayscale,
+            "jpeg_quality": settings.ocr_jpeg_quality,
+        }
+
+    def ocr(self, images, on_page_done=None):
+        """images 为 {页码下标: 图片字节}，返回 {页码下标: 单页结果}"""
+        with span("pipeline.ocr", pages=len(images)) as current:
+            pages = batch_ocr(
+                images, self.ocr_backend, cache=self.ocr_cache,
+                max_workers=self.settings.ocr_max_workers, on_page_done=on_page_done,
+                retries=self.settings.ocr_page_retries, prep_options=self.prep_options,
+            )
+            current.set(failed_pages=sum(1 for page in pages.values() if not page["ok"]))
+        return pages
+
+    def llm_client(self):
+        # 延迟到第一次解析时创建：未配置 DeepSeek 密钥时只用 OCR 也不会报错
+        if self._llm_client is None:
+            with self._llm_client_lock:
+                if self._llm_client is None:
+                    self._llm_client = self.llm_client_factory()
+        return self._llm_client
+
+    def ppt_components(self):
+        """
+        返回 (排版测量器, 模板, 增量渲染器或 None)，所有 PPT 共用：测量器缓存字形宽度，模板只解析一次。
+        python-pptx 与这几个模块在这里才导入，只做 OCR、或尚未生成过 PPT 的进程不承担这部分开销。
+        """
+        if self._ppt_components is None:
+            with self._ppt_lock:
+                if self._ppt_components is None:
+                    from layout import TextMeasurer
+                    from deck_template import load_deck_template
+                    from deck_cache import IncrementalDeckRenderer
+                    settings = self.settings
+                    measurer = TextMeasurer(settings.ppt_font_path)
+                    template = load_deck_template(settings.ppt_template_path, settings.ppt_theme,
+                                                  settings.ppt_theme_path)
+                    renderer = None
+                    if settings.slide_cache_entries > 0:
+                        renderer = IncrementalDeckRenderer(template, measurer, max_entries=settings.slide_cache_entries)
+                    self._ppt_components = (measurer, template, renderer)
+        return self._ppt_components
+
+    def warm_up(self):
+        """
+        提前加载首次生成才会用到的重型依赖：排版组件（python-pptx、模板解析）与 AI 客户端（openai）。
+        网页端在后台线程调用，页面先渲染出来，用户第一次点击生成时不再等导入。
+        """
+        with span("pipeline.warm_up"):
+            self.ppt_components()
+            # 没配置 DeepSeek 密钥时创建客户端会报错，留到真正解析时再提示
+            if self.settings.llm_backend != "deepseek" or self.settings.deepseek_api_key:
+                self.llm_client()
+
+    def is_long_record(self, patient_text):
+        return len(patient_text) > self.settings.long_record_threshold
+
+    def compact(self, patient_text, long_record_mode=True):
+        """
+        AI 解析前压缩病史文本，返回 (压缩后文本, 统计信息)；关闭 TEXT_COMPACTION 时原样返回，统计信息为 None。
+        仍会走分段解析的超长病历保留分页标记，供切块使用。
+        """
+        if not self.settings.text_compaction:
+            return patient_text, None
+        extra_patterns = [p.strip() for p in self.settings.compaction_extra_patterns.splitlines() if p.strip()]
+        keep_markers = long_record_mode and self.is_long_record(patient_text)
+        with span("pipeline.compact", chars=len(patient_text)):
+            return compact_medical_text(patient_text, extra_patterns, strip_page_markers=not keep_markers)
+
+    def extract(self, patient_text, force=False, long_record_mode=True, on_progress=None, on_chunk_done=None,
+                source_text=None):
+        """
+        AI 结构化提取，返回 (病例 JSON, 是否来自缓存)。
+        超长病历（且 long_record_mode 开启）走分段并发解析并回调 on_chunk_done，否则按需流式回调 on_progress。
+        patient_text 是压缩过的文本时，source_text 传压缩前的原文：趋势图的检验值从原文提取，
+        去重/去样板删掉的重复化验行不会让时间序列缺点。
+        """
+        client = self.llm_client()
+        long_mode = long_record_mode and self.is_long_record(patient_text)
+        with span("pipeline.extract", chars=len(patient_text), long_record=long_mode) as current:
+            if long_mode:
+                case_json, from_cache = extract_long_case(
+                    patient_text, client, self.llm_cache, force=force,
+                    max_workers=self.settings.llm_max_workers, chunk_chars=self.settings.llm_chunk_chars,
+                    on_chunk_done=on_chunk_done,
+                )
+            else:
+                case_json, from_cache = extract_case_with_cache(patient_text, client, self.llm_cache, force=force,
+                                                                on_progress=on_progress)
+            current.set(from_cache=from_cache)
+        return self.attach_marker_trends(case_json, source_text or patient_text), from_cache
+
+    def attach_marker_trends(self, case_json, patient_text):
+        """
+        用本地规则从原文提取肿瘤标志物/检验值时间序列，写入 case_json["marker_trends"] 供趋势图使用。
+        数值直接取自原文，不经过 AI；治疗阶段按 AI 整理出的 treatments 标注。
+        """
+        if self.settings.marker_trends:
+            with span("pipeline.marker_trends"):
+                case_json["marker_trends"] = build_marker_trends(patient_text, case_json.get("treatments"))
+        return case_json
+
+    def has_cached_case(self, patient_text):
+        """reasoner 的解析结果是否已在缓存里（命中时没必要再出快速草稿）"""
+        return has_cached_case(patient_text, self.llm_cache)
+
+    def extract_speculative(self, patient_text, force=False, on_progress=None, on_draft=None, source_text=None):
+        """
+        两级解析：快速模型（DRAFT_MODEL）在后台线程出草稿，reasoner 同时在当前线程推理。
+        草稿先到时回调 on_draft(草稿 JSON)（在草稿线程中执行）；reasoner 先完成则草稿作废、不再回调，
+        草稿线程还没发出请求时直接跳过，不再白白调用一次快速模型。
+        返回 (最终 JSON, 是否来自缓存, 草稿 JSON 或 None)：只有草稿先到（页面上确实展示过）时才返回草稿，
+        草稿落后或失败都返回 None，不影响最终结果；草稿的结局（shown/skipped/late）与异常记在 pipeline.draft span 上。
+        source_text 同 extract。
+        """
+        client = self.llm_client()
+        final_done = threading.Event()
+        race_lock = threading.Lock()  # 草稿“先到”的判定与 reasoner 完成互斥，二者只会有一个赢
+        shown = {}
+
+        def run_draft():
+            try:
+                with span("pipeline.draft", model=self.settings.draft_model) as current:
+                    if final_done.is_set():
+                        current.set(outcome="skipped")
+                        return
+                    draft, _ = extract_case_with_cache(patient_text, client, self.llm_cache, force=force,
+                                                       model=self.settings.draft_model)
+                    self.attach_marker_trends(draft, source_text or patient_text)
+                    with race_lock:
+                        if final_done.is_set():
+                            current.set(outcome="late")
+                            return
+                        shown["draft"] = draft
+                    current.set(outcome="shown")
+                    if on_draft:
+                        on_draft(draft)
+            except Exception:
+                return  # 异常已由 span 记为 error；草稿只是预览，失败不影响 reasoner 的结果
+
+        pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="draft")
+        pool.submit(contextvars.copy_context().run, run_draft)
+        pool.shutdown(wait=False)  # 不等草稿：reasoner 完成后直接返回
+        try:
+            case_json, from_cache = self.extract(patient_text, force=force, long_record_mode=False,
+                                                 on_progress=on_progress, source_text=source_text)
+        finally:
+            with race_lock:
+                final_done.set()
+        return case_json, from_cache, shown.get("draft")
+
+    def build_ppt(self, case_json):
+        return self.render_ppt(case_json)[0]
+
+    def render_ppt(self, case_json):
+        """
+        排版成 PPT，返回 (PPT 字节, 统计)。开启增量重排时输入未变的页面单元直接复用缓存的幻灯片，
+        统计见 IncrementalDeckRenderer.render；关闭时整份重排，统计为 None。
+        """
+        measurer, template, renderer = self.ppt_components()
+        with span("pipeline.build") as current:
+            if renderer is not None:
+                ppt_bytes, stats = renderer.render(case_json)
+                current.set(slides=stats["slides"], reused_slides=stats["reused_slides"])
+                return ppt_bytes, stats
+            from ppt_maker import AdvancedPPTMaker
+            maker = AdvancedPPTMaker(case_json, measurer=measurer, template=template)
+            return maker.build().getvalue(), None
+
+    def run(self, patient_text="", images=None, force=False, long_record_mode=True):
+        """
+        一次跑完整条流程：有图片先 OCR（识别文字按页拼接在 patient_text 之前），再 AI 解析、排版。
+        返回 {"case_json", "ppt_bytes", "from_cache", "ocr_failed_pages", "compaction", "timings", "trace"}，
+        compaction 为文本压缩统计（见 compact_medical_text），timings 为各阶段耗时（秒），
+        trace 为本次运行各 span 的耗时分解（见 tracing.RunTrace.breakdown）。
+        """
+        with start_run("pipeline.run") as run:
+            timings = {}
+            failed_pages = []
+            if images:
+                start = time.perf_counter()
+                pages = self.ocr(dict(enumerate(images)))
+                timings["ocr"] = time.perf_counter() - start
+                ordered = [pages[i] for i in range(len(images))]
+                failed_pages = [i + 1 for i, page in enumerate(ordered) if not page["ok"]]
+                patient_text = "\n".join(filter(None, [join_ocr_pages(ordered), patient_text]))
+
+            start = time.perf_counter()
+            source_text = patient_text
+            patient_text, compaction = self.compact(patient_text, long_record_mode=long_record_mode)
+            timings["compact"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            case_json, from_cache = self.extract(patient_text, force=force, long_record_mode=long_record_mode,
+                                                 source_text=source_text)
+            timings["extract"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            ppt_bytes = self.build_ppt(case_json)
+            timings["build"] = time.perf_counter() - start
+        return {
+            "case_json": case_json,
+            "ppt_bytes": ppt_bytes,
+            "from_cache": from_cache,
+            "ocr_failed_pages": failed_pages,
+            "compaction": compaction,
+            "timings": timings,
+            "trace": run.breakdown(),
+        }
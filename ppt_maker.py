@@ -0,0 +1,421 @@
+from pptx.util import Inches, Pt
+from pptx.enum.text import PP_ALIGN
+from pptx.enum.shapes import MSO_SHAPE
+from pptx.chart.data import CategoryChartData
+from pptx.enum.chart import XL_CHART_TYPE, XL_LEGEND_POSITION, XL_LABEL_POSITION, XL_MARKER_STYLE
+from pptx.enum.dml import MSO_LINE_DASH_STYLE
+from pptx.enum.shapes import PP_PLACEHOLDER
+import io
+from functools import partial
+from clinical_terms import DEFAULT_CLASSIFIER
+from tracing import span
+from deck_template import load_deck_template
+from layout import (default_measurer, paginate, fits, layout_timeline, join_wrapped_lines,
+                    BOX_INSET_X, BOX_INSET_Y, LINE_SPACING)
+
+# ==========================================
+# 4. PPT 生成模块
+# ==========================================
+class AdvancedPPTMaker:
+    # 幻灯片按此顺序生成（基准脚本也据此逐页计时）
+    BUILD_STEPS = ("make_cover", "make_baseline", "make_treatments", "make_marker_trends",
+                   "make_current_admission", "make_timeline", "make_summary")
+
+    def __init__(self, data, classifier=None, measurer=None, template=None):
+        self.classifier = classifier or DEFAULT_CLASSIFIER
+        self.measurer = measurer or default_measurer()
+        # 模板（版式 + 主题配色 + 样式预设）进程内只解析一次，这里从缓存的母版字节载入
+        self.template = template or load_deck_template()
+        self.prs = self.template.new_presentation()
+        self.data = self.clean_data(data)
+        self.C_PRI = self.template.color("primary")
+        self.C_ACC = self.template.color("accent")
+
+    def clean_data(self, data):
+        # 治疗阶段与时间轴事件各打一次标签，后续节点配色、阶段改名、跳页都只看标签
+        self.term_tags = self.classifier.classify_case(data)
+        adjuvant = {"adjuvant", "neoadjuvant"}
+        if not self.term_tags["has_surgery"]:
+            # 没做过手术就谈不上“辅助”治疗，统一改称一线
+            for tx, tags in zip(data.get("treatments", []), self.term_tags["treatments"]):
+                if tags["phase"] & adjuvant:
+                    tx["phase"] = "一线治疗"
+                    tags["phase"] -= adjuvant
+            for evt, tags in zip(data.get("timeline_events", []), self.term_tags["events"]):
+                if tags["phase"] & adjuvant:
+                    evt["phase"] = "一线"
+                    tags["phase"] -= adjuvant
+            for trend in data.get("marker_trends", []):
+                for point in trend.get("points", []):
+                    if self.classifier.tags(point.get("phase", ""))[0] & adjuvant:
+                        point["phase"] = "一线治疗"
+        return data
+
+    def add_header(self, slide, text):
+        # 模板没有“仅标题”版式时的后备：逐页手工画标题栏
+        shape = slide.shapes.add_shape(MSO_SHAPE.RECTANGLE, 0, 0, Inches(13.33), Inches(0.9))
+        shape.fill.solid()
+        shape.fill.fore_color.rgb = self.C_PRI
+        shape.line.fill.background()
+        tb = slide.shapes.add_textbox(Inches(0.5), Inches(0.05), Inches(10), Inches(0.8))
+        self.fill_text_frame(tb.text_frame, [self.template.style("header", text)])
+
+    def _add_layout_slide(self, layout_index, title):
+        slide = self.prs.slides.add_slide(self.prs.slide_layouts[layout_index])
+        # 只保留标题占位符，模板版式里的正文/副标题等空占位符不进成品
+        for ph in list(slide.placeholders):
+            if ph.placeholder_format.type not in (PP_PLACEHOLDER.TITLE, PP_PLACEHOLDER.CENTER_TITLE):
+                ph._element.getparent().remove(ph._element)
+        slide.shapes.title.text = title
+        return slide
+
+    def add_slide(self, title=None):
+        """新建一页：有标题时套用模板的标题版式（标题栏与标题样式由版式提供），模板没有合适版式时手工画标题栏"""
+        if title is not None and self.template.title_layout is not None:
+            return self._add_layout_slide(self.template.title_layout, title)
+        slide = self.prs.slides.add_slide(self.prs.slide_layouts[self.template.blank_layout])
+        if title is not None:
+            self.add_header(slide, title)
+        return slide
+
+    def fill_text_frame(self, tf, paragraphs, scale=1.0):
+        """按段落描述（见 layout.paginate、DeckTemplate.style）写入文本框，字号与段前段后间距按 scale 缩放"""
+        tf.word_wrap = True
+        for i, para in enumerate(paragraphs):
+            p = tf.paragraphs[0] if i == 0 else tf.add_paragraph()
+            p.text = para["text"]
+            # 段落格式整段套用模板缓存的预设 XML
+            old = p._p.pPr
+            if old is not None:
+                p._p.remove(old)
+            p._p.insert(0, self.template.paragraph_properties(para, scale))
+
+    def add_text_slides(self, title, paragraphs, left=0.8, top=1.2, width=11.5, height=6.0, single_title=None):
+        """
+        正文页统一入口：按字体度量测量段落高度，一页放得下（必要时略缩字号）就一页，
+        否则自动拆成续页，标题加 (1/N)。single_title 为只有一页时使用的标题（默认同 title）。返回生成的幻灯片列表。
+        """
+        scale, pages = paginate(paragraphs, self.measurer, Inches(width).pt, Inches(height).pt)
+        slides = []
+        for page_no, page in enumerate(pages, 1):
+            slide = self.add_slide(f"{title} ({page_no}/{len(pages)})" if len(pages) > 1 else single_title or title)
+            tb = slide.shapes.add_textbox(Inches(left), Inches(top), Inches(width), Inches(height))
+            self.fill_text_frame(tb.text_frame, page, scale)
+            slides.append(slide)
+        return slides
+
+    def make_cover(self):
+        title = self.data.get("cover", {}).get("title", "病例汇报")
+        if self.template.cover_layout is not None:
+            self._add_layout_slide(self.template.cover_layout, title)
+            return
+        slide = self.add_slide()
+        shape = slide.shapes.add_shape(MSO_SHAPE.RECTANGLE, 0, 0, Inches(13.33), Inches(7.5))
+        shape.fill.solid()
+        shape.fill.fore_color.rgb = self.C_PRI
+        tb = slide.shapes.add_textbox(Inches(1.5), Inches(3), Inches(10), Inches(2))
+        self.fill_text_frame(tb.text_frame, [self.template.style("cover_title", title, align=PP_ALIGN.CENTER)])
+
+    def make_baseline(self):
+        base_data = self.data.get("baseline", {})
+        content = f"【患者信息】 {base_data.get('patient_info', '')}\n\n" \
+                  f"【主诉】 {base_data.get('chief_complaint', '')}\n\n" \
+                  f"【临床诊断】\n{base_data.get('diagnosis', '')}\n\n" \
+                  f"【关键检查/病理】\n{base_data.get('key_exams', '')}"
+        self.add_text_slides("病例介绍", [self.template.style("lead", content)], single_title="病例介绍 (基线资料)")
+
+    def make_treatments(self):
+        for tx, tags in zip(self.data.get("treatments", []), self.term_tags["treatments"]):
+            self.make_treatment(tx, tags)
+
+    def make_treatment(self, tx, tags):
+        phase_name = tx.get('phase', '阶段治疗')
+        if tags["phase"] & {"adjuvant", "neoadjuvant"} and len(tx.get('regimen', '')) < 5:
+            return
+        style = self.template.style
+        self.add_text_slides(f"治疗经过：{phase_name}", [
+            style("heading", f"【治疗时间】 {tx.get('duration', '')}"),
+            style("body", f"\n【用药方案及局部治疗】\n{tx.get('regimen', '')}"),
+            style("body_muted", f"\n【影像学评估】\n{tx.get('imaging', '')}"),
+            style("body_accent", f"\n【肿瘤标志物】\n{tx.get('markers', '')}"),
+        ])
+
+    def add_marker_chart(self, slide, trend, x, y, cx, cy):
+        """单个指标的折线图（原生图表，可在 PowerPoint 里直接改数据）：横轴为检测日期（附所处治疗阶段），虚线为参考上限"""
+        points = trend["points"]
+        unit = trend.get("unit", "")
+        chart_data = CategoryChartData()
+        chart_data.categories = [f"{p['date']}\n{p['phase']}" if p.get("phase") else p["date"] for p in points]
+        chart_data.add_series(trend["name"], [p["value"] for p in points])
+        has_ref = trend.get("ref_high") is not None
+        if has_ref:
+            chart_data.add_series("参考上限", [trend["ref_high"]] * len(points))
+        chart = slide.shapes.add_chart(XL_CHART_TYPE.LINE_MARKERS, x, y, cx, cy, chart_data).chart
+
+        chart.has_title = True
+        styles, color = self.template.styles, self.template.color
+        title = chart.chart_title.text_frame.paragraphs[0]
+        title.text = f"{trend['name']}（{unit}）" if unit else trend["name"]
+        title.font.size = Pt(styles["chart_title"]["size"])
+        title.font.bold = styles["chart_title"].get("bold", False)
+        title.font.color.rgb = styles["chart_title"].get("color", self.C_PRI)
+        axis_size = Pt(styles["chart_axis"]["size"])
+        chart.has_legend = has_ref
+        if has_ref:
+            chart.legend.position = XL_LEGEND_POSITION.BOTTOM
+            chart.legend.include_in_layout = False
+            chart.legend.font.size = axis_size
+        chart.category_axis.tick_labels.font.size = axis_size
+        chart.value_axis.tick_labels.font.size = axis_size
+        chart.value_axis.major_gridlines.format.line.color.rgb = color("grid")
+
+        values = chart.plots[0].series[0]
+        values.smooth = False
+        values.format.line.color.rgb = self.C_ACC
+        values.format.line.width = Pt(2.25)
+        values.marker.style = XL_MARKER_STYLE.CIRCLE
+        values.marker.size = 7
+        labels = values.data_labels
+        labels.show_value = True
+        labels.number_format = "0.##"
+        labels.number_format_is_linked = False
+        labels.position = XL_LABEL_POSITION.ABOVE
+        labels.font.size = Pt(styles["chart_label"]["size"])
+        flag_colors = {"high": color("progression"), "low": color("low")}
+        for i, p in enumerate(points):
+            # 超出参考范围的点标红（偏高）或标橙（偏低）
+            point_color = flag_colors.get(p.get("flag"), self.C_ACC)
+            marker = values.points[i].marker
+            marker.format.fill.solid()
+            marker.format.fill.fore_color.rgb = point_color
+            marker.format.line.color.rgb = point_color
+            if p.get("cmp"):
+                # “<20” 这类检测限结果按界值画点，数据标签保留比较符
+                label = values.points[i].data_label
+                label.position = XL_LABEL_POSITION.ABOVE
+                label.text_frame.text = f"{p['cmp']}{p['value']:g}"
+                label.text_frame.paragraphs[0].runs[0].font.size = Pt(styles["chart_label"]["size"])
+        if has_ref:
+            ref = chart.plots[0].series[1]
+            ref.smooth = False
+            ref.marker.style = XL_MARKER_STYLE.NONE
+            ref.format.line.color.rgb = color("reference")
+            ref.format.line.width = Pt(1.25)
+            ref.format.line.dash_style = MSO_LINE_DASH_STYLE.DASH
+
+    def make_marker_trends(self):
+        # 本地规则提取的指标时间序列（见 markers.build_marker_trends），至少两个时间点才画趋势
+        trends = [t for t in self.data.get("marker_trends", []) if len(t.get("points", [])) >= 2]
+        if not trends: return
+        for kind, title in (("tumor", "肿瘤标志物动态变化"), ("lab", "关键检验指标动态变化")):
+            group = [t for t in trends if t.get("kind") == kind]
+            pages = [group[i:i + 4] for i in range(0, len(group), 4)]
+            for page_no, page in enumerate(pages, 1):
+                slide = self.add_slide(f"{title} ({page_no}/{len(pages)})" if len(pages) > 1 else title)
+                cols = 1 if len(page) == 1 else 2
+                rows = 1 if len(page) <= 2 else 2
+                cell_w = 12.0 / cols
+                cell_h = 6.3 / rows
+                for i, trend in enumerate(page):
+                    x = Inches(0.65 + (i % cols) * cell_w)
+                    y = Inches(1.05 + (i // cols) * cell_h)
+                    self.add_marker_chart(slide, trend, x, y, Inches(cell_w - 0.2), Inches(cell_h - 0.15))
+
+    def make_current_admission(self):
+        adm_data = self.data.get("current_admission")
+        if not adm_data: return
+        exams_list = adm_data.get("exams", [])
+        exams_str = "\n".join([f"• {item}" for item in exams_list]) if isinstance(exams_list, list) else str(exams_list)
+        imaging_str = adm_data.get("imaging", "")
+        plan_list = adm_data.get("plan", [])
+        plan_str = "\n".join([f"• {item}" for item in plan_list]) if isinstance(plan_list, list) else str(plan_list)
+        # 是否拆页由实际排版高度决定：放不下时检验、影像、计划依次续页
+        style = self.template.style
+        self.add_text_slides("本次入院评估及计划", [
+            style("heading", "【入院检验指标】", keep_with_next=True),
+            style("body_large", exams_str, space_after=12),
+            style("heading", "【影像学评估】", keep_with_next=True),
+            style("body_large", imaging_str, space_after=12),
+            style("heading", "【后续治疗与随访计划】", keep_with_next=True),
+            style("body_large", plan_str),
+        ], single_title="本次入院评估及计划 (转归)")
+
+    def timeline_card_paragraphs(self, evt, phase_label, color, width, height):
+        """卡片文字：按 card_* 样式预设（默认日期 10pt、正文 9pt），按字体度量放不下时逐级缩小 2pt，仍放不下则截断事件描述"""
+        inner_w = Inches(width - 0.1).pt
+        inner_h = Inches(height - 0.1).pt
+        event_text = evt.get("event", "")
+        style = self.template.style
+
+        def paragraphs(shrink, text):
+            paras = [style("card_date", evt.get("date", ""), color=color, align=PP_ALIGN.CENTER)]
+            if phase_label:
+                paras.append(style("card_phase", phase_label, color=color, align=PP_ALIGN.CENTER))
+            paras.append(style("card_body", text, align=PP_ALIGN.CENTER))
+            for para in paras:
+                para["size"] -= shrink
+            return paras
+
+        for shrink in (0, 1, 2):
+            paras = paragraphs(shrink, event_text)
+            if fits(paras, self.measurer, inner_w, inner_h):
+                return paras
+        head, body_size = paras[:-1], paras[-1]["size"]
+        room = (inner_h - sum(self.measurer.height(p["text"], inner_w, p["size"], p.get("bold", False)) for p in head)) \
+            // (body_size * LINE_SPACING)
+        lines = self.measurer.wrap(event_text, inner_w, body_size)
+        text = join_wrapped_lines(lines[:max(int(room), 1)])
+        return paragraphs(2, text[:-1] + "…" if text else text)
+
+    def make_timeline(self):
+        events = self.data.get("timeline_events", [])
+        if not events: return
+        # 事件按日期排序、按治疗阶段分页，卡片在比例时间轴上分四层（轴上下各两层）无重叠放置，事件数不设上限
+        line_y = 4.2
+        card_width, card_height = 1.5, 1.2
+        stem_base, lane_gap = 0.3, 0.12
+        margin = 0.35
+        pages = layout_timeline(events, margin + card_width / 2, 13.333 - margin - card_width / 2, card_width)
+        color = self.template.color
+        band_colors = (color("band"), color("band_alt"))
+
+        for page_no, page in enumerate(pages, 1):
+            slide = self.add_slide(f"全病程时间轴概览 ({page_no}/{len(pages)})" if len(pages) > 1
+                                   else "全病程时间轴概览 (Timeline)")
+
+            main_line = slide.shapes.add_shape(MSO_SHAPE.RIGHT_ARROW, Inches(margin), Inches(line_y - 0.05),
+                                               Inches(13.333 - 2 * margin), Inches(0.1))
+            main_line.fill.solid()
+            main_line.fill.fore_color.rgb = color("axis")
+            main_line.line.fill.background()
+
+            # 各治疗阶段在主轴上的色带
+            for k, band in enumerate(page["phases"]):
+                if not band["phase"]:
+                    continue
+                x0, x1 = band["x0"] - 0.2, band["x1"] + 0.2
+                shape = slide.shapes.add_shape(MSO_SHAPE.ROUNDED_RECTANGLE, Inches(x0), Inches(line_y - 0.13),
+                                               Inches(x1 - x0), Inches(0.26))
+                shape.fill.solid()
+                shape.fill.fore_color.rgb = band_colors[k % 2]
+                shape.line.fill.background()
+                # 色带够宽时在带内标注阶段名（节点圆点会压住一部分，只作辅助）
+                label = self.template.style("band_label", band["phase"], align=PP_ALIGN.CENTER)
+                if self.measurer.text_width(label["text"], label["size"]) + 8 <= Inches(x1 - x0).pt:
+                    tf = shape.text_frame
+                    tf.margin_left = tf.margin_right = tf.margin_top = tf.margin_bottom = 0
+                    self.fill_text_frame(tf, [label])
+
+            nodes = []
+            for item in page["items"]:
+                evt = events[item["index"]]
+                tags = self.term_tags["events"][item["index"]]
+                phase_text = evt.get("phase", "") 
+                event_type = evt.get("event_type", "Treatment")
+                # “未见进展”“无复发”这类被否定的进展按病情控制处理
+                is_pd = "progression" in tags["event"]
+                is_control = "response" in tags["event"] or "progression" in tags["event_negated"]
+                if is_pd: node_color = color("progression")
+                elif is_control and event_type == "Evaluation": node_color = color("control")
+                else: node_color = self.C_PRI 
+
+                depth = item["lane"] // 2
+                above = item["lane"] % 2 == 0
+                offset = stem_base + depth * (card_height + lane_gap)
+                card_top = line_y - offset - card_height if above else line_y + offset
+                stem = slide.shapes.add_shape(MSO_SHAPE.RECTANGLE, Inches(item["x"] - 0.015),
+                                              Inches(line_y - offset if above else line_y), Inches(0.03), Inches(offset)) 
+                stem.fill.solid()
+                stem.fill.fore_color.rgb = node_color
+                stem.line.fill.background()
+                nodes.append((item, evt, phase_text, event_type, node_color, card_top))
+
+            # 先画全部竖线再画圆点和卡片，外层卡片的竖线压在内层卡片下面
+            for item, evt, phase_text, event_type, node_color, card_top in nodes:
+                x = Inches(item["x"])
+                circle = slide.shapes.add_shape(MSO_SHAPE.OVAL, x - Inches(0.15), Inches(line_y - 0.15), Inches(0.3), Inches(0.3))
+                circle.fill.solid()
+                circle.fill.fore_color.rgb = node_color
+                circle.line.color.rgb = color("on_primary"); circle.line.width = Pt(2)
+
+                card = slide.shapes.add_shape(MSO_SHAPE.ROUNDED_RECTANGLE, x - Inches(card_width / 2), Inches(card_top),
+                                              Inches(card_width), Inches(card_height))
+                card.fill.solid()
+                card.fill.fore_color.rgb = color("card_fill")
+                card.line.color.rgb = node_color; card.line.width = Pt(1.5)
+                tf = card.text_frame
+                tf.margin_left = Inches(0.05); tf.margin_right = Inches(0.05); tf.margin_top = Inches(0.05); tf.margin_bottom = Inches(0.05)
+                if phase_text and phase_text != "评估":
+                    phase_label = f"【{phase_text}】"
+                elif event_type == "Evaluation":
+                    phase_label = "【疗效评估】"
+                else:
+                    phase_label = ""
+                self.fill_text_frame(tf, self.timeline_card_paragraphs(evt, phase_label, node_color, card_width, card_height))
+
+    def make_summary(self):
+        summary_data = self.data.get("summary", {})
+        highlights = []
+        discussion = []
+        if isinstance(summary_data, list):
+            highlights = summary_data
+        elif isinstance(summary_data, dict):
+            highlights = summary_data.get("highlights", [])
+            discussion = summary_data.get("discussion", [])
+
+        style = self.template.style
+        top = [style("highlight", f"• {item}", space_after=18) for item in highlights]
+        bottom = [style("discussion_title", "思考：", space_after=12, keep_with_next=True)]
+        bottom += [style("discussion", f"➤ {item}", space_after=14) for item in discussion]
+        width = Inches(11.5).pt - BOX_INSET_X
+
+        # 要点、思考各自的区域（缩字号后）都放得下时保持上下分栏，否则整体按正文页自动续页
+        scale = 1.0
+        while scale >= 0.85 - 1e-9:
+            if fits(top, self.measurer, width, Inches(3.0).pt - BOX_INSET_Y, scale) and \
+                    (not discussion or fits(bottom, self.measurer, width, Inches(2.8).pt - BOX_INSET_Y, scale)):
+                break
+            scale -= 0.05
+        else:
+            self.add_text_slides("病例思考与总结", top + (bottom if discussion else []), top=1.3)
+            return
+
+        slide = self.add_slide("病例思考与总结")
+        top_box = slide.shapes.add_textbox(Inches(0.8), Inches(1.3), Inches(11.5), Inches(3.0))
+        self.fill_text_frame(top_box.text_frame, top, scale)
+
+        line = slide.shapes.add_shape(MSO_SHAPE.RECTANGLE, Inches(0.8), Inches(4.3), Inches(11.5), Inches(0.03))
+        line.fill.solid()
+        line.fill.fore_color.rgb = self.C_PRI 
+        line.line.fill.background()
+
+        if discussion:
+            bottom_box = slide.shapes.add_textbox(Inches(0.8), Inches(4.5), Inches(11.5), Inches(2.8))
+            self.fill_text_frame(bottom_box.text_frame, bottom, scale)
+
+    def render_units(self):
+        """
+        按成品顺序拆开的页面单元：[(单元名, 输入, 构建函数)]，每种治疗阶段单独成一个单元。
+        “输入”是该单元读取的全部病例字段（clean_data 之后）与术语标签，增量重排（deck_cache）据此算指纹，
+        输入不变的单元直接复用上次生成的幻灯片。依次调用全部构建函数等价于 build()。
+        """
+        data, tags = self.data, self.term_tags
+        units = [("cover", data.get("cover", {}).get("title", "病例汇报"), self.make_cover),
+                 ("baseline", data.get("baseline", {}), self.make_baseline)]
+        for tx, tx_tags in zip(data.get("treatments", []), tags["treatments"]):
+            units.append(("treatment", [tx, tx_tags["phase"]], partial(self.make_treatment, tx, tx_tags)))
+        units += [("marker_trends", data.get("marker_trends", []), self.make_marker_trends),
+                  ("current_admission", data.get("current_admission"), self.make_current_admission),
+                  ("timeline", [data.get("timeline_events", []), tags["events"]], self.make_timeline),
+                  ("summary", data.get("summary", {}), self.make_summary)]
+        return units
+
+    def build(self):
+        for step in self.BUILD_STEPS:
+            with span(f"ppt.{step}"):
+                getattr(self, step)()
+        ppt_stream = io.BytesIO()
+        with span("ppt.save", slides=len(self.prs.slides)):
+            self.prs.save(ppt_stream)
+        ppt_stream.seek(0)
+        return ppt_stream
@@ -0,0 +1,129 @@
+import os
+import tomllib
+
+# ==========================================
+# 🔑 密钥与运行参数配置
+# ==========================================
+# 可配置项及默认值：键名与 .streamlit/secrets.toml / 环境变量中的写法一致，类型以默认值为准
+DEFAULTS = {
+    "BAIDU_API_KEY": "",
+    "BAIDU_SECRET_KEY": "",
+    "DEEPSEEK_API_KEY": "",
+
+    # 并发 OCR 的在途上限与单页重试次数（百度高精度版默认 QPS 较低，按账户配额调整）；
+    # 单页重试只针对百度返回的限流/临时错误码，网络错误与 429/5xx 由连接池的 HTTP_RETRIES 负责
+    "OCR_MAX_WORKERS": 2,
+    "OCR_PAGE_RETRIES": 2,
+
+    # 百度接口共享连接池：保持的长连接数、连接/读取超时（秒）、连接错误与 429/5xx 的自动重试次数
+    "HTTP_POOL_SIZE": 10,
+    "HTTP_CONNECT_TIMEOUT": 5.0,
+    "HTTP_READ_TIMEOUT": 30.0,
+    "HTTP_RETRIES": 3,
+
+    # DeepSeek 客户端：reasoner 思考可能长达数分钟，读取超时要留足；SDK 自带的退避重试次数
+    "LLM_CONNECT_TIMEOUT": 10.0,
+    "LLM_READ_TIMEOUT": 600.0,
+    "LLM_MAX_RETRIES": 2,
+
+    # OCR 结果本地缓存（按图片内容哈希），同一张化验单重复上传不再消耗百度额度；路径留空则不缓存
+    "OCR_CACHE_PATH": ".cache/ocr_cache.sqlite3",
+    "OCR_CACHE_MAX_MB": 200.0,
+
+    # OCR 前的图片预处理：长边上限（超过部分对文字识别没有增益，只会拖慢上传）、是否转灰度、JPEG 质量下限
+    "OCR_MAX_EDGE": 2560,
+    "OCR_GRAYSCALE": True,
+    "OCR_JPEG_QUALITY": 85,
+
+    # AI 解析结果本地缓存：同一份病史 + 同一版提示词 + 同一模型，直接复用上次解析出的病例 JSON
+    "LLM_CACHE_PATH": ".cache/llm_cache.sqlite3",
+    "LLM_CACHE_MAX_MB": 50.0,
+    "LLM_CACHE_TTL_HOURS": 24.0 * 7,
+
+    # 快速草稿：提交后先用非推理模型几秒内出一版草稿 PPT，reasoner 结果到达后自动替换（超长病历分段解析时不启用）
+    "SPECULATIVE_DRAFT": True,
+    "DRAFT_MODEL": "deepseek-chat",
+
+    # 肿瘤标志物/检验值趋势图：本地规则从原文提取数值与日期，生成可编辑的折线图页
+    "MARKER_TRENDS": True,
+
+    # PPT 正文排版测量用的 CJK 字体文件（.ttf/.ttc）；留空时自动查找常见系统字体，都没有则按字符宽度估算
+    "PPT_FONT_PATH": "",
+
+    # PPT 模板与主题：PPT_TEMPLATE_PATH 为医院/科室 .pptx 模板（16:9，留空用内置版式），
+    # PPT_THEME 为主题名（内置 default/navy/teal），PPT_THEME_PATH 为追加主题的 JSON 文件（格式见 deck_template.THEMES）
+    "PPT_TEMPLATE_PATH": "",
+    "PPT_THEME": "default",
+    "PPT_THEME_PATH": "",
+    # 增量重排：按页面单元缓存已排好的幻灯片（条数上限），页面里修改病例 JSON 后只重画受影响的页；0 表示关闭
+    "SLIDE_CACHE_ENTRIES": 256,
+
+    # AI 解析前的文本压缩：删掉跨页重复的抬头/页脚、重叠截图、近似重复段落和样板行，缩短提示词。
+    # COMPACTION_EXTRA_PATTERNS 为追加的样板行正则（整行匹配，每行一个），用于本院特有的页眉页脚
+    "TEXT_COMPACTION": True,
+    "COMPACTION_EXTRA_PATTERNS": "",
+
+    # 超长病历分段解析：超过阈值字数时按页/按日期切块，多块并发提取后在本地合并
+    "LONG_RECORD_THRESHOLD": 12000,
+    "LLM_CHUNK_CHARS": 6000,
+    "LLM_MAX_WORKERS": 4,
+
+    # 链路追踪与指标：TRACE_LOG_PATH 为逐个 span 的 JSON 日志文件（"-" 输出到标准错误，留空不写），
+    # METRICS_PATH 为 Prometheus 文本格式指标文件（每次生成任务结束覆盖写入），METRICS_PORT 非 0 时在该端口提供 /metrics 抓取端点，
+    # 默认只监听本机（METRICS_HOST），需要跨机器抓取时显式配置为 0.0.0.0 或网卡地址
+    "TRACE_LOG_PATH": "",
+    "METRICS_PATH": "",
+    "METRICS_PORT": 0,
+    "METRICS_HOST": "127.0.0.1",
+
+    # 后台任务池：同时执行的生成任务数，以及结束后结果（PPT 字节、病例 JSON）在内存中保留的时长
+    "JOB_MAX_WORKERS": 4,
+    "JOB_RESULT_TTL_MINUTES": 30.0,
+
+    # 后端选择：OCR_BACKEND 为 baidu / replay，LLM_BACKEND 为 deepseek / replay。
+    # replay 从 REPLAY_DIR 回放录制的响应（没有录制则返回占位结果），不需要任何密钥，用于本地调试与基准测试；
+    # RECORD_DIR 非空时，真实后端的每次响应都会写入该目录，之后即可离线回放
+    "OCR_BACKEND": "baidu",
+    "LLM_BACKEND": "deepseek",
+    "REPLAY_DIR": "",
+    "RECORD_DIR": "",
+    # 回放后端注入的模拟耗时：OCR 每页延迟（含随机抖动）、AI 首字延迟与吐字速度（0 表示不限速）
+    "MOCK_OCR_LATENCY_MS": 0,
+    "MOCK_OCR_JITTER_MS": 0,
+    "MOCK_LLM_LATENCY_MS": 0,
+    "MOCK_LLM_CHARS_PER_SECOND": 0,
+}
+
+def _coerce(default, value):
+    if isinstance(default, bool):
+        # 环境变量里只能写字符串，"false"/"0" 之类要当作关闭
+        return value if isinstance(value, bool) else str(value).strip().lower() in ("1", "true", "yes", "on")
+    return type(default)(value)
+
+class Settings:
+    """
+    运行参数的只读快照。各项以小写属性访问（如 settings.ocr_max_workers），
+    来源可以是 st.secrets、secrets.toml 文件或环境变量，业务模块本身不直接读取任何配置源。
+    """
+    def __init__(self, values=None):
+        values = values or {}
+        for key, default in DEFAULTS.items():
+            value = values.get(key, default)
+            setattr(self, key.lower(), _coerce(default, value))
+
+    @classmethod
+    def from_mapping(cls, mapping, environ=None):
+        """从任意映射（st.secrets、dict 等）读取，缺失项使用默认值；传入 environ 时同名环境变量优先"""
+        values = {key: mapping[key] for key in DEFAULTS if key in mapping}
+        if environ is not None:
+            values.update({key: environ[key] for key in DEFAULTS if key in environ})
+        return cls(values)
+
+    @classmethod
+    def load(cls, secrets_path=".streamlit/secrets.toml", environ=None):
+        """命令行/脚本场景：先读 secrets.toml（存在的话），再用同名环境变量覆盖"""
+        values = {}
+        if secrets_path and os.path.exists(secrets_path):
+            with open(secrets_path, "rb") as f:
+                values.update(tomllib.load(f))
+        return cls.from_mapping(values, os.environ if environ is None else environ)
@@ -0,0 +1,8 @@
+from batch_cli import discover_cases
+
+def test_discover_cases_keeps_colliding_stems_apart(tmp_path):
+    (tmp_path / "张某").mkdir()
+    for name in ("张某/01.jpg", "张某.txt", "张某.png", "李某.txt", "Report.md"):
+        (tmp_path / name).write_bytes(b"")
+    names = [case["name"] for case in discover_cases(str(tmp_path))]
+    assert sorted(names) == sorted(["张某", "张某.txt", "张某.png", "李某", "Report.md"])
@@ -0,0 +1,33 @@
+import pytest
+
+from clinical_terms import DEFAULT_CLASSIFIER
+
+# ==========================================
+# 术语标签与否定：(文本, 命中的标签, 被否定的标签)
+# ==========================================
+TAG_CASES = [
+    ("未见明显进展", set(), {"progression"}),
+    ("无复发", set(), {"progression"}),
+    ("未见复发、转移或进展", set(), {"progression"}),
+    # 伪否定：字面带“无”，病情其实是进展/复发
+    ("无明显诱因出现肝转移进展", {"progression"}, set()),
+    ("无进展生存期12月后再次复发", {"progression"}, set()),
+    ("mPFS 8个月，复查提示PD", {"progression"}, set()),
+    # 否定只作用于附近的术语，不延伸到整句
+    ("未规律随访，3月后疾病进展", {"progression"}, set()),
+    ("无不适主诉，复查CT示肝内病灶较前明显进展", {"progression"}, set()),
+    ("进展期胃癌", set(), set()),
+    ("PD-1 抑制剂治疗后 PR", {"response"}, set()),
+    ("腹腔镜下根治术", {"surgery"}, set()),
+    ("术后辅助化疗", {"adjuvant"}, set()),
+]
+
+@pytest.mark.parametrize("text, found, negated", TAG_CASES)
+def test_tags(text, found, negated):
+    assert DEFAULT_CLASSIFIER.tags(text) == (found, negated)
+
+def test_classify_case_events():
+    case = {"timeline_events": [{"phase": "二线治疗", "event": "无明显诱因出现肝转移进展"},
+                                {"phase": "一线治疗", "event": "复查未见明显进展"}]}
+    events = DEFAULT_CLASSIFIER.classify_case(case)["events"]
+    assert [(e["event"], e["event_negated"]) for e in events] == [({"progression"}, set()), (set(), {"progression"})]
@@ -0,0 +1,33 @@
+import time
+import random
+
+from compaction import compact_medical_text
+
+def test_near_duplicates_removed_but_new_numbers_kept():
+    block = "复查胸腹部CT提示肝内多发转移灶较前缩小，继续原方案治疗，患者耐受可，无明显不适"
+    text = "\n\n".join([block, block.replace("缩小", "缩少"), block + " CEA 3.1"])
+    compacted, stats = compact_medical_text(text)
+    assert stats["removed"] == {"near_duplicate": 1}
+    assert compacted.count("CEA 3.1") == 1
+
+def test_near_duplicates_only_within_adjacent_pages_and_same_date():
+    block = "复查胸腹部CT提示肝内多发转移灶较前缩小，继续原方案治疗，患者耐受可，无明显不适"
+    pages = lambda *bodies: "\n".join(f"【第{i}页提取结果】\n{body}" for i, body in enumerate(bodies, 1))
+    # 相邻两页的重叠截图：删
+    _, stats = compact_medical_text(pages(block, block))
+    assert stats["removed"].get("near_duplicate") == 1
+    # 隔了一页：不是截图重叠，留着
+    _, stats = compact_medical_text(pages(block, "入院后完善相关检查", block))
+    assert "near_duplicate" not in stats["removed"]
+    # 同一页里不同日期标题下的相同段落：两个时间点，都留着
+    _, stats = compact_medical_text(f"2021-03-05\n\n{block}\n\n2021-05-05\n\n{block}")
+    assert "near_duplicate" not in stats["removed"]
+
+def test_near_duplicate_pass_is_not_quadratic():
+    # 上千个互不相同、又没有数字可以区分的段落：逐对比较要跑几分钟
+    words = ["患者", "复查", "胸腹部CT", "提示", "肝内", "转移灶", "较前", "增大", "给予", "奥沙利铂", "化疗", "出院"]
+    rng = random.Random(0)
+    blocks = ["".join(rng.choice(words) for _ in range(24)) for _ in range(1500)]
+    start = time.perf_counter()
+    compact_medical_text("\n\n".join(blocks))
+    assert time.perf_counter() - start < 10
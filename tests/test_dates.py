@@ -0,0 +1,42 @@
+import pytest
+
+from dates import parse_date_key, format_date_key
+from markers import extract_marker_points
+from extraction import merge_case_fragments
+
+# ==========================================
+# 日期解析：(写法, 期望的 (年, 月, 日))；时间轴、分段合并与检验值共用
+# ==========================================
+DATE_CASES = [
+    ("2021-03-15", (2021, 3, 15)),
+    ("2021/3/5", (2021, 3, 5)),
+    ("2021.3", (2021, 3, 0)),
+    ("2021年3月", (2021, 3, 0)),
+    ("2021年3月5日", (2021, 3, 5)),
+    ("２０２１年３月", (2021, 3, 0)),
+    ("2021年", (2021, 0, 0)),
+    ("20210315", (2021, 3, 15)),
+    ("2021.01 - 2021.05", (2021, 1, 0)),
+    ("2021-13", None),
+    ("住院号 20193012", None),
+    ("第1234例", None),
+    ("3月", None),
+    ("", None),
+]
+
+@pytest.mark.parametrize("text, expected", DATE_CASES)
+def test_parse_date_key(text, expected):
+    assert parse_date_key(text) == expected
+
+@pytest.mark.parametrize("key, text", [((2021, 3, 5), "2021-03-05"), ((2021, 3, 0), "2021-03"), ((2021, 0, 0), "2021")])
+def test_format_date_key(key, text):
+    assert format_date_key(key) == text
+
+@pytest.mark.parametrize("date", ["2021.3", "2021年3月", "2021-03"])
+def test_partial_dates_agree_across_merge_and_markers(date):
+    merged = merge_case_fragments([
+        {"timeline_events": [{"date": date, "event": "一线化疗"}]},
+        {"timeline_events": [{"date": "2021年3月", "event": "一线化疗"}]},
+    ])
+    assert len(merged["timeline_events"]) == 1
+    assert [p["date"] for p in extract_marker_points(f"{date} CEA 3.1")] == [(2021, 3, 0)]
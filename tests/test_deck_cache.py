@@ -0,0 +1,63 @@
+import io
+import copy
+import zipfile
+
+from pptx import Presentation
+
+from layout import TextMeasurer
+from deck_template import load_deck_template
+from deck_cache import IncrementalDeckRenderer
+from markers import build_marker_trends
+from ppt_maker import AdvancedPPTMaker
+
+RECORD = """2020-01-02 胃镜活检示腺癌，CEA 8.5 ng/ml，CA19-9 60 U/ml
+2020-04-03 一线 SOX 方案化疗后复查 CEA 4.2 ng/ml，CA19-9 35 U/ml
+2020-09-05 二线 FOLFIRI 方案治疗后复查 CEA 12.3 ng/ml，CA19-9 80 U/ml"""
+
+def make_case():
+    treatments = [
+        {"phase": "一线治疗", "duration": "2020-01 至 2020-04", "regimen": "SOX 方案 ×4 周期", "imaging": "PR"},
+        {"phase": "二线治疗", "duration": "2020-05 至 2020-09", "regimen": "FOLFIRI 方案 ×6 周期", "imaging": "SD"},
+    ]
+    return {
+        "cover": {"title": "晚期胃癌多线治疗病例汇报"},
+        "baseline": {"patient_info": "男，56岁", "diagnosis": "胃腺癌 cT4N2M1"},
+        "treatments": treatments,
+        "timeline_events": [{"date": "2020-01", "event": "确诊", "event_type": "Evaluation"},
+                            {"date": "2020-05", "event": "一线进展，改二线", "event_type": "Treatment"}],
+        "summary": {"highlights": ["多线治疗后疾病稳定"], "discussion": ["三线方案选择"]},
+        "marker_trends": build_marker_trends(RECORD, treatments),
+    }
+
+def slide_outline(ppt_bytes):
+    """每页的版式名 + 全部文字 + 图表数，用来比对页序"""
+    outline = []
+    for slide in Presentation(io.BytesIO(ppt_bytes)).slides:
+        texts = [shape.text_frame.text for shape in slide.shapes if shape.has_text_frame]
+        charts = sum(1 for shape in slide.shapes if shape.has_chart)
+        outline.append((slide.slide_layout.name, texts, charts))
+    return outline
+
+def test_edit_one_treatment_rebuilds_only_that_unit():
+    measurer, template = TextMeasurer(), load_deck_template()
+    renderer = IncrementalDeckRenderer(template, measurer)
+    _, first = renderer.render(make_case())
+    assert first["reused_slides"] == 0
+
+    case = make_case()
+    case["treatments"][1]["regimen"] = "FOLFIRI + 贝伐珠单抗 ×6 周期"
+    expected = AdvancedPPTMaker(copy.deepcopy(case), measurer=measurer, template=template).build().getvalue()
+    ppt_bytes, stats = renderer.render(case)
+    assert stats["rebuilt"] == ["treatment"]
+    assert 0 < stats["reused_slides"] < stats["slides"]
+    assert slide_outline(ppt_bytes) == slide_outline(expected)
+    assert any("贝伐珠单抗" in " ".join(texts) for _, texts, _ in slide_outline(ppt_bytes))
+
+    # 从快照还原的图表页：图表 XML 能解析出数据，内嵌数据表是完整的 xlsx
+    charts = [shape.chart for slide in Presentation(io.BytesIO(ppt_bytes)).slides
+              for shape in slide.shapes if shape.has_chart]
+    assert charts
+    for chart in charts:
+        assert all(len(list(series.values)) > 0 for series in chart.plots[0].series)
+        xlsx = chart.part.chart_workbook.xlsx_part
+        assert xlsx is not None and zipfile.ZipFile(io.BytesIO(xlsx.blob)).testzip() is None
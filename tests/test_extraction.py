@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+from cache import DiskCache
+from backends import ReplayLLMClient
+from extraction import (PARTIAL_KEY, FAILED_CHUNKS_KEY, parse_model_json, extract_case_with_cache, extract_long_case,
+                        get_cached_case, has_cached_case, diff_case_fields, merge_case_fragments, normalize_case, CASE_SCHEMA)
+
+# ==========================================
+# 容错 JSON 解析：(模型回复, 期望解析结果)
+# ==========================================
+REPAIR_CASES = [
+    # 值里的全角冒号 + 中文引号不能被当成结构符号改掉
+    ('{"cover": {"title": "医生说：“继续化疗”",}}', {"cover": {"title": "医生说：“继续化疗”"}}),
+    ('{"treatments": [{"phase": "一线", "regimen": "SOX，患者诉：“乏力明显”", "imaging": "PR",}]}',
+     {"treatments": [{"phase": "一线", "regimen": "SOX，患者诉：“乏力明显”", "imaging": "PR"}]}),
+    # 结构位置上的中文引号、全角冒号和逗号
+    ('{“cover”：{“title”：“汇报”}，“summary”：{"highlights"：["a"，"b"]}}',
+     {"cover": {"title": "汇报"}, "summary": {"highlights": ["a", "b"]}}),
+    ('{“cover”：{“title”：“诉“乏力””}}', {"cover": {"title": "诉“乏力”"}}),
+    # 前言 + 代码块 + 结尾说明
+    ('好的，结果如下：\n```json\n{"cover": {"title": "x"}}\n```\n以上。', {"cover": {"title": "x"}}),
+]
+
+@pytest.mark.parametrize("raw, expected", REPAIR_CASES)
+def test_parse_model_json_repairs_structure_only(raw, expected):
+    assert parse_model_json(raw) == expected
+
+def test_truncated_reply_is_flagged_partial():
+    result = parse_model_json('{"cover": {"title": "x"}, "treatments": [{"phase": "一线", "regimen": "FOLFOX')
+    assert result[PARTIAL_KEY] is True
+    assert result["treatments"][0]["regimen"] == "FOLFOX"
+
+@pytest.mark.parametrize("reply, cached", [
+    ('{"cover": {"title": "完整"}}', True),
+    ('{"cover": {"title": "截断"}, "treatments": [{"phase": "一线', False),
+])
+def test_partial_salvage_is_not_cached(tmp_path, reply, cached):
+    cache = DiskCache(str(tmp_path / "llm.sqlite3"), "case_json", 10 ** 6)
+    client = ReplayLLMClient(response_factory=lambda messages: reply)
+    case_json, from_cache = extract_case_with_cache("病史" * 20, client, cache)
+    assert PARTIAL_KEY not in case_json and not from_cache
+    assert (get_cached_case("病史" * 20, cache) is not None) is cached
+
+def test_has_cached_case_does_not_count(tmp_path):
+    cache = DiskCache(str(tmp_path / "llm.sqlite3"), "case_json", 10 ** 6)
+    assert not has_cached_case("病史" * 20, cache)
+    extract_case_with_cache("病史" * 20, ReplayLLMClient(), cache)
+    assert has_cached_case("病史" * 20, cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+
+def test_diff_case_fields_skips_local_fields():
+    draft = {"cover": {"title": "草稿"}, "marker_trends": [{"name": "CEA", "points": []}]}
+    final = {"cover": {"title": "终稿"}, "marker_trends": [{"name": "CEA", "points": [{"value": 1.0}]}]}
+    assert diff_case_fields(draft, final) == [("cover.title", "草稿", "终稿")]
+
+def test_merged_fragments_have_the_single_call_shape():
+    merged = merge_case_fragments([
+        {"baseline": {"diagnosis": "胃癌"}, "treatments": [{"phase": "一线", "regimen": ["SOX", "PD-1"]}]},
+        {"timeline_events": [{"date": "2021.3", "event": "化疗", "event_type": "评估"}], "summary": ["亮点"]},
+    ])
+    assert merged == normalize_case(merged)
+    assert set(CASE_SCHEMA) <= set(merged)
+    assert merged["treatments"][0]["regimen"] == "SOX；PD-1"
+    assert merged["timeline_events"][0]["event_type"] == "Evaluation"
+
+# ==========================================
+# 超长病历分段解析：单块失败重试一次，仍失败则跳过
+# ==========================================
+def test_long_case_retries_failed_chunk_once_then_merges_the_rest():
+    pages = {1: "2020-01-02 胃镜活检示腺癌", 2: "2020-02-03 一线 SOX 方案化疗", 3: "2020-05-06 复查 CT 疗效评估 PR"}
+    text = "\n".join(f"【第{n}页提取结果】\n{body}\n" + "病程记录" * 40 for n, body in pages.items())
+    calls = {}
+
+    def factory(messages):
+        n = next(n for n, body in pages.items() if body in messages[-1]["content"])
+        calls[n] = calls.get(n, 0) + 1
+        if n == 2 and calls[n] == 1:
+            raise TimeoutError("第一次超时")
+        if n == 3:
+            raise TimeoutError("一直超时")
+        return json.dumps({"timeline_events": [{"date": pages[n][:10], "event": pages[n][11:]}]}, ensure_ascii=False)
+
+    progress = []
+    case_json, from_cache = extract_long_case(text, ReplayLLMClient(response_factory=factory), None,
+                                              chunk_chars=200, on_chunk_done=lambda *args: progress.append(args))
+    assert calls == {1: 1, 2: 2, 3: 2}
+    assert [evt["date"] for evt in case_json["timeline_events"]] == ["2020-01-02", "2020-02-03"]
+    assert case_json[FAILED_CHUNKS_KEY] == [3] and not from_cache
+    assert [(done, total) for done, total, _, _ in progress] == [(1, 3), (2, 3), (3, 3)]
+    assert progress[-1][3] == [3]
+
+def test_long_case_raises_when_every_chunk_fails():
+    def factory(messages):
+        raise TimeoutError("全部超时")
+    text = "\n".join(f"【第{n}页提取结果】\n" + "病程记录" * 40 for n in range(1, 3))
+    with pytest.raises(TimeoutError):
+        extract_long_case(text, ReplayLLMClient(response_factory=factory), None, chunk_chars=200)
@@ -0,0 +1,69 @@
+import time
+import threading
+
+from jobs import JobManager
+
+def wait_for(manager, job_id, statuses, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = manager.get(job_id)
+        if job is not None and job["status"] in statuses:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"任务 {job_id} 没有进入 {statuses}：{manager.get(job_id)}")
+
+def test_status_transitions_and_progress_updates():
+    manager = JobManager(max_workers=1, result_ttl=60)
+    release = threading.Event()
+
+    def slow(update, value):
+        update(stage="解析中", progress=0.5)
+        release.wait(5)
+        return value * 2
+
+    first = manager.submit(slow, 21)
+    second = manager.submit(slow, 1)  # 单线程池：第一个任务没结束前一直排队
+    wait_for(manager, first, {"running"})
+    while manager.get(first)["progress"] != 0.5:
+        time.sleep(0.01)
+    assert manager.get(first)["stage"] == "解析中"
+    assert manager.get(second)["status"] == "queued"
+    assert manager.active_count() == 2
+
+    release.set()
+    job = wait_for(manager, first, {"done"})
+    assert job["result"] == 42 and job["progress"] == 1.0 and job["error"] is None
+    assert job["finished_at"] >= job["created_at"]
+    wait_for(manager, second, {"done"})
+    assert manager.active_count() == 0
+
+def test_failing_job_captures_error():
+    manager = JobManager(max_workers=1, result_ttl=60)
+
+    def broken(update):
+        update(stage="AI 解析中")
+        raise ValueError("AI 生成的数据不是 JSON 对象，请重试。")
+
+    job = wait_for(manager, manager.submit(broken), {"error", "done"})
+    assert job["status"] == "error"
+    assert job["error"] == "AI 生成的数据不是 JSON 对象，请重试。"
+    assert job["result"] is None and job["finished_at"] is not None
+
+def test_finished_results_expire_after_ttl_but_running_jobs_stay():
+    manager = JobManager(max_workers=2, result_ttl=0.2)
+    release = threading.Event()
+    done = manager.submit(lambda update: "ppt-bytes")
+    running = manager.submit(lambda update: release.wait(5))
+    wait_for(manager, done, {"done"})
+    wait_for(manager, running, {"running"})
+
+    time.sleep(0.3)
+    # 不提交新任务，单靠轮询 get / active_count 也会清掉过期结果
+    assert manager.active_count() == 1
+    assert manager.get(done) is None
+    assert manager.get(running)["status"] == "running"
+
+    release.set()
+    wait_for(manager, running, {"done"})
+    time.sleep(0.3)
+    assert manager.get(running) is None
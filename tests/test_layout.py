@@ -0,0 +1,9 @@
+from layout import TextMeasurer
+
+def test_measurer_cache_holds_glyphs_not_tokens():
+    measurer = TextMeasurer()
+    for i in range(500):
+        measurer.wrap(f"CEA {i}.{i % 10} ng/ml 2021-03-{i % 28 + 1:02d} 奥沙利铂", 200, 12)
+    # 每份病例的化验值、日期都不同：缓存大小只取决于出现过的字符种类
+    assert len(measurer._widths) <= len(set("CEA0123456789.ng/ml-奥沙利铂 "))
+    assert measurer.text_width("CEA 12.3", 12) == sum(measurer.text_width(ch, 12) for ch in "CEA 12.3")
@@ -0,0 +1,26 @@
+import pytest
+
+from markers import extract_marker_points
+
+# ==========================================
+# 指标名与数值配对：(化验行, 期望的 [(指标, 数值, 比较符, 标记)])
+# ==========================================
+MARKER_CASES = [
+    ("2021-03-05 CEA 3.1 ng/ml", [("CEA", 3.1, "", "")]),
+    # 中文名与英文缩写写在一起时合并成一个名称，不能在别名处截断数值窗口
+    ("2021-03-05 癌胚抗原(CEA) 3.1 ng/ml", [("CEA", 3.1, "", "")]),
+    ("2021-03-05 糖类抗原19-9(CA19-9) 85.6", [("CA19-9", 85.6, "", "high")]),
+    ("2021-03-05 甲胎蛋白（AFP）：12.0", [("AFP", 12.0, "", "high")]),
+    ("2021-03-05 CEA(癌胚抗原) 3.1", [("CEA", 3.1, "", "")]),
+    # 检测限以下的结果保留比较符，不按上限判偏高
+    ("2021-03-05 AFP<20", [("AFP", 20.0, "<", "")]),
+    ("2021-03-05 CA125 >1000", [("CA125", 1000.0, ">", "high")]),
+    ("2021-03-05 WBC <3.5", [("WBC", 3.5, "<", "low")]),
+    ("2021-03-05 CEA 3.1 CA125 40 AFP 2", [("CEA", 3.1, "", ""), ("CA125", 40.0, "", "high"), ("AFP", 2.0, "", "")]),
+    ("CEA 3.1", []),  # 没有日期的数值不进入结果
+]
+
+@pytest.mark.parametrize("line, expected", MARKER_CASES)
+def test_extract_marker_points(line, expected):
+    points = extract_marker_points(line)
+    assert [(p["name"], p["value"], p["cmp"], p["flag"]) for p in points] == expected
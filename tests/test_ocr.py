@@ -0,0 +1,131 @@
+import time
+import threading
+
+import pytest
+
+import ocr
+from ocr import BaiduTokenProvider, OCRError, batch_ocr, ocr_page_with_retry, perform_ocr
+from backends import BaiduOCRBackend
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        if self.body is None:
+            raise ValueError("Expecting value: line 1 column 1 (char 0)")
+        return self.body
+
+class FakeSession:
+    """
+    按 URL 路由的假连接池：token 接口每次发新 token（token-1、token-2...），耗时 token_delay 秒；
+    OCR 接口依次返回 ocr_replies 里的响应（用完后重复最后一个）。
+    """
+    def __init__(self, ocr_replies=(), token_delay=0):
+        self.ocr_replies = list(ocr_replies)
+        self.token_delay = token_delay
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def request(self, method, url, headers=None, data=None):
+        with self._lock:
+            self.requests.append(url)
+            issued = len(token_requests(self))
+        if "oauth" in url:
+            time.sleep(self.token_delay)
+            return FakeResponse(200, {"access_token": f"token-{issued}", "expires_in": 2592000})
+        with self._lock:
+            return self.ocr_replies.pop(0) if len(self.ocr_replies) > 1 else self.ocr_replies[0]
+
+def ocr_requests(session):
+    return [url for url in session.requests if "/ocr/" in url]
+
+def token_requests(session):
+    return [url for url in session.requests if "oauth" in url]
+
+def run_concurrently(fn, threads=8):
+    barrier = threading.Barrier(threads)
+    results = [None] * threads
+
+    def worker(i):
+        barrier.wait()
+        results[i] = fn()
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return results
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(ocr, "backoff_delay", lambda attempt: 0)
+
+# ==========================================
+# access_token 单飞刷新与失效重发
+# ==========================================
+def test_concurrent_get_fetches_token_once():
+    session = FakeSession(token_delay=0.1)
+    provider = BaiduTokenProvider("ak", "sk", session=session)
+    assert run_concurrently(provider.get) == ["token-1"] * 8
+    assert len(token_requests(session)) == 1
+
+def test_concurrent_refresh_of_same_stale_token_fetches_once():
+    session = FakeSession(token_delay=0.1)
+    provider = BaiduTokenProvider("ak", "sk", session=session)
+    stale = provider.get()
+    # 多个请求同时发现 token 失效：第一个刷新，其余复用刷新出来的新 token
+    assert run_concurrently(lambda: provider.refresh(stale_token=stale)) == ["token-2"] * 8
+    assert len(token_requests(session)) == 2
+
+def test_invalid_token_reply_refreshes_once_and_resends():
+    invalid = FakeResponse(200, {"error_code": 110, "error_msg": "Access token invalid or no longer valid"})
+    session = FakeSession([invalid, FakeResponse(200, {"words_result": [{"words": "CEA 3.1"}]})])
+    provider = BaiduTokenProvider("ak", "sk", session=session)
+    assert perform_ocr(b"image", provider) == "CEA 3.1"
+    assert len(token_requests(session)) == 2
+    sent = ocr_requests(session)
+    assert len(sent) == 2
+    assert sent[0].endswith("access_token=token-1") and sent[1].endswith("access_token=token-2")
+
+def test_invalid_token_twice_is_not_resent_again():
+    invalid = FakeResponse(200, {"error_code": 111, "error_msg": "Access token expired"})
+    session = FakeSession([invalid])
+    provider = BaiduTokenProvider("ak", "sk", session=session)
+    with pytest.raises(OCRError):
+        perform_ocr(b"image", provider)
+    assert len(token_requests(session)) == 2 and len(ocr_requests(session)) == 2
+
+# ==========================================
+# 重试只有一层：HTTP 错误归连接池，百度错误码归单页重试
+# ==========================================
+def test_http_error_after_transport_retries_is_not_retried_per_page():
+    session = FakeSession([FakeResponse(503, None)])
+    backend = BaiduOCRBackend(BaiduTokenProvider("ak", "sk", session=session))
+    result = ocr_page_with_retry(b"not-an-image", backend, retries=2)
+    assert not result["ok"] and "HTTP 503" in result["text"]
+    assert len(ocr_requests(session)) == 1
+
+def test_baidu_rate_limit_code_is_retried_per_page():
+    limited = FakeResponse(200, {"error_code": 18, "error_msg": "Open api qps request limit reached"})
+    session = FakeSession([limited, limited, FakeResponse(200, {"words_result": [{"words": "CEA 3.1"}]})])
+    backend = BaiduOCRBackend(BaiduTokenProvider("ak", "sk", session=session))
+    result = ocr_page_with_retry(b"not-an-image", backend, retries=2)
+    assert result["ok"] and result["text"] == "CEA 3.1"
+    assert len(ocr_requests(session)) == 3
+
+class FlakyBackend:
+    name = "flaky"
+
+    def recognize(self, image_bytes):
+        if image_bytes == b"bad":
+            raise KeyError("words_result")
+        if image_bytes == b"quota":
+            raise OCRError("识别错误: 日调用量超限", retryable=False)
+        return image_bytes.decode()
+
+def test_unexpected_backend_error_fails_only_that_page():
+    results = batch_ocr({0: b"page-1", 1: b"bad", 2: b"quota", 3: b"page-4"}, FlakyBackend())
+    assert [results[i]["ok"] for i in range(4)] == [True, False, False, True]
+    assert "KeyError" in results[1]["text"]
@@ -0,0 +1,65 @@
+import time
+
+from settings import Settings
+from pipeline import CasePipeline
+from backends import ReplayLLMClient
+from extraction import REASONER_MODEL
+from tracing import start_run
+
+LAB = "复查肿瘤标志物：CEA 12.3 ng/ml，CA19-9 40 U/ml，较前相仿，继续原方案治疗"
+
+def test_repeated_lab_under_new_date_survives_compaction():
+    # 两次复查数值相同：是两个时间点，压缩不能把 2021-05-05 那段当重复删掉，趋势图也要有两个点
+    text = f"2021-03-05\n\n{LAB}\n\n2021-05-05\n\n{LAB}\n\n" + "患者病史记录" * 5
+    pipeline = CasePipeline(Settings({"OCR_BACKEND": "replay", "LLM_BACKEND": "replay",
+                                      "OCR_CACHE_PATH": "", "LLM_CACHE_PATH": ""}))
+    compacted, _ = pipeline.compact(text)
+    assert compacted.count("CEA 12.3") == 2
+    assert compacted.index("2021-05-05") < compacted.rindex("CEA 12.3")
+    result = pipeline.run(text)
+    assert "near_duplicate" not in result["compaction"]["removed"]
+    dates = {trend["name"]: [p["date"] for p in trend["points"]] for trend in result["case_json"]["marker_trends"]}
+    assert dates == {"CEA": ["2021-03-05", "2021-05-05"], "CA19-9": ["2021-03-05", "2021-05-05"]}
+
+# ==========================================
+# 快速草稿 vs reasoner 竞速
+# ==========================================
+class RaceClient(ReplayLLMClient):
+    """按模型设定首字延迟的回放客户端；延迟为 None 的模型直接报错"""
+    def __init__(self, latency_by_model):
+        super().__init__()
+        self.latency_by_model = latency_by_model
+
+    def _create(self, model, messages, stream=False, **kwargs):
+        if self.latency_by_model[model] is None:
+            raise TimeoutError(f"{model} 超时")
+        time.sleep(self.latency_by_model[model] / 1000)
+        return super()._create(model, messages, stream=stream, **kwargs)
+
+def race(draft_ms, reasoner_ms):
+    settings = Settings({"OCR_BACKEND": "replay", "LLM_BACKEND": "replay", "OCR_CACHE_PATH": "", "LLM_CACHE_PATH": ""})
+    client = RaceClient({settings.draft_model: draft_ms, REASONER_MODEL: reasoner_ms})
+    pipeline = CasePipeline(settings, llm_client_factory=lambda: client)
+    drafts = []
+    with start_run("test.speculative") as run:
+        case_json, _, draft = pipeline.extract_speculative("患者男，56岁，结肠癌多线治疗后进展" * 3, on_draft=drafts.append)
+    time.sleep(0.4)  # 落后的一方跑完，确认它不会再回调
+    return case_json, draft, drafts, run
+
+def draft_stage(run):
+    return next(s for s in run.breakdown()["stages"] if s["name"] == "pipeline.draft")
+
+def test_draft_first_is_shown_and_returned():
+    case_json, draft, drafts, _ = race(draft_ms=0, reasoner_ms=300)
+    assert draft is not None and drafts == [draft]
+    assert case_json["cover"]["title"]
+
+def test_reasoner_first_discards_late_draft():
+    case_json, draft, drafts, _ = race(draft_ms=300, reasoner_ms=0)
+    assert draft is None and drafts == []
+    assert case_json["cover"]["title"]
+
+def test_draft_failure_is_traced_not_raised():
+    _, draft, drafts, run = race(draft_ms=None, reasoner_ms=200)
+    assert draft is None and drafts == []
+    assert draft_stage(run)["errors"] == 1
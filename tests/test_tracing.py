@@ -0,0 +1,16 @@
+from tracing import TRACER, record_duration, span, start_run
+
+def test_metrics_file_written_per_run_not_per_rerun(tmp_path, monkeypatch):
+    path = tmp_path / "metrics.prom"
+    monkeypatch.setattr(TRACER, "metrics_path", str(path))
+    # 页面每次 rerun 补记的耗时、零散的根 span 都不写文件
+    record_duration("app.rerun", 0.01)
+    with span("pipeline.warm_up"):
+        pass
+    assert not path.exists()
+
+    with start_run("pipeline.run"):
+        with span("pipeline.extract"):
+            pass
+    text = path.read_text(encoding="utf-8")
+    assert 'span="pipeline.run"' in text and 'span="app.rerun"' in text
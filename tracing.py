@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# ==========================================
+# 📈 链路追踪与指标 (计时 span -> JSON 日志 + Prometheus 指标 + 单次运行耗时分解)
+# ==========================================
+# 用法：with span("ocr.request", payload_bytes=n) as s: ...; s.set(prompt_tokens=...)
+# 每个 span 结束时：写一行 JSON 日志（logger "case_pipeline.trace"）、计入耗时直方图，
+# 并归入当前运行（start_run）的耗时分解。工作线程里要继承当前运行/父 span，提交任务时用 contextvars.copy_context().run 包一层。
+logger = logging.getLogger("case_pipeline.trace")
+
+# 耗时直方图分桶（秒）：覆盖排版的毫秒级到 reasoner 的数分钟
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+# 耗时分解里按运行累加的数值属性（OCR 上传字节数、AI token 用量）
+SUMMED_ATTRS = ("payload_bytes", "prompt_tokens", "completion_tokens", "reasoning_tokens")
+
+METRIC_HELP = {
+    "case_pipeline_span_duration_seconds": "各阶段耗时（秒），按 span 名与结果分组",
+    "case_pipeline_ocr_payload_bytes_total": "实际发送给 OCR 接口的图片字节数",
+    "case_pipeline_llm_tokens_total": "AI 接口返回的 token 用量，按模型与类别（prompt/completion/reasoning）分组",
+}
+
+_current_span = contextvars.ContextVar("case_pipeline_span", default=None)
+_current_run = contextvars.ContextVar("case_pipeline_run", default=None)
+
+class Span:
+    def __init__(self, name, trace_id, parent_id, attrs):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.seconds = None
+        self.error = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+class RunTrace:
+    """一次运行（一个后台任务 / 一次 CasePipeline.run）内结束的全部 span，线程安全"""
+    def __init__(self, name):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.root_id = None
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def breakdown(self):
+        """
+        按 span 名汇总：{"name", "seconds": 整次运行耗时, "stages": [{"name", "count", "seconds", "max", "errors"}],
+        "totals": {SUMMED_ATTRS 中出现过的属性: 合计}}。stages 按首次开始的先后排列；并发的 span 耗时会重叠。
+        """
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        stages = {}
+        totals = {}
+        seconds = 0.0
+        for s in spans:
+            if s.span_id == self.root_id:
+                seconds = s.seconds
+                continue
+            stage = stages.setdefault(s.name, {"name": s.name, "count": 0, "seconds": 0.0, "max": 0.0, "errors": 0})
+            stage["count"] += 1
+            stage["seconds"] += s.seconds
+            stage["max"] = max(stage["max"], s.seconds)
+            stage["errors"] += s.error is not None
+            for attr in SUMMED_ATTRS:
+                if isinstance(s.attrs.get(attr), (int, float)):
+                    totals[attr] = totals.get(attr, 0) + s.attrs[attr]
+        return {"name": self.name, "seconds": seconds, "stages": list(stages.values()), "totals": totals}
+
+def _label_str(labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return ",".join(f'{key}="{escape(value)}"' for key, value in labels)
+
+class Tracer:
+    """
+    进程级指标注册表：span 耗时直方图 + 计数器，按 Prometheus 文本格式导出。
+    metrics_path 非空时每次运行（start_run，即一次生成任务或 CasePipeline.run）结束把全部指标原子地写入该文件，
+    供 node_exporter textfile 采集；零散的根 span 与 record_duration（如每次页面 rerun）不触发写文件。
+    """
+    def __init__(self):
+        self.metrics_path = ""
+        self._lock = threading.Lock()
+        self._histograms = {}  # (span, status) -> [各桶计数..., 总和, 总数]
+        self._counters = {}    # (指标名, ((标签, 值), ...)) -> 累计值
+
+    def observe(self, span):
+        key = (span.name, "error" if span.error else "ok")
+        with self._lock:
+            hist = self._histograms.setdefault(key, [0] * len(DURATION_BUCKETS) + [0.0, 0])
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if span.seconds <= bound:
+                    hist[i] += 1
+            hist[-2] += span.seconds
+            hist[-1] += 1
+
+    def add(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def render_prometheus(self):
+        with self._lock:
+            histograms = {key: list(hist) for key, hist in self._histograms.items()}
+            counters = dict(self._counters)
+        lines = []
+        name = "case_pipeline_span_duration_seconds"
+        lines += [f"# HELP {name} {METRIC_HELP[name]}", f"# TYPE {name} histogram"]
+        for (span_name, status), hist in sorted(histograms.items()):
+            labels = [("span", span_name), ("status", status)]
+            for bound, count in zip(DURATION_BUCKETS, hist):
+                lines.append(f"{name}_bucket{{{_label_str(labels + [('le', bound)])}}} {count}")
+            lines.append(f"{name}_bucket{{{_label_str(labels + [('le', '+Inf')])}}} {hist[-1]}")
+            lines.append(f"{name}_sum{{{_label_str(labels)}}} {hist[-2]:.6f}")
+            lines.append(f"{name}_count{{{_label_str(labels)}}} {hist[-1]}")
+        for counter in sorted({key[0] for key in counters}):
+            lines += [f"# HELP {counter} {METRIC_HELP.get(counter, counter)}", f"# TYPE {counter} counter"]
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == counter:
+                    lines.append(f"{metric}{{{_label_str(labels)}}} {value}" if labels else f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self):
+        if not self.metrics_path:
+            return
+        if os.path.dirname(self.metrics_path):
+            os.makedirs(os.path.dirname(self.metrics_path), exist_ok=True)
+        tmp_path = f"{self.metrics_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_path, self.metrics_path)
+
+    def finish(self, span):
+        span.seconds = time.perf_counter() - span.start
+        self.observe(span)
+        run = _current_run.get()
+        if run is not None:
+            run.add(span)
+        if logger.isEnabledFor(logging.INFO):
+            record = {"ts": round(time.time(), 3), "trace_id": span.trace_id, "span_id": span.span_id,
+                      "parent_id": span.parent_id, "name": span.name,
+                      "duration_ms": round(span.seconds * 1000, 3), "status": "error" if span.error else "ok"}
+            if span.error:
+                record["error"] = span.error
+            record.update(span.attrs)
+            logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+    def flush_metrics(self):
+        try:
+            self.write_metrics()
+        except OSError:
+            logger.warning("指标文件写入失败：%s", self.metrics_path, exc_info=True)
+
+TRACER = Tracer()
+
+@contextmanager
+def span(name, **attrs):
+    """计时一个阶段；块内抛出的异常记为 error（异常类型与消息）后原样向上抛"""
+    parent = _current_span.get()
+    run = _current_run.get()
+    trace_id = parent.trace_id if parent else run.trace_id if run else uuid.uuid4().hex
+    current = Span(name, trace_id, parent.span_id if parent else None, attrs)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        TRACER.finish(current)
+
+@contextmanager
+def start_run(name, **attrs):
+    """开始一次运行：块内（及继承了上下文的工作线程里）结束的 span 都归入返回的 RunTrace；运行结束时刷新指标文件"""
+    run = RunTrace(name)
+    token = _current_run.set(run)
+    try:
+        with span(name, **attrs) as root:
+            run.root_id = root.span_id
+            yield run
+    finally:
+        _current_run.reset(token)
+        TRACER.flush_metrics()
+
+def add_metric(name, value, **labels):
+    """累加计数器（Prometheus counter），如 OCR 上传字节数、AI token 用量"""
+    TRACER.add(name, value, **labels)
+
+def record_duration(name, seconds, **attrs):
+    """补记一段已测好的耗时（不便用 with 包住的代码，如 Streamlit 整页脚本的一次 rerun），与 span 一样计入指标与日志"""
+    run = _current_run.get()
+    current = Span(name, run.trace_id if run else uuid.uuid4().hex, None, attrs)
+    current.start = time.perf_counter() - seconds
+    TRACER.finish(current)
+
+def _metrics_server_class():
+    """/metrics 抓取端点；http.server 只在配置了 METRICS_PORT 时才导入"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = TRACER.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # 抓取请求很频繁，不写访问日志
+
+    return ThreadingHTTPServer, MetricsHandler
+
+_metrics_server = None
+_configure_lock = threading.Lock()
+
+def configure_tracing(log_path="", metrics_path="", metrics_port=0, metrics_host="127.0.0.1"):
+    """
+    按配置打开导出：log_path 为 JSON 日志文件（"-" 表示标准错误输出），metrics_path 为 Prometheus 文本格式文件，
+    metrics_port 非 0 时在 metrics_host 的该端口起 /metrics 抓取端点（进程内只起一次）。
+    默认只监听本机，Prometheus 在别的机器上抓取时才需要把 metrics_host 显式配成对外地址。
+    都不配置时 span 只计入内存指标与运行分解。
+    """
+    global _metrics_server
+    with _configure_lock:
+        TRACER.metrics_path = metrics_path
+        if log_path and not any(getattr(h, "_trace_target", None) == log_path for h in logger.handlers):
+            handler = logging.StreamHandler() if log_path == "-" else logging.FileHandler(log_path, encoding="utf-8")
+            handler._trace_target = log_path
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+        if metrics_port and _metrics_server is None:
+            server_class, handler_class = _metrics_server_class()
+            _metrics_server = server_class((metrics_host, int(metrics_port)), handler_class)
+            threading.Thread(target=_metrics_server.serve_forever, name="metrics", daemon=True).start()